@@ -1,29 +1,113 @@
+import time
+_import_started = time.perf_counter()
+
 import structlog
 from utils.http_handler import handle_http_request
 from utils.websocket_handler import handle_websocket_connection
+from utils.turn_worker import handle_turn_jobs
+from utils.session_purge import purge_sessions
 import utils.prompt_helper as prompt_helper
+from utils import lazy
+from utils.dynamodb_calls import counter as dynamodb_calls
+from utils.metrics import metrics
 
 
 import boto3
 
-# Initialize LLM client
+# Shared LLM client, built on first use; most routes never touch it
 llm_client = prompt_helper.setup_llm()
 # Initialize DynamoDB resource
 session = boto3.Session()
 dynamodb = session.resource('dynamodb')
+dynamodb_calls.instrument(dynamodb.meta.client)
 
 # Initialize structlog
 logger = structlog.get_logger(__name__)
 
+module_import_seconds = time.perf_counter() - _import_started
+cold_start = True
+
 
 def lambda_handler(event, context):
+    global cold_start
     structlog.contextvars.clear_contextvars()
+    dynamodb_calls.reset()
+    metrics.reset()
     logger.info("Lambda function invoked", requestevent=event)
     session_table = dynamodb.Table('dd-infra-sessions')
     connection_table = dynamodb.Table('dd-infra-connections')
+    turn_table = dynamodb.Table('dd-infra-turns')
 
+    route = get_route(event)
+    loaded_before = lazy.load_times()
+    started = time.perf_counter()
+    try:
         # Get HTTP method and session ID
+        if 'httpMethod' in event:
+            return handle_http_request(event, session_table, connection_table, turn_table, llm_client)
+        else:
+            return handle_websocket_connection(event, session_table, connection_table, turn_table, llm_client)
+    finally:
+        lazy_loads = {
+            name: seconds for name, seconds in lazy.load_times().items()
+            if name not in loaded_before
+        }
+        logger.info(
+            "Lambda function completed",
+            route=route,
+            cold_start=cold_start,
+            module_import_seconds=module_import_seconds if cold_start else 0.0,
+            lazy_loads=lazy_loads,
+            dynamodb_calls=dynamodb_calls.snapshot(),
+            duration=time.perf_counter() - started
+        )
+        metrics.record('invocation', time.perf_counter() - started)
+        metrics.emit(Route=route or 'unknown')
+        cold_start = False
+
+
+def turn_worker_handler(event, context):
+    structlog.contextvars.clear_contextvars()
+    dynamodb_calls.reset()
+    metrics.reset()
+    session_table = dynamodb.Table('dd-infra-sessions')
+    connection_table = dynamodb.Table('dd-infra-connections')
+    turn_table = dynamodb.Table('dd-infra-turns')
+    logger.info("Turn worker invoked", jobs=len(event.get('Records', [])))
+    started = time.perf_counter()
+    try:
+        return handle_turn_jobs(event, session_table, connection_table, turn_table, llm_client)
+    finally:
+        logger.info("Turn worker completed", dynamodb_calls=dynamodb_calls.snapshot())
+        metrics.record('invocation', time.perf_counter() - started)
+        metrics.emit(Route='turn_worker')
+
+
+def purge_handler(event, context):
+    """
+    Bulk-deletes sessions. The event names them with a list of `session_ids`,
+    or gives an `expired_before` epoch time to purge every session that
+    expired before it.
+    """
+    structlog.contextvars.clear_contextvars()
+    dynamodb_calls.reset()
+    metrics.reset()
+    logger.info("Purge invoked", requestevent=event)
+    try:
+        return purge_sessions(
+            session_table=dynamodb.Table('dd-infra-sessions'),
+            connection_table=dynamodb.Table('dd-infra-connections'),
+            turn_table=dynamodb.Table('dd-infra-turns'),
+            llm_client=llm_client,
+            session_ids=event.get('session_ids'),
+            expired_before=event.get('expired_before')
+        )
+    finally:
+        logger.info("Purge completed", dynamodb_calls=dynamodb_calls.snapshot())
+        metrics.emit(Route='purge')
+
+
+def get_route(event):
     if 'httpMethod' in event:
-        return handle_http_request(event, session_table, connection_table, llm_client)
-    else:
-        return handle_websocket_connection(event, session_table, connection_table, llm_client)
+        return event['httpMethod']
+    return event.get('requestContext', {}).get('routeKey')
@@ -0,0 +1,83 @@
+"""
+Compares payload size and encode time of GET /{id} responses for different
+content encodings on realistically sized session histories.
+
+Run from lambda/src:
+
+    python -m tests.benchmarks.bench_compression
+"""
+import gzip
+import json
+import random
+import re
+import timeit
+
+from utils.http_handler import brotli
+from utils.prompt_helper import assistant_instructions
+
+# DM replies in live sessions are a few paragraphs of prose in the style of
+# the assistant instructions, so replies are assembled from their sentences.
+DM_SENTENCES = [
+    sentence.strip() + '.'
+    for sentence in re.split(r'[.!?]\s', ' '.join(assistant_instructions.split()))
+    if len(sentence.split()) > 4
+]
+PLAYER_ACTIONS = [
+    "I cast a fireball at the shadowy figures.",
+    "I charge at the idol with my sword raised.",
+    "I search the clearing for tracks or hidden traps.",
+    "I ask Lila what she knows about the idol's origins.",
+    "I try to sneak around the chanting figures.",
+]
+BIO = (
+    "A reclusive wizard, shunned by society due to the dark nature of his magical studies. "
+    "His once-bright robes are now tattered and stained from countless forbidden experiments.\n\n"
+    "Role: Spellcaster & Damage Dealer\n\nCombat Abilities:\n- Magic Missile\n- Shield\n- Fireball"
+)
+
+
+def build_session_body(turns, seed=0):
+    rng = random.Random(seed)
+    chat_history = []
+    for turn in range(turns // 2):
+        chat_history.append({'role': 'user', 'content': f"Seth: {rng.choice(PLAYER_ACTIONS)}"})
+        reply = '\n\n'.join(
+            ' '.join(rng.sample(DM_SENTENCES, k=rng.randint(2, 4)))
+            for _ in range(rng.randint(2, 4))
+        )
+        reply = f"{rng.choice(['Seth', 'Hank'])} rolls a {rng.randint(1, 20)}.\n\n{reply}"
+        chat_history.append({'role': 'Dungeon Master', 'content': reply})
+    return json.dumps({
+        'users': [{'name': 'Seth', 'role': 'Wizard'}, {'name': 'Hank', 'role': 'Warrior'}],
+        'chat_history': chat_history,
+        'user_bios': {'Seth': BIO, 'Hank': BIO},
+        'last_turn': turns,
+        'has_more': False,
+    }).encode('utf-8')
+
+
+def encoders():
+    yield 'gzip-1', lambda data: gzip.compress(data, compresslevel=1)
+    yield 'gzip-6', lambda data: gzip.compress(data, compresslevel=6)
+    yield 'gzip-9', lambda data: gzip.compress(data, compresslevel=9)
+    if brotli is not None:
+        yield 'br-5', lambda data: brotli.compress(data, quality=5)
+        yield 'br-11', lambda data: brotli.compress(data, quality=11)
+
+
+def main():
+    print(f"{'turns':>6} {'encoding':>9} {'bytes':>9} {'ratio':>7} {'encode ms':>10}")
+    for turns in (20, 200, 1000):
+        data = build_session_body(turns)
+        print(f"{turns:>6} {'identity':>9} {len(data):>9} {1.0:>7.2f} {0.0:>10.3f}")
+        for name, encode in encoders():
+            runs = 20
+            seconds = timeit.timeit(lambda: encode(data), number=runs) / runs
+            size = len(encode(data))
+            print(f"{turns:>6} {name:>9} {size:>9} {len(data) / size:>7.2f} {seconds * 1000:>10.3f}")
+    if brotli is None:
+        print("brotli is not installed; only gzip was measured")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Compares time-to-first-token of the Assistants thread engine and the Chat
+Completions engine on the same session history.
+
+Both engines are given the same synthetic history: the thread gets it as
+messages, the chat engine as turns. Each run sends the same action and times
+from the start of the turn to the first frame handed to the connections. For
+the thread engine that includes `threads.messages.create`.
+
+Needs a real OpenAI key and makes paid API calls. Run from lambda/src:
+
+    OPENAI_API_KEY=... python -m tests.benchmarks.bench_ttft [turns] [runs]
+"""
+import json
+import statistics
+import sys
+import time
+
+from openai import OpenAI
+
+import utils.chat_engine as chat_engine
+import utils.prompt_helper as prompt_helper
+from tests.benchmarks.bench_compression import build_session_body
+
+ACTION = {'user': 'Seth', 'msg': 'I cast a fireball at the shadowy figures.'}
+
+
+class FirstFrameTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_frame_at = None
+
+    def __call__(self, message):
+        if self.first_frame_at is None:
+            self.first_frame_at = time.perf_counter()
+
+    @property
+    def ttft(self):
+        return self.first_frame_at - self.started
+
+
+def build_turns(turn_count):
+    chat_history = json.loads(build_session_body(turn_count))['chat_history']
+    turns = []
+    for turn, entry in enumerate(chat_history, start=1):
+        if entry['role'] == 'user':
+            user, msg = entry['content'].split(': ', 1)
+        else:
+            user, msg = 'Dungeon Master', entry['content']
+        turns.append({'turn': turn, 'user': user, 'msg': msg})
+    return turns
+
+
+def seed_thread(llm_client, turns):
+    thread = llm_client.beta.threads.create()
+    for turn in turns:
+        role = 'assistant' if turn['user'] == 'Dungeon Master' else 'user'
+        content = turn['msg'] if role == 'assistant' else json.dumps({'user': turn['user'], 'msg': turn['msg']})
+        llm_client.beta.threads.messages.create(thread_id=thread.id, role=role, content=content)
+    return thread.id
+
+
+def time_thread_engine(llm_client, thread_id):
+    timer = FirstFrameTimer()
+    prompt_helper.process_action(llm_client, thread_id, ACTION, timer)
+    return timer.ttft
+
+
+def time_chat_engine(llm_client, turns):
+    timer = FirstFrameTimer()
+    chat_engine.process_action(llm_client, {}, turns, ACTION, timer)
+    return timer.ttft
+
+
+def summarize(name, samples):
+    samples = sorted(samples)
+    p90 = samples[min(len(samples) - 1, int(len(samples) * 0.9))]
+    print(f"{name:>10} {statistics.median(samples) * 1000:>10.0f} {p90 * 1000:>10.0f} {len(samples):>5}")
+
+
+def main():
+    turn_count = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    llm_client = OpenAI()
+    turns = build_turns(turn_count)
+
+    thread_samples = []
+    chat_samples = []
+    for _ in range(runs):
+        # A fresh thread each run, so earlier runs don't lengthen the history
+        thread_id = seed_thread(llm_client, turns)
+        try:
+            thread_samples.append(time_thread_engine(llm_client, thread_id))
+        finally:
+            llm_client.beta.threads.delete(thread_id)
+        chat_samples.append(time_chat_engine(llm_client, turns))
+
+    print(f"{len(turns)} turns of history, {runs} runs")
+    print(f"{'engine':>10} {'p50 ms':>10} {'p90 ms':>10} {'runs':>5}")
+    summarize('thread', thread_samples)
+    summarize('chat', chat_samples)
+
+
+if __name__ == '__main__':
+    main()
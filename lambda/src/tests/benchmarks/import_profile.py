@@ -0,0 +1,58 @@
+"""
+Summarizes `python -X importtime` for the handler cold start of each route.
+
+Every route pays for importing `handler`; routes that reach the LLM also pay
+for the modules loaded lazily on first use. Each route is profiled in a fresh
+interpreter so nothing is shared between them.
+
+Run from lambda/src:
+
+    python -m tests.benchmarks.import_profile
+"""
+import os
+import subprocess
+import sys
+
+# Modules each route loads lazily on top of `import handler`
+ROUTE_LAZY_IMPORTS = {
+    '$connect': [],
+    '$disconnect': [],
+    'GET': [],
+    'DELETE': ['openai'],
+    'POST': ['openai', 'utils.event_handler'],
+    'sendmessage': ['openai', 'utils.event_handler'],
+}
+TOP_N = 5
+
+
+def profile(modules):
+    code = '; '.join(['import handler'] + [f'import {module}' for module in modules])
+    env = os.environ | {'AWS_DEFAULT_REGION': os.getenv('AWS_DEFAULT_REGION', 'us-west-1')}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True, text=True, env=env, check=True
+    )
+    top_level = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # Top-level imports are not indented beyond the single separating space
+        if not name.startswith('  '):
+            top_level.append((int(cumulative) / 1000, name.strip()))
+    return top_level
+
+
+def main():
+    print(f"{'route':<12} {'total ms':>9}  heaviest top-level imports")
+    for route, modules in ROUTE_LAZY_IMPORTS.items():
+        top_level = profile(modules)
+        total = sum(ms for ms, _ in top_level)
+        heaviest = ', '.join(
+            f"{name} {ms:.0f}" for ms, name in sorted(top_level, reverse=True)[:TOP_N]
+        )
+        print(f"{route:<12} {total:>9.1f}  {heaviest}")
+
+
+if __name__ == '__main__':
+    main()
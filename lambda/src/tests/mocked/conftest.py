@@ -0,0 +1,10 @@
+import pytest
+
+from utils.connection_registry import registry as connection_registry
+
+
+@pytest.fixture(autouse=True)
+def clear_connection_registry():
+    connection_registry.clear()
+    yield
+    connection_registry.clear()
@@ -0,0 +1,307 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+from botocore.exceptions import EndpointConnectionError
+
+import utils.session_manager as session_manager
+import utils.prompt_helper as prompt_helper
+from utils.event_handler import AsyncEventHandler
+from utils import async_runtime
+from utils.session_unit_of_work import AsyncSessionUnitOfWork
+from utils.connection_registry import registry as connection_registry
+
+
+class GoneException(Exception):
+    pass
+
+
+class FakeManagementClient:
+    exceptions = SimpleNamespace(GoneException=GoneException)
+
+    def __init__(self, gone=(), unreachable=()):
+        self.posts = []
+        self.gone = set(gone)
+        self.unreachable = set(unreachable)
+
+    async def post_to_connection(self, Data, ConnectionId):
+        if ConnectionId in self.gone:
+            raise GoneException(ConnectionId)
+        if ConnectionId in self.unreachable:
+            raise EndpointConnectionError(endpoint_url='https://example.execute-api.us-east-1.amazonaws.com')
+        await asyncio.sleep(0)
+        self.posts.append((ConnectionId, Data.decode('utf-8')))
+
+
+class FakeTable:
+    def __init__(self, name='table', item=None):
+        self.name = name
+        self.item = item
+        self.items = []
+        self.updates = []
+        self.batches = []
+        self.transactions = []
+
+        async def transact_write_items(TransactItems):
+            self.transactions.append(TransactItems)
+        self.meta = SimpleNamespace(client=SimpleNamespace(transact_write_items=transact_write_items))
+
+    async def update_item(self, **kwargs):
+        self.updates.append(kwargs)
+        if kwargs.get('ReturnValues') == 'ALL_NEW':
+            return {'Attributes': dict(self.item)}
+        return {}
+
+    async def put_item(self, Item):
+        self.items.append(Item)
+
+    @asynccontextmanager
+    async def batch_writer(self):
+        batch = SimpleNamespace(items=[])
+
+        async def put_item(Item):
+            batch.items.append(Item)
+        batch.put_item = put_item
+        yield batch
+        self.batches.append(batch.items)
+
+    async def query(self, **kwargs):
+        return {'Items': [{'connection_id': 'conn-a'}, {'connection_id': 'conn-b'}]}
+
+
+class FakeAsyncRuns:
+    def __init__(self, deltas, final_text):
+        self.deltas = deltas
+        self.final_text = final_text
+
+    @asynccontextmanager
+    async def stream(self, thread_id, assistant_id, event_handler, **kwargs):
+        for delta in self.deltas:
+            await event_handler.on_text_delta(SimpleNamespace(value=delta), None)
+        message = SimpleNamespace(content=[SimpleNamespace(type='text', text=SimpleNamespace(value=self.final_text))])
+        await event_handler.on_message_done(message)
+
+        async def until_done():
+            return None
+        yield SimpleNamespace(until_done=until_done)
+
+
+class FakeLLMProvider:
+    def __init__(self, runs):
+        async def create(**kwargs):
+            return None
+        self.async_client = SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(
+            runs=runs,
+            messages=SimpleNamespace(create=create),
+        )))
+
+    def get_async(self):
+        return self.async_client
+
+
+def unit_of_work(session_table=None, turn_table=None):
+    unit_of_work = AsyncSessionUnitOfWork(session_table or FakeTable(), turn_table or FakeTable(), 'test-session-id')
+    unit_of_work.session = {'session_id': 'test-session-id', 'thread_id': 'thread', 'turn_count': 4, 'expiration_time': 100}
+    return unit_of_work
+
+
+@pytest.mark.asyncio
+async def test_run_turn_async_streams_and_stages_turns():
+    turns = unit_of_work()
+    replay_table = FakeTable()
+    management_client = FakeManagementClient()
+    llm_client = FakeLLMProvider(FakeAsyncRuns(['Seth', ' rolls a 3.'], 'Seth rolls a 3.'))
+
+    response = await session_manager.run_turn_async(
+        unit_of_work=turns,
+        llm_client=llm_client,
+        message={'user': 'Seth', 'msg': 'I cast a fireball.'},
+        connection_table=FakeTable(),
+        replay_table=replay_table,
+        connection_id='conn-a',
+        api_gateway_management_client=management_client
+    )
+
+    assert json.loads(response['body']) == 'Seth rolls a 3.'
+    [_, *puts] = turns.transact_items(turns.update_request())
+    assert [(put['Put']['Item']['turn'], put['Put']['Item']['user']) for put in puts] == [(5, 'Seth'), (6, 'Dungeon Master')]
+    for connection_id in ('conn-a', 'conn-b'):
+        frames = [json.loads(data) for conn, data in management_client.posts if conn == connection_id]
+        assert [(frame['turn'], frame['seq']) for frame in frames] == [(5, seq) for seq in range(len(frames))]
+        assert frames[0]['text'] == "\n\n Seth: I cast a fireball. \n\n"
+        assert ''.join(frame['text'] for frame in frames[1:]) == 'Seth rolls a 3.'
+    # The replay buffer is saved to its own table, never on the session
+    [replay] = replay_table.items
+    assert (replay['session_id'], replay['turn'], replay['complete']) == ('test-session-id', 5, True)
+    assert replay['next_seq'] == len(frames)
+    assert 'frames' not in turns.update_request()['ExpressionAttributeNames'].values()
+
+
+@pytest.fixture
+def async_tables(monkeypatch):
+    tables = {
+        'dd-infra-sessions': FakeTable(name='dd-infra-sessions', item={
+            'session_id': 'test-session-id', 'thread_id': 'thread', 'turn_count': 4, 'expiration_time': 100,
+            'lease_owner': 'conn-a:owner', 'lease_expires_at': 200,
+        }),
+    }
+    management_client = FakeManagementClient()
+
+    async def get_table(name):
+        return tables.setdefault(name, FakeTable(name=name))
+
+    async def get_client(service_name, endpoint_url=None):
+        return management_client
+    monkeypatch.setattr(async_runtime, 'get_table', get_table)
+    monkeypatch.setattr(async_runtime, 'get_client', get_client)
+    connection_registry.invalidate('test-session-id')
+    return tables
+
+
+def add_entry_async(llm_client):
+    return session_manager.add_entry_async(
+        session_table=SimpleNamespace(name='dd-infra-sessions'),
+        llm_client=llm_client,
+        session_id='test-session-id',
+        message={'user': 'Seth', 'msg': 'I cast a fireball.'},
+        connection_table=SimpleNamespace(name='dd-infra-connections'),
+        turn_table=SimpleNamespace(name='dd-infra-turns'),
+        connection_id='conn-a',
+        api_gateway_management_client=SimpleNamespace(meta=SimpleNamespace(endpoint_url='https://example.com'))
+    )
+
+
+@pytest.mark.asyncio
+async def test_add_entry_async_commits_turns_and_version_together(async_tables):
+    session_table = async_tables['dd-infra-sessions']
+
+    response = await add_entry_async(FakeLLMProvider(FakeAsyncRuns(['Seth', ' rolls a 3.'], 'Seth rolls a 3.')))
+
+    assert json.loads(response['body']) == 'Seth rolls a 3.'
+    # The session is read from the lease write; the turns land with the version bump
+    [lease] = session_table.updates
+    assert lease['ReturnValues'] == 'ALL_NEW'
+    [[update, *puts]] = session_table.transactions
+    assert {'version', 'turn_count', 'lease_owner'} <= set(update['Update']['ExpressionAttributeNames'].values())
+    assert update['Update']['ConditionExpression'].startswith('(turn_count = :read_turn_count)')
+    assert [put['Put']['Item']['turn'] for put in puts] == [5, 6]
+
+
+@pytest.mark.asyncio
+async def test_failed_async_turn_only_releases_the_lease(monkeypatch, async_tables):
+    session_table = async_tables['dd-infra-sessions']
+
+    async def process_action_async(**kwargs):
+        raise RuntimeError("model unavailable")
+    monkeypatch.setattr(prompt_helper, 'process_action_async', process_action_async)
+
+    response = await add_entry_async(FakeLLMProvider(FakeAsyncRuns([], '')))
+
+    assert 'error' in json.loads(response['body'])
+    assert session_table.transactions == []
+    assert [update['UpdateExpression'] for update in session_table.updates] == [
+        'SET lease_owner = :owner, lease_expires_at = :expires_at',
+        'REMOVE lease_owner, lease_expires_at',
+    ]
+
+
+def run_turn(management_client, deltas, final_text):
+    return session_manager.run_turn_async(
+        unit_of_work=unit_of_work(),
+        llm_client=FakeLLMProvider(FakeAsyncRuns(deltas, final_text)),
+        message={'user': 'Seth', 'msg': 'I cast a fireball.'},
+        connection_table=FakeTable(),
+        connection_id='conn-a',
+        api_gateway_management_client=management_client
+    )
+
+
+@pytest.mark.asyncio
+async def test_unreachable_connection_does_not_stop_the_turn():
+    connection_registry.invalidate('test-session-id')
+    management_client = FakeManagementClient(unreachable=['conn-b'])
+
+    response = await asyncio.wait_for(run_turn(management_client, ['Seth', ' rolls a 3.'], 'Seth rolls a 3.'), 2)
+
+    assert json.loads(response['body']) == 'Seth rolls a 3.'
+    assert {conn for conn, _ in management_client.posts} == {'conn-a'}
+
+
+@pytest.mark.asyncio
+async def test_failed_fan_out_stops_the_run(monkeypatch):
+    connection_registry.invalidate('test-session-id')
+
+    async def consume(self, frames):
+        await frames.get()
+        raise RuntimeError("fan-out failed")
+    monkeypatch.setattr(session_manager.AsyncStreamToConnections, 'consume', consume)
+    monkeypatch.setattr(session_manager, 'PIPELINE_QUEUE_SIZE', 1)
+    deltas = [f'{n}.' for n in range(20)]
+
+    turn = asyncio.create_task(run_turn(FakeManagementClient(), deltas, ''.join(deltas)))
+    # Unlike wait_for, wait doesn't cancel the turn, which couldn't finish if it hung
+    done, _ = await asyncio.wait((turn,), timeout=2)
+
+    assert done, "the run blocked on the frame queue"
+    with pytest.raises(RuntimeError, match="fan-out failed"):
+        turn.result()
+
+
+@pytest.mark.asyncio
+async def test_async_stream_to_connections_removes_gone_connections():
+    connection_registry.put('test-session-id', ['conn-a', 'conn-gone'])
+    connection_table = FakeTable()
+    stream_to_connections = session_manager.AsyncStreamToConnections(
+        api_gateway_management_client=FakeManagementClient(gone=['conn-gone']),
+        session_id='test-session-id',
+        connection_id='conn-a',
+        connection_table=connection_table
+    )
+    await stream_to_connections.get_connection_ids(connection_table, 'test-session-id')
+
+    await stream_to_connections('hello')
+
+    assert stream_to_connections.connection_ids == ['conn-a']
+    assert connection_registry.get('test-session-id') == ['conn-a']
+    assert connection_table.batches == []
+
+    await stream_to_connections.expire_stale_connections()
+
+    assert [[item['connection_id'] for item in batch] for batch in connection_table.batches] == [['conn-gone']]
+
+
+@pytest.mark.asyncio
+async def test_async_handler_flushes_buffered_text_while_the_model_pauses():
+    frames = asyncio.Queue()
+    event_handler = AsyncEventHandler(frames)
+    event_handler.buffer.flush_interval = 0.05
+    event_handler.buffer.flush_on_sentence = False
+
+    await event_handler.on_text_delta(SimpleNamespace(value='The orc'), None)
+    await event_handler.on_text_delta(SimpleNamespace(value=' falls'), None)
+
+    assert await asyncio.wait_for(frames.get(), 1) == 'The orc'
+    assert await asyncio.wait_for(frames.get(), 1) == ' falls'
+    await event_handler.close()
+    assert frames.empty()
+
+
+@pytest.mark.asyncio
+async def test_process_action_async_queues_coalesced_frames():
+    frames = asyncio.Queue()
+    llm_client = FakeLLMProvider(FakeAsyncRuns(['The orc', ' falls.'], 'The orc falls.'))
+
+    reply = await prompt_helper.process_action_async(
+        llm_client=llm_client,
+        thread_id='thread',
+        user_action={'user': 'Seth', 'msg': 'I swing.'},
+        frames=frames
+    )
+
+    queued = []
+    while not frames.empty():
+        queued.append(frames.get_nowait())
+    assert reply == 'The orc falls.'
+    assert ''.join(queued) == 'The orc falls.'
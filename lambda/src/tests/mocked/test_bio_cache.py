@@ -0,0 +1,83 @@
+import time
+
+from botocore.exceptions import ClientError
+
+from utils.bio_cache import BioCache, cache_key
+
+
+class FakeCacheTable:
+    def __init__(self, items=None, fail=False):
+        self.items = dict(items or {})
+        self.fail = fail
+        self.reads = 0
+
+    def get_item(self, Key):
+        self.reads += 1
+        if self.fail:
+            raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'GetItem')
+        item = self.items.get(Key['cache_key'])
+        return {'Item': item} if item else {}
+
+    def put_item(self, Item):
+        if self.fail:
+            raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'PutItem')
+        self.items[Item['cache_key']] = Item
+
+
+SETH = {'name': 'Seth', 'role': 'Wizard'}
+
+
+def test_key_normalizes_name_and_role():
+    assert cache_key({'name': '  seth ', 'role': 'WIZARD'}, 'v1') == cache_key(SETH, 'v1')
+    assert cache_key(SETH, 'v1') != cache_key(SETH, 'v2')
+
+
+def test_put_then_get_hits_lru_without_reading_table():
+    table = FakeCacheTable()
+    cache = BioCache(table=table, version='v1')
+
+    cache.put(SETH, 'Seth', 'Seth the Wizard')
+
+    assert cache.get({'name': 'seth', 'role': 'wizard'}) == ('Seth', 'Seth the Wizard')
+    assert table.reads == 0
+    assert cache.stats()['lru_hits'] == 1
+
+
+def test_table_tier_is_shared_between_containers():
+    table = FakeCacheTable()
+    BioCache(table=table, version='v1').put(SETH, 'Seth', 'Seth the Wizard')
+    other_container = BioCache(table=table, version='v1')
+
+    assert other_container.get(SETH) == ('Seth', 'Seth the Wizard')
+    assert other_container.get(SETH) == ('Seth', 'Seth the Wizard')
+    assert other_container.stats()['table_hits'] == 1
+    assert other_container.stats()['lru_hits'] == 1
+
+
+def test_expired_table_items_miss():
+    key = cache_key(SETH, 'v1')
+    table = FakeCacheTable({key: {'cache_key': key, 'character': 'Seth', 'bio': 'old', 'expiration_time': int(time.time()) - 1}})
+
+    assert BioCache(table=table, version='v1').get(SETH) is None
+
+
+def test_lru_evicts_least_recently_used():
+    cache = BioCache(table=FakeCacheTable(fail=True), version='v1', max_size=2)
+    cache.put({'name': 'A'}, 'A', 'a')
+    cache.put({'name': 'B'}, 'B', 'b')
+    cache.get({'name': 'A'})
+    cache.put({'name': 'C'}, 'C', 'c')
+
+    assert cache.get({'name': 'B'}) is None
+    assert cache.get({'name': 'A'}) == ('A', 'a')
+
+
+def test_lookup_and_store_match_bios_back_to_users():
+    cache = BioCache(table=FakeCacheTable(), version='v1')
+    ana = {'name': 'Ana', 'role': 'Rogue'}
+    cache.store([SETH, ana], {'Seth': 'Seth the Wizard'})
+
+    bios, missed = cache.lookup([SETH, ana])
+
+    assert bios == {'Seth': 'Seth the Wizard'}
+    assert missed == [ana]
@@ -0,0 +1,46 @@
+import utils.prompt_helper as prompt_helper
+from utils.bio_parser import BioStreamParser
+
+BIOS_TEXT = """_____________________
+Seth the Wizard
+A scholar of the arcane.
+=====================
+
+_____________________
+Ana the Rogue
+Quick with a blade.
+=====================
+"""
+
+
+def test_parser_emits_each_bio_as_its_delimiter_arrives():
+    emitted = []
+    parser = BioStreamParser(on_bio=lambda character, bio: emitted.append(character))
+
+    seth_end = BIOS_TEXT.index('=====================') + len('=====================\n')
+    for i in range(seth_end):
+        parser.feed(BIOS_TEXT[i])
+    assert emitted == ['Seth']
+
+    for i in range(seth_end, len(BIOS_TEXT)):
+        parser.feed(BIOS_TEXT[i])
+    assert emitted == ['Seth', 'Ana']
+
+
+def test_parser_matches_split_user_bios():
+    parser = BioStreamParser()
+    for chunk in (BIOS_TEXT[:17], BIOS_TEXT[17:60], BIOS_TEXT[60:]):
+        parser.feed(chunk)
+
+    assert parser.close() == prompt_helper.split_user_bios(BIOS_TEXT)
+    assert parser.bios['Seth'] == 'Seth the Wizard\nA scholar of the arcane.'
+
+
+def test_parser_emits_unterminated_bio_on_close():
+    emitted = []
+    parser = BioStreamParser(on_bio=lambda character, bio: emitted.append((character, bio)))
+    parser.feed("_____________________\nBram the Bard^\nSings")
+
+    assert emitted == []
+    parser.close()
+    assert emitted == [('Bram', 'Bram the Bard\nSings')]
@@ -0,0 +1,129 @@
+from types import SimpleNamespace
+
+import utils.chat_engine as chat_engine
+import utils.session_operations as session_operations
+from utils.prompt_helper import assistant_instructions
+
+
+def make_turns(count, words=40):
+    return [
+        {
+            'turn': turn,
+            'user': 'Dungeon Master' if turn % 2 == 0 else 'Seth',
+            'msg': f"turn {turn} " + 'word ' * words,
+        }
+        for turn in range(1, count + 1)
+    ]
+
+
+def chunk(content=None, usage=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=content))] if content is not None else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+class FakeChatCompletions:
+    def __init__(self, deltas=(), summary='A summary.'):
+        self.deltas = deltas
+        self.summary = summary
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if kwargs.get('stream'):
+            return iter([chunk(delta) for delta in self.deltas] + [chunk(usage=SimpleNamespace(model_dump=lambda: {}))])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.summary))])
+
+
+def test_build_messages_puts_static_instructions_first():
+    session = {'user_bios': {'Seth': 'Seth the wizard'}, 'story_summary': 'They met Lila.'}
+
+    messages, older = chat_engine.build_messages(session, make_turns(2), {'user': 'Seth', 'msg': 'I look around.'})
+
+    assert messages[0] == {'role': 'system', 'content': assistant_instructions}
+    assert 'Seth the wizard' in messages[1]['content']
+    assert 'They met Lila.' in messages[2]['content']
+    assert [m['role'] for m in messages[3:]] == ['user', 'assistant', 'user']
+    assert older == []
+
+
+def test_build_messages_keeps_recent_turns_within_budget():
+    turns = make_turns(20)
+    per_turn = chat_engine.count_tokens(turns[0]['msg']) + chat_engine.MESSAGE_OVERHEAD_TOKENS
+
+    messages, older = chat_engine.build_messages({}, turns, {'user': 'Seth', 'msg': 'Hi'}, budget=per_turn * 5 + 20)
+
+    window = messages[1:-1]
+    assert len(window) == 5
+    assert window[-1]['content'] == turns[-1]['msg']
+    assert older == turns[:15]
+
+
+def test_unsummarized_turns_skips_already_summarized():
+    turns = make_turns(6)
+
+    assert chat_engine.unsummarized_turns({'summary_through': 4}, turns) == turns[4:]
+    assert chat_engine.unsummarized_turns({}, turns) == turns
+
+
+def test_process_action_streams_reply():
+    frames = []
+    completions = FakeChatCompletions(deltas=['Seth rolls', ' a 12.'])
+    llm_client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    reply, unsummarized = chat_engine.process_action(
+        llm_client, {}, make_turns(2), {'user': 'Seth', 'msg': 'I jump.'}, frames.append
+    )
+
+    assert reply == 'Seth rolls a 12.'
+    assert ''.join(frames) == 'Seth rolls a 12.'
+    assert unsummarized == []
+    assert completions.calls[0]['stream_options'] == {'include_usage': True}
+
+
+def test_summary_waits_for_a_batch_of_turns(monkeypatch):
+    monkeypatch.setattr(chat_engine, 'SUMMARY_BATCH_TURNS', 3)
+    monkeypatch.setattr(chat_engine, 'SUMMARY_BATCH_TOKENS', 10_000)
+    completions = FakeChatCompletions(deltas=['Seth rolls', ' a 12.'])
+    llm_client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    monkeypatch.setattr(
+        chat_engine, 'build_messages',
+        lambda session, turns, user_action: ([], turns[:2])
+    )
+
+    _, unsummarized = chat_engine.process_action(
+        llm_client, {}, make_turns(4), {'user': 'Seth', 'msg': 'I jump.'}, lambda message: None
+    )
+
+    assert unsummarized == []
+    assert not chat_engine.summary_due([])
+    assert chat_engine.summary_due(make_turns(3))
+    monkeypatch.setattr(chat_engine, 'SUMMARY_BATCH_TOKENS', 1)
+    assert chat_engine.summary_due(make_turns(1))
+
+
+def test_add_message_to_session_summarizes_turns_outside_window(monkeypatch):
+    updates = []
+    turns = make_turns(4)
+    completions = FakeChatCompletions(deltas=['The orc falls.'], summary='Seth fought an orc.')
+    llm_client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    monkeypatch.setattr(chat_engine, 'DM_ENGINE', 'chat')
+    monkeypatch.setattr(chat_engine, 'SUMMARY_BATCH_TURNS', 2)
+    monkeypatch.setattr(session_operations, 'get_recent_turns', lambda turn_table, session_id, limit: turns)
+    monkeypatch.setattr(session_operations, 'append_turns', lambda **kwargs: 5)
+    monkeypatch.setattr(
+        chat_engine, 'build_messages',
+        lambda session, turns, user_action: ([], turns[:2])
+    )
+    session_table = SimpleNamespace(update_item=lambda **kwargs: updates.append(kwargs))
+
+    reply = session_operations.add_message_to_session(
+        session_table=session_table,
+        turn_table=None,
+        llm_client=llm_client,
+        body={'user': 'Seth', 'msg': 'I swing.'},
+        session={'session_id': 'test-session-id', 'thread_id': 'thread'},
+        stream_to_connections=lambda message: None
+    )
+
+    assert reply == 'The orc falls.'
+    assert updates[0]['ExpressionAttributeValues'] == {':summary': 'Seth fought an orc.', ':through': 2}
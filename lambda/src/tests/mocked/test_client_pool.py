@@ -0,0 +1,26 @@
+import pytest
+
+import utils.client_pool as client_pool
+
+
+@pytest.fixture(autouse=True)
+def clear_pool():
+    client_pool.clear()
+    yield
+    client_pool.clear()
+
+
+def test_clients_are_reused_per_endpoint(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-west-1')
+    first = client_pool.get_management_client('https://example.com/dev')
+    second = client_pool.get_management_client('https://example.com/dev')
+    other = client_pool.get_management_client('https://example.com/prod')
+
+    assert first is second
+    assert first is not other
+    assert first.meta.config.max_pool_connections == client_pool.FANOUT_MAX_WORKERS
+
+    stats = client_pool.pool_stats()
+    assert stats['clients_created'] == 2
+    assert stats['clients_reused'] == 1
+    assert stats['construction_saved_seconds'] > 0
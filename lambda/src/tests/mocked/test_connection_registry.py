@@ -0,0 +1,51 @@
+import utils.session_manager as session_manager
+from utils.connection_registry import ConnectionRegistry, registry
+
+
+def test_get_put_and_expiry():
+    cache = ConnectionRegistry(ttl=60)
+    assert cache.get('session') is None
+
+    cache.put('session', ['a', 'b'])
+
+    assert cache.get('session') == ['a', 'b']
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'sessions': 1}
+
+    expired = ConnectionRegistry(ttl=0)
+    expired.put('session', ['a'])
+    assert expired.get('session') is None
+
+
+def test_connect_and_disconnect_update_live_entries():
+    cache = ConnectionRegistry(ttl=60)
+    cache.add('session', 'a')
+    assert cache.get('session') is None
+
+    cache.put('session', ['a'])
+    cache.add('session', 'b')
+    cache.add('session', 'b')
+    cache.discard('a')
+
+    assert cache.get('session') == ['b']
+
+
+def test_stream_reads_dynamodb_once_per_ttl(monkeypatch):
+    reads = []
+
+    def get_connection_ids(connection_table, session_id):
+        reads.append(session_id)
+        return ['a', 'b']
+    monkeypatch.setattr(session_manager.session_operations, 'get_connection_ids', get_connection_ids)
+
+    for _ in range(3):
+        stream = session_manager.StreamToConnections(
+            api_gateway_management_client=None,
+            session_id='test-session-id',
+            connection_id='a',
+            connection_table=None
+        )
+        stream.get_connection_ids(connection_table=None, session_id='test-session-id')
+        assert stream.connection_ids == ['a', 'b']
+
+    assert reads == ['test-session-id']
+    assert registry.stats()['hits'] == 2
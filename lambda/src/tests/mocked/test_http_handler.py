@@ -0,0 +1,66 @@
+import base64
+import gzip
+import json
+
+import pytest
+
+import utils.http_handler as http_handler
+from utils.http_handler import choose_encoding, compress_response, get_header, parse_turn_cursor
+
+
+def test_parse_turn_cursor():
+    assert parse_turn_cursor({}) == (None, None)
+    assert parse_turn_cursor({'since': '12', 'limit': '50'}) == (12, 50)
+
+
+@pytest.mark.parametrize('query_parameters', [
+    {'since': 'abc'},
+    {'limit': '0'},
+    {'limit': '100000'},
+])
+def test_parse_turn_cursor_rejects_bad_values(query_parameters):
+    with pytest.raises(ValueError):
+        parse_turn_cursor(query_parameters)
+
+
+def test_get_header_is_case_insensitive():
+    event = {'headers': {'if-none-match': 'W/"3"'}}
+
+    assert get_header(event, 'If-None-Match') == 'W/"3"'
+    assert get_header({'headers': None}, 'If-None-Match') is None
+
+
+def test_choose_encoding(monkeypatch):
+    monkeypatch.setattr(http_handler, 'brotli', None)
+    assert choose_encoding(None) is None
+    assert choose_encoding('identity') is None
+    assert choose_encoding('gzip, deflate, br') == 'gzip'
+    assert choose_encoding('gzip;q=0') is None
+    assert choose_encoding('*') == 'gzip'
+
+
+def test_choose_encoding_prefers_brotli_when_available(monkeypatch):
+    monkeypatch.setattr(http_handler, 'brotli', object())
+    assert choose_encoding('gzip, deflate, br') == 'br'
+    assert choose_encoding('gzip;q=1.0, br;q=0.5') == 'gzip'
+
+
+def test_compress_response_gzip():
+    body = json.dumps({'chat_history': [{'role': 'user', 'content': 'Seth: I cast a fireball.'}] * 100})
+    response = {'statusCode': 200, 'body': body, 'headers': {'ETag': 'W/"1"'}}
+
+    compress_response(response, 'gzip', min_bytes=1024)
+
+    assert response['isBase64Encoded'] is True
+    assert response['headers']['Content-Encoding'] == 'gzip'
+    assert response['headers']['ETag'] == 'W/"1"'
+    assert gzip.decompress(base64.b64decode(response['body'])).decode('utf-8') == body
+
+
+def test_compress_response_skips_small_bodies():
+    response = {'statusCode': 200, 'body': json.dumps({'error': 'Session not found'}), 'headers': {}}
+
+    compress_response(response, 'gzip', min_bytes=1024)
+
+    assert 'isBase64Encoded' not in response
+    assert 'Content-Encoding' not in response['headers']
@@ -0,0 +1,87 @@
+import pytest
+
+import utils.llm_client as llm_client
+
+
+class AuthenticationError(Exception):
+    status_code = 401
+
+
+class FakeThreads:
+    def __init__(self, api_key, calls):
+        self.api_key = api_key
+        self.calls = calls
+
+    def create(self):
+        self.calls.append(self.api_key)
+        if self.api_key == 'rotated-out':
+            raise AuthenticationError()
+        return 'thread'
+
+
+class FakeOpenAI:
+    def __init__(self, api_key, calls):
+        self.beta = type('Beta', (), {})()
+        self.beta.threads = FakeThreads(api_key, calls)
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    keys = iter(['rotated-out', 'current'])
+    calls = []
+    provider = llm_client.LLMClientProvider(ttl=3600)
+    builds = []
+
+    def refresh():
+        provider._api_key = next(keys)
+        provider._fetched_at = llm_client.time.monotonic()
+        provider._client = FakeOpenAI(provider._api_key, calls)
+        builds.append(provider._api_key)
+    monkeypatch.setattr(provider, '_refresh', refresh)
+    provider.calls = calls
+    provider.builds = builds
+    return provider
+
+
+def test_client_is_built_once(provider):
+    first = provider.get()
+
+    assert provider.get() is first
+    assert provider.builds == ['rotated-out']
+
+
+def test_auth_failure_refreshes_key_and_retries(provider):
+    assert provider.beta.threads.create() == 'thread'
+
+    assert provider.calls == ['rotated-out', 'current']
+    assert provider.builds == ['rotated-out', 'current']
+
+
+def test_other_errors_are_not_retried(provider):
+    with pytest.raises(AttributeError):
+        provider.beta.threads.delete('thread')
+    assert provider.builds == ['rotated-out']
+
+
+def test_is_auth_failure():
+    assert llm_client.is_auth_failure(AuthenticationError())
+    assert not llm_client.is_auth_failure(ValueError())
+
+
+def test_rotated_key_reuses_http_client(monkeypatch):
+    secrets = iter(['first-key', 'first-key', 'second-key'])
+
+    class FakeSecretsManager:
+        def get_secret_value(self, SecretId):
+            return {'SecretString': next(secrets)}
+    monkeypatch.setattr(llm_client.boto3, 'client', lambda service: FakeSecretsManager())
+    provider = llm_client.LLMClientProvider(ttl=0)
+
+    first = provider.get()
+    same_key = provider.get()
+    rotated = provider.get()
+
+    assert same_key is first
+    assert rotated is not first
+    assert rotated.api_key == 'second-key'
+    assert rotated._client is first._client
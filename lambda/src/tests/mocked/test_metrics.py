@@ -0,0 +1,52 @@
+import io
+import json
+
+from utils.metrics import MetricsRecorder, histogram
+
+
+def test_emits_one_emf_record_per_invocation():
+    stream = io.StringIO()
+    recorder = MetricsRecorder(enabled=True, namespace='Test', stream=stream)
+
+    @recorder.timed('dynamodb.get_session')
+    def get_session():
+        return 'session'
+
+    assert get_session() == 'session'
+    with recorder.timer('openai.run'):
+        pass
+    recorder.record('fanout.post', 0.012)
+    recorder.record('fanout.post', 0.012)
+    recorder.emit(Route='sendmessage')
+
+    record = json.loads(stream.getvalue())
+    directive = record['_aws']['CloudWatchMetrics'][0]
+    assert directive['Namespace'] == 'Test'
+    assert directive['Dimensions'] == [['Route']]
+    assert {metric['Name'] for metric in directive['Metrics']} == {'dynamodb.get_session', 'openai.run', 'fanout.post'}
+    assert record['Route'] == 'sendmessage'
+    assert record['fanout.post'] == {'Values': [12.0], 'Counts': [2]}
+    # Samples are cleared once emitted
+    assert recorder.emit(Route='sendmessage') is None
+
+
+def test_disabled_recorder_leaves_functions_alone():
+    stream = io.StringIO()
+    recorder = MetricsRecorder(enabled=False, stream=stream)
+
+    def get_session():
+        return 'session'
+
+    assert recorder.timed('dynamodb.get_session')(get_session) is get_session
+    with recorder.timer('openai.run'):
+        recorder.record('fanout.post', 0.01)
+    assert recorder.emit(Route='sendmessage') is None
+    assert stream.getvalue() == ''
+
+
+def test_histogram_fits_the_per_metric_limit():
+    result = histogram([value / 7 for value in range(1, 5000)])
+
+    assert len(result['Values']) <= 100
+    assert sum(result['Counts']) == 4999
+    assert result['Values'] == sorted(result['Values'])
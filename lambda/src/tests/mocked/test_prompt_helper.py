@@ -0,0 +1,130 @@
+import json
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+import utils.prompt_helper as prompt_helper
+from utils.bio_parser import BIO_END, BIO_START
+
+
+def text_delta(value):
+    return SimpleNamespace(value=value)
+
+
+def completed_message(text):
+    return SimpleNamespace(content=[SimpleNamespace(type='text', text=SimpleNamespace(value=text))])
+
+
+class FakeRuns:
+    def __init__(self, deltas, final_text=None):
+        self.deltas = deltas
+        self.final_text = final_text
+
+    @contextmanager
+    def stream(self, thread_id, assistant_id, event_handler, **kwargs):
+        for delta in self.deltas:
+            event_handler.on_text_delta(text_delta(delta), None)
+        if self.final_text is not None:
+            event_handler.on_message_done(completed_message(self.final_text))
+        usage = SimpleNamespace(model_dump=lambda: {'prompt_tokens': 10, 'completion_tokens': 4})
+        event_handler.on_event(SimpleNamespace(event='thread.run.completed', data=SimpleNamespace(usage=usage)))
+        yield SimpleNamespace(until_done=lambda: None)
+
+
+class FakeLLMClient:
+    def __init__(self, runs):
+        self.beta = SimpleNamespace(threads=SimpleNamespace(
+            runs=runs,
+            messages=SimpleNamespace(
+                create=lambda **kwargs: None,
+                list=lambda thread_id: pytest.fail("messages should not be listed"),
+            ),
+        ))
+
+
+def test_process_action_takes_reply_from_stream():
+    frames = []
+    llm_client = FakeLLMClient(FakeRuns(['Seth', ' rolls a 3.', ' The orc'], final_text='Seth rolls a 3. The orc dodges.'))
+
+    reply = prompt_helper.process_action(
+        llm_client=llm_client,
+        thread_id='thread',
+        user_action={'user': 'Seth', 'msg': 'I cast a fireball.'},
+        stream_to_connections=frames.append
+    )
+
+    assert reply == 'Seth rolls a 3. The orc dodges.'
+    assert ''.join(frames) == 'Seth rolls a 3. The orc'
+
+
+def test_stream_run_falls_back_to_deltas():
+    llm_client = FakeLLMClient(FakeRuns(['The orc', ' falls.']))
+
+    reply = prompt_helper.stream_run(llm_client=llm_client, thread_id='thread', stream_to_connections=lambda message: None)
+
+    assert reply == 'The orc falls.'
+
+
+def test_bio_card_follows_the_bio_text():
+    frames = []
+    bios = []
+    deltas = [f'{BIO_START}\n', 'Seth the wizard', ' casts spells.', f'\n{BIO_END}\nAna', ' the rogue']
+    llm_client = FakeLLMClient(FakeRuns(deltas))
+
+    prompt_helper.generate_character_bios(
+        llm_client=llm_client,
+        users=[{'name': 'Seth'}, {'name': 'Ana'}],
+        thread_id='thread',
+        stream_to_connections=frames.append,
+        on_bio=lambda character, bio: bios.append((character, len(frames)))
+    )
+
+    cards = [i for i, frame in enumerate(frames) if isinstance(frame, dict)]
+    assert frames[cards[0]]['character'] == 'Seth'
+    # Everything streamed before the bio closed went out ahead of its card
+    assert ''.join(frame for frame in frames[:cards[0]]).endswith(f'{BIO_END}\nAna')
+    assert bios[0] == ('Seth', cards[0] + 1)
+
+
+class FakeCompletions:
+    def __init__(self, replies):
+        self.replies = replies
+        self.calls = []
+
+    def create(self, model, messages):
+        user = json.loads(messages[-1]['content'])[0]
+        self.calls.append(user['name'])
+        reply = self.replies[user['name']]
+        if isinstance(reply, Exception):
+            raise reply
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+
+
+def test_generate_character_bios_parallel_isolates_bad_bios():
+    thread_messages = []
+    completions = FakeCompletions({
+        'Seth': "_____________________\nSeth the Wizard\n=====================\n",
+        'Ana': "Ana is a rogue with no delimiters",
+        'Bram': RuntimeError("model unavailable"),
+    })
+    llm_client = SimpleNamespace(
+        chat=SimpleNamespace(completions=completions),
+        beta=SimpleNamespace(threads=SimpleNamespace(messages=SimpleNamespace(
+            create=lambda **kwargs: thread_messages.append(kwargs)
+        ))),
+    )
+    emitted = []
+    users = [{'name': 'Seth', 'role': 'Wizard'}, {'name': 'Ana', 'role': 'Rogue'}, {'name': 'Bram', 'role': 'Bard'}]
+
+    bios = prompt_helper.generate_character_bios_parallel(
+        llm_client=llm_client,
+        users=users,
+        thread_id='thread',
+        on_bio=lambda character, bio: emitted.append(character)
+    )
+
+    assert bios == {'Seth': 'Seth the Wizard', 'Ana': 'Ana is a rogue with no delimiters'}
+    assert sorted(emitted) == ['Ana', 'Seth']
+    assert sorted(completions.calls) == ['Ana', 'Bram', 'Seth']
+    assert [message['role'] for message in thread_messages] == ['user', 'assistant']
@@ -0,0 +1,147 @@
+import json
+
+import pytest
+
+import utils.websocket_handler as websocket_handler
+from utils.replay_buffer import ReplayBuffer, frames_after, merge_segments
+
+
+def test_frames_are_enveloped_in_sequence():
+    replay = ReplayBuffer(turn=7)
+
+    assert replay.append('The orc') == {'type': 'chunk', 'turn': 7, 'seq': 0, 'text': 'The orc'}
+    assert replay.append({'type': 'character_bio', 'character': 'Seth', 'bio': 'A ranger.'}) == {
+        'type': 'character_bio', 'character': 'Seth', 'bio': 'A ranger.', 'turn': 7, 'seq': 1,
+    }
+    segment = replay.take_segment()
+    assert segment['next_seq'] == 2
+    assert [json.loads(frame)['seq'] for frame in segment['frames']] == [0, 1]
+    assert replay.position() == {'replay_turn': 7, 'replay_next_seq': 2}
+
+
+def test_buffer_keeps_only_the_newest_frames():
+    replay = ReplayBuffer(turn=1, max_frames=3)
+    for n in range(5):
+        replay.append(f'chunk {n}')
+
+    segment = replay.take_segment(complete=True)
+
+    assert segment['first_seq'] == 2
+    assert [json.loads(frame)['text'] for frame in segment['frames']] == ['chunk 2', 'chunk 3', 'chunk 4']
+    assert segment['complete'] is True
+
+
+def test_buffer_is_bounded_by_bytes():
+    replay = ReplayBuffer(turn=1, max_bytes=200)
+    for n in range(10):
+        replay.append('x' * 50)
+
+    assert sum(map(len, replay.take_segment()['frames'])) <= 200
+
+
+def test_sequence_continues_on_the_same_turn():
+    session = {'replay_turn': 4, 'replay_next_seq': 9, 'expiration_time': 100}
+
+    assert ReplayBuffer.for_session(session, turn=4).append('more')['seq'] == 9
+    assert ReplayBuffer.for_session(session, turn=5).append('next')['seq'] == 0
+    assert ReplayBuffer.for_session(session, turn=5).take_segment()['expiration_time'] == 100
+
+
+def test_segments_hold_only_frames_since_the_last_one():
+    replay = ReplayBuffer(turn=2)
+    replay.append('The orc')
+    first = replay.take_segment()
+    replay.append(' falls.')
+
+    second = replay.take_segment(complete=True)
+
+    assert (second['first_seq'], second['next_seq']) == (1, 2)
+    assert [json.loads(frame)['text'] for frame in second['frames']] == [' falls.']
+    assert merge_segments([second, first]) == {
+        'turn': 2, 'first_seq': 0, 'next_seq': 2, 'frames': first['frames'] + second['frames'], 'complete': True,
+    }
+
+
+def test_merge_keeps_the_latest_run_after_any_gap():
+    earlier_run = ReplayBuffer(turn=3)
+    for n in range(4):
+        earlier_run.append(f'old {n}')
+    stale = [earlier_run.take_segment()]
+    latest_run = ReplayBuffer(turn=3)
+    latest_run.started_at = earlier_run.started_at + 1
+    latest_run.append('lost')
+    latest_run.take_segment()
+    latest_run.append('kept')
+
+    replay = merge_segments(stale + [latest_run.take_segment(complete=True)])
+
+    assert (replay['first_seq'], replay['next_seq']) == (1, 2)
+    assert [json.loads(frame)['text'] for frame in replay['frames']] == ['kept']
+    assert merge_segments([]) is None
+
+
+@pytest.fixture
+def replay():
+    replay = ReplayBuffer(turn=4, max_frames=3)
+    for n in range(5):
+        replay.append(f'chunk {n}')
+    return merge_segments([replay.take_segment()])
+
+
+def test_frames_after_returns_only_missed_frames(replay):
+    assert [json.loads(frame)['seq'] for frame in frames_after(replay, 4, 2)] == [3, 4]
+    assert frames_after(replay, 4, 4) == []
+    assert frames_after(replay, 5, 0) == []
+    assert frames_after(None, 1, 0) == []
+
+
+def test_frames_after_needs_resync_when_frames_are_gone(replay):
+    assert frames_after(replay, 4, 0) is None
+    assert frames_after(replay, 3, 10) is None
+
+
+class FakeManagementClient:
+    class exceptions:
+        GoneException = type('GoneException', (Exception,), {})
+
+    def __init__(self):
+        self.frames = []
+
+    def post_to_connection(self, Data, ConnectionId):
+        self.frames.append(json.loads(Data))
+
+
+@pytest.fixture
+def resume(monkeypatch, replay):
+    monkeypatch.setattr(
+        websocket_handler.session_operations, 'get_session_id_for_connection',
+        lambda connection_table, connection_id: 'test-session-id'
+    )
+    monkeypatch.setattr(
+        websocket_handler.session_operations, 'get_replay',
+        lambda replay_table, session_id: replay
+    )
+    client = FakeManagementClient()
+
+    def resume(turn, seq):
+        status_code = websocket_handler.handle_resume(None, 'conn', turn, seq, client)
+        return status_code, client.frames
+    return resume
+
+
+def test_resume_sends_missed_frames_then_status(resume, replay):
+    replay['complete'] = False
+
+    status_code, frames = resume(4, 2)
+
+    assert status_code == 200
+    assert frames[0]['type'] == 'batch'
+    assert [frame['text'] for frame in frames[0]['frames']] == ['chunk 3', 'chunk 4']
+    assert frames[1] == {'type': 'resume', 'turn': 4, 'last_seq': 4, 'complete': False}
+
+
+def test_resume_asks_for_resync_when_frames_are_gone(resume):
+    status_code, frames = resume(4, 0)
+
+    assert status_code == 200
+    assert frames == [{'type': 'resync'}]
@@ -0,0 +1,121 @@
+import json
+
+import pytest
+
+import utils.session_manager as session_manager
+
+
+def test_add_entry_fails_fast_when_lease_is_held(monkeypatch):
+    monkeypatch.setattr(session_manager.SessionUnitOfWork, 'acquire_lease', lambda self, owner: False)
+    monkeypatch.setattr(session_manager.SessionUnitOfWork, 'exists', lambda self: True)
+    monkeypatch.setattr(
+        session_manager.session_operations, 'create_session',
+        lambda **kwargs: pytest.fail("session should not be created")
+    )
+    monkeypatch.setattr(session_manager, 'run_turn', lambda **kwargs: pytest.fail("turn should not run"))
+
+    response = session_manager.add_entry(
+        session_table=None,
+        llm_client=None,
+        session_id='test-session-id',
+        message={'user': 'Seth', 'msg': 'I cast a fireball.'},
+        connection_table=None,
+        turn_table=None
+    )
+
+    assert response['body'].startswith("Wait a moment")
+
+
+def test_add_entry_releases_lease_when_turn_fails(monkeypatch):
+    session = {'session_id': 'test-session-id', 'thread_id': 'thread'}
+    leases = []
+    monkeypatch.setattr(
+        session_manager.SessionUnitOfWork, 'acquire_lease',
+        lambda self, owner: leases.append(('acquire', owner)) or setattr(self, 'session', session) or True
+    )
+    monkeypatch.setattr(
+        session_manager.session_operations, 'release_turn_lease',
+        lambda session_table, session_id, owner: leases.append(('release', owner))
+    )
+
+    def run_turn(**kwargs):
+        raise RuntimeError("model unavailable")
+    monkeypatch.setattr(session_manager, 'run_turn', run_turn)
+
+    response = session_manager.add_entry(
+        session_table=None,
+        llm_client=None,
+        session_id='test-session-id',
+        message={'user': 'Seth', 'msg': 'I cast a fireball.'},
+        connection_table=None,
+        turn_table=None,
+        connection_id='conn'
+    )
+
+    assert 'error' in response['body']
+    assert [action for action, _ in leases] == ['acquire', 'release']
+    assert leases[0][1] == leases[1][1]
+
+
+def test_ensure_thread_skipped_by_chat_engine(monkeypatch):
+    from utils import chat_engine
+    monkeypatch.setattr(chat_engine, 'DM_ENGINE', 'chat')
+    monkeypatch.setattr(
+        session_manager.prompt_helper, 'create_thread',
+        lambda llm_client: pytest.fail("the chat engine has no thread")
+    )
+    unit_of_work = session_manager.SessionUnitOfWork(None, None, 'test-session-id')
+    unit_of_work.session = {'session_id': 'test-session-id'}
+
+    session_manager.ensure_thread(unit_of_work, llm_client=None)
+
+    assert not unit_of_work.pending
+
+
+class FakeTurnTable:
+    def __init__(self):
+        self.queries = []
+
+    def query(self, **kwargs):
+        self.queries.append(kwargs)
+        return {'Items': []}
+
+
+def test_get_session_not_modified_skips_turns(monkeypatch):
+    session = {'session_id': 'test-session-id', 'version': 3}
+    monkeypatch.setattr(
+        session_manager.session_operations, 'get_session',
+        lambda session_table, session_id: dict(session)
+    )
+    turn_table = FakeTurnTable()
+
+    response = session_manager.get_session(None, 'test-session-id', turn_table, if_none_match='W/"3"')
+
+    assert response['statusCode'] == 304
+    assert turn_table.queries == []
+
+
+def test_get_session_since_cursor(monkeypatch):
+    session = {'session_id': 'test-session-id', 'version': 4, 'turn_count': 4, 'user_set': []}
+    monkeypatch.setattr(
+        session_manager.session_operations, 'get_session',
+        lambda session_table, session_id: dict(session)
+    )
+    pages = []
+
+    def get_turns_page(turn_table, session_id, since=None, limit=None):
+        pages.append((since, limit))
+        return [{'turn': 3, 'user': 'Seth', 'msg': 'I run.'}], True
+    monkeypatch.setattr(session_manager.session_operations, 'get_turns_page', get_turns_page)
+
+    response = session_manager.get_session(
+        None, 'test-session-id', None, since=2, limit=1, if_none_match='W/"3"'
+    )
+
+    body = json.loads(response['body'])
+    assert response['statusCode'] == 200
+    assert response['headers']['ETag'] == 'W/"4"'
+    assert pages == [(2, 1)]
+    assert body['chat_history'] == [{'role': 'user', 'content': 'Seth: I run.'}]
+    assert body['last_turn'] == 3
+    assert body['has_more'] is True
@@ -0,0 +1,412 @@
+import boto3
+import pytest
+from botocore.stub import ANY, Stubber
+
+import utils.session_operations as session_operations
+from utils.bio_cache import BioCache
+from utils.session_unit_of_work import SessionUnitOfWork
+from tests.mocked.test_bio_cache import FakeCacheTable
+
+
+@pytest.fixture
+def connection_table():
+    dynamodb = boto3.resource('dynamodb', region_name='us-west-1')
+    table = dynamodb.Table('dd-infra-connections')
+    with Stubber(table.meta.client) as stubber:
+        yield table, stubber
+        stubber.assert_no_pending_responses()
+
+
+def test_get_connection_ids_queries_session_index_across_pages(connection_table):
+    table, stubber = connection_table
+    expected_params = {
+        'TableName': 'dd-infra-connections',
+        'IndexName': 'session_id-index',
+        'KeyConditionExpression': ANY,
+        'FilterExpression': ANY,
+        'ProjectionExpression': 'connection_id',
+    }
+    stubber.add_response(
+        'query',
+        {
+            'Items': [{'connection_id': {'S': 'a'}}, {'connection_id': {'S': 'b'}}],
+            'LastEvaluatedKey': {'connection_id': {'S': 'b'}, 'session_id': {'S': 'test-session-id'}},
+        },
+        expected_params
+    )
+    stubber.add_response(
+        'query',
+        {'Items': [{'connection_id': {'S': 'c'}}]},
+        expected_params | {'ExclusiveStartKey': {'connection_id': 'b', 'session_id': 'test-session-id'}}
+    )
+
+    connection_ids = session_operations.get_connection_ids(table, 'test-session-id')
+
+    assert connection_ids == ['a', 'b', 'c']
+
+
+def test_get_connection_ids_empty(connection_table):
+    table, stubber = connection_table
+    stubber.add_response('query', {'Items': []})
+
+    assert session_operations.get_connection_ids(table, 'test-session-id') == []
+
+
+def test_expire_connections_writes_one_batch(monkeypatch, connection_table):
+    table, stubber = connection_table
+    monkeypatch.setattr(session_operations.time, 'time', lambda: 1000)
+    stubber.add_response('batch_write_item', {'UnprocessedItems': {}}, {
+        'RequestItems': {'dd-infra-connections': [
+            {'PutRequest': {'Item': {'session_id': 'test-session-id', 'connection_id': connection_id, 'expiration_time': 1030}}}
+            for connection_id in ('a', 'b')
+        ]}
+    })
+
+    session_operations.expire_connections(table, 'test-session-id', ['a', 'b', 'a'])
+
+
+def test_expire_connections_splits_batches_across_workers(monkeypatch):
+    batches = []
+    monkeypatch.setattr(
+        session_operations, '_expire_connection_batch',
+        lambda connection_table, session_id, connection_ids: batches.append(connection_ids)
+    )
+
+    session_operations.expire_connections(None, 'test-session-id', [f'conn-{i}' for i in range(60)])
+
+    assert sorted(len(batch) for batch in batches) == [10, 25, 25]
+    assert sorted(sum(batches, [])) == sorted(f'conn-{i}' for i in range(60))
+
+
+@pytest.fixture
+def session_table():
+    dynamodb = boto3.resource('dynamodb', region_name='us-west-1')
+    table = dynamodb.Table('dd-infra-sessions')
+    with Stubber(table.meta.client) as stubber:
+        yield table, stubber
+        stubber.assert_no_pending_responses()
+
+
+def test_acquire_turn_lease(session_table):
+    table, stubber = session_table
+    stubber.add_response('update_item', {'Attributes': {
+        'session_id': {'S': 'test-session-id'},
+        'turn_count': {'N': '4'},
+        'lease_owner': {'S': 'a'},
+    }}, {
+        'TableName': 'dd-infra-sessions',
+        'Key': {'session_id': 'test-session-id'},
+        'UpdateExpression': 'SET lease_owner = :owner, lease_expires_at = :expires_at',
+        'ConditionExpression': 'attribute_exists(session_id) AND (attribute_not_exists(lease_owner) OR lease_expires_at < :now)',
+        'ExpressionAttributeValues': ANY,
+        'ReturnValues': 'ALL_NEW',
+    })
+
+    session = session_operations.acquire_turn_lease(table, 'test-session-id', owner='a')
+
+    assert session['turn_count'] == 4
+
+
+def test_acquire_turn_lease_contended(session_table):
+    table, stubber = session_table
+    stubber.add_client_error('update_item', service_error_code='ConditionalCheckFailedException')
+
+    assert session_operations.acquire_turn_lease(table, 'test-session-id', owner='b') is None
+
+
+def test_release_turn_lease_tolerates_lost_lease(session_table):
+    table, stubber = session_table
+    stubber.add_response('update_item', {})
+    stubber.add_client_error('update_item', service_error_code='ConditionalCheckFailedException')
+
+    session_operations.release_turn_lease(table, 'test-session-id', owner='a')
+    session_operations.release_turn_lease(table, 'test-session-id', owner='a')
+
+
+def segment_item(first_seq, next_seq, complete):
+    return {
+        'session_id': {'S': 'test-session-id'},
+        'turn': {'N': '4'},
+        'started_at': {'N': '1000'},
+        'first_seq': {'N': str(first_seq)},
+        'next_seq': {'N': str(next_seq)},
+        'frames': {'L': [{'S': f'frame {seq}'} for seq in range(first_seq, next_seq)]},
+        'complete': {'BOOL': complete},
+    }
+
+
+def test_get_replay_joins_segments_across_pages():
+    dynamodb = boto3.resource('dynamodb', region_name='us-west-1')
+    table = dynamodb.Table('dd-infra-replay')
+    with Stubber(table.meta.client) as stubber:
+        stubber.add_response('query', {
+            'Items': [segment_item(0, 2, False)],
+            'LastEvaluatedKey': {'session_id': {'S': 'test-session-id'}, 'first_seq': {'N': '0'}},
+        })
+        stubber.add_response('query', {'Items': [segment_item(2, 3, True)]}, {
+            'TableName': 'dd-infra-replay',
+            'KeyConditionExpression': ANY,
+            'ExclusiveStartKey': {'session_id': 'test-session-id', 'first_seq': 0},
+        })
+
+        replay = session_operations.get_replay(table, 'test-session-id')
+
+    assert replay['frames'] == ['frame 0', 'frame 1', 'frame 2']
+    assert (replay['next_seq'], replay['complete']) == (3, True)
+
+
+
+@pytest.fixture
+def turn_table():
+    dynamodb = boto3.resource('dynamodb', region_name='us-west-1')
+    table = dynamodb.Table('dd-infra-turns')
+    with Stubber(table.meta.client) as stubber:
+        yield table, stubber
+        stubber.assert_no_pending_responses()
+
+
+def test_append_turns_writes_only_new_entries(session_table, turn_table):
+    sessions, session_stubber = session_table
+    turns, turn_stubber = turn_table
+    session = {'session_id': 'test-session-id', 'expiration_time': 100}
+    session_stubber.add_response(
+        'update_item',
+        {'Attributes': {'turn_count': {'N': '12'}}},
+        {
+            'TableName': 'dd-infra-sessions',
+            'Key': {'session_id': 'test-session-id'},
+            'UpdateExpression': 'ADD turn_count :count, version :one',
+            'ExpressionAttributeValues': {':count': 2, ':one': 1},
+            'ReturnValues': 'UPDATED_NEW',
+        }
+    )
+    turn_stubber.add_response('batch_write_item', {'UnprocessedItems': {}}, {
+        'RequestItems': {'dd-infra-turns': [
+            {'PutRequest': {'Item': {
+                'session_id': 'test-session-id', 'turn': 11, 'expiration_time': 100,
+                'user': 'Seth', 'msg': 'I cast a fireball.'
+            }}},
+            {'PutRequest': {'Item': {
+                'session_id': 'test-session-id', 'turn': 12, 'expiration_time': 100,
+                'user': 'Dungeon Master', 'msg': 'The orc falls.'
+            }}},
+        ]}
+    })
+
+    first_turn = session_operations.append_turns(sessions, turns, session, [
+        {'user': 'Seth', 'msg': 'I cast a fireball.'},
+        {'user': 'Dungeon Master', 'msg': 'The orc falls.'},
+    ])
+
+    assert first_turn == 11
+
+
+def test_get_session_assembles_history_from_turns(session_table, turn_table):
+    sessions, session_stubber = session_table
+    turns, turn_stubber = turn_table
+    session_stubber.add_response('get_item', {'Item': {'session_id': {'S': 'test-session-id'}}})
+    turn_stubber.add_response('query', {'Items': [
+        {'session_id': {'S': 'test-session-id'}, 'turn': {'N': '1'}, 'user': {'S': 'Seth'}, 'msg': {'S': 'I cast a fireball.'}},
+        {'session_id': {'S': 'test-session-id'}, 'turn': {'N': '2'}, 'user': {'S': 'Dungeon Master'}, 'msg': {'S': 'The orc falls.'}},
+    ]})
+
+    session = session_operations.get_session(sessions, 'test-session-id', turn_table=turns)
+
+    assert [session_operations.to_dialogue(turn) for turn in session['turns']] == [
+        {'user': 'Seth', 'msg': 'I cast a fireball.'},
+        {'user': 'Dungeon Master', 'msg': 'The orc falls.'},
+    ]
+    assert [session_operations.to_chat_history(turn) for turn in session['turns']] == [
+        {'role': 'user', 'content': 'Seth: I cast a fireball.'},
+        {'role': 'Dungeon Master', 'content': 'The orc falls.'},
+    ]
+
+
+def test_get_session_migrates_inline_history(session_table, turn_table):
+    sessions, session_stubber = session_table
+    turns, turn_stubber = turn_table
+    session_stubber.add_response('get_item', {'Item': {
+        'session_id': {'S': 'test-session-id'},
+        'expiration_time': {'N': '100'},
+        'dialogue': {'L': [
+            {'M': {'user': {'S': 'Hank'}, 'msg': {'S': 'Hello'}}},
+            {'M': {'user': {'S': 'Dungeon Master'}, 'msg': {'S': 'Welcome'}}},
+        ]},
+        'chat_history': {'L': [
+            {'M': {'role': {'S': 'user'}, 'content': {'S': 'Hank: Hello'}}},
+            {'M': {'role': {'S': 'Dungeon Master'}, 'content': {'S': 'Welcome'}}},
+        ]},
+    }})
+    turn_stubber.add_response('batch_write_item', {'UnprocessedItems': {}}, {
+        'RequestItems': {'dd-infra-turns': [
+            {'PutRequest': {'Item': {
+                'session_id': 'test-session-id', 'turn': -1, 'expiration_time': 100,
+                'user': 'Hank', 'msg': 'Hello'
+            }}},
+            {'PutRequest': {'Item': {
+                'session_id': 'test-session-id', 'turn': 0, 'expiration_time': 100,
+                'user': 'Dungeon Master', 'msg': 'Welcome'
+            }}},
+        ]}
+    })
+    session_stubber.add_response('update_item', {}, {
+        'TableName': 'dd-infra-sessions',
+        'Key': {'session_id': 'test-session-id'},
+        'UpdateExpression': 'REMOVE dialogue, chat_history',
+        'ConditionExpression': 'attribute_exists(dialogue)',
+    })
+    turn_stubber.add_response('query', {'Items': [
+        {'session_id': {'S': 'test-session-id'}, 'turn': {'N': '-1'}, 'user': {'S': 'Hank'}, 'msg': {'S': 'Hello'}},
+        {'session_id': {'S': 'test-session-id'}, 'turn': {'N': '0'}, 'user': {'S': 'Dungeon Master'}, 'msg': {'S': 'Welcome'}},
+    ]})
+
+    session = session_operations.get_session(sessions, 'test-session-id', turn_table=turns)
+
+    assert 'dialogue' not in session and 'chat_history' not in session
+    assert [turn['turn'] for turn in session['turns']] == [-1, 0]
+
+
+def test_update_bios_as_needed_saves_streamed_bios_once(monkeypatch):
+    updates = []
+    session = {'session_id': 'test-session-id', 'thread_id': 'thread', 'user_set': [], 'user_bios': {}}
+    monkeypatch.setattr(
+        session_operations.prompt_helper, 'generate_character_bios',
+        lambda llm_client, users, thread_id, stream_to_connections: {'Seth': 'Seth the wizard', 'Ana': 'Ana the rogue'}
+    )
+    session_table = type('FakeTable', (), {'update_item': lambda self, **kwargs: updates.append(kwargs)})()
+
+    bios = session_operations.update_bios_as_needed(
+        session_table=session_table,
+        llm_client=None,
+        body={'users': [{'name': 'Seth', 'role': 'Wizard'}, {'name': 'Ana', 'role': 'Rogue'}]},
+        session=session,
+        stream_to_connections=lambda message: None
+    )
+
+    assert bios == {'Seth': 'Seth the wizard', 'Ana': 'Ana the rogue'}
+    assert len(updates) == 1
+    assert updates[0]['ExpressionAttributeValues'][':user_bios'] == bios
+
+
+def test_update_bios_as_needed_stages_bios_on_unit_of_work(monkeypatch):
+    updates = []
+    session = {'session_id': 'test-session-id', 'thread_id': 'thread', 'user_set': [], 'user_bios': {}}
+
+    def generate_character_bios(llm_client, users, thread_id, stream_to_connections):
+        assert updates == []
+        return {'Seth': 'Seth the wizard', 'Ana': 'Ana the rogue'}
+    monkeypatch.setattr(session_operations.prompt_helper, 'generate_character_bios', generate_character_bios)
+    session_table = type('FakeTable', (), {'update_item': lambda self, **kwargs: updates.append(kwargs)})()
+    unit_of_work = SessionUnitOfWork(session_table, None, 'test-session-id')
+    unit_of_work.session = session
+
+    session_operations.update_bios_as_needed(
+        session_table=session_table,
+        llm_client=None,
+        body={'users': [{'name': 'Seth', 'role': 'Wizard'}, {'name': 'Ana', 'role': 'Rogue'}]},
+        session=session,
+        stream_to_connections=lambda message: None,
+        unit_of_work=unit_of_work
+    )
+
+    assert updates == []
+    unit_of_work.commit()
+    [update] = updates
+    names = {name: placeholder for placeholder, name in update['ExpressionAttributeNames'].items()}
+    assert f"{names['user_bios']} = :u1" in update['UpdateExpression']
+    assert update['ExpressionAttributeValues'][':u1'] == {'Seth': 'Seth the wizard', 'Ana': 'Ana the rogue'}
+
+
+def test_update_bios_as_needed_uses_completions_without_a_thread(monkeypatch):
+    from utils import chat_engine
+    session = {'session_id': 'test-session-id', 'user_set': [], 'user_bios': {}}
+    calls = []
+    monkeypatch.setattr(chat_engine, 'DM_ENGINE', 'chat')
+    monkeypatch.setattr(session_operations, 'BIO_CACHE_ENABLED', False)
+    monkeypatch.setattr(
+        session_operations.prompt_helper, 'generate_character_bio',
+        lambda llm_client, user: calls.append(user) or {user['name']: f"{user['name']} the {user['role']}"}
+    )
+    monkeypatch.setattr(
+        session_operations.prompt_helper, 'add_bios_to_thread',
+        lambda **kwargs: pytest.fail("the chat engine has no thread")
+    )
+    session_table = type('FakeTable', (), {'update_item': lambda self, **kwargs: None})()
+
+    bios = session_operations.update_bios_as_needed(
+        session_table=session_table,
+        llm_client=None,
+        body={'users': [{'name': 'Seth', 'role': 'Wizard'}]},
+        session=session,
+        stream_to_connections=lambda message: None
+    )
+
+    assert bios == {'Seth': 'Seth the Wizard'}
+    assert calls == [{'name': 'Seth', 'role': 'Wizard'}]
+
+
+def test_update_bios_as_needed_merges_parallel_bios_in_one_write(monkeypatch):
+    updates = []
+    session = {'session_id': 'test-session-id', 'thread_id': 'thread', 'user_set': [], 'user_bios': {}}
+    monkeypatch.setattr(session_operations.prompt_helper, 'BIO_GENERATION', 'parallel')
+    monkeypatch.setattr(
+        session_operations.prompt_helper, 'generate_character_bios_parallel',
+        lambda llm_client, users, thread_id, on_bio: {'Seth': 'Seth the wizard', 'Ana': 'Ana the rogue'}
+    )
+    session_table = type('FakeTable', (), {'update_item': lambda self, **kwargs: updates.append(kwargs)})()
+
+    session_operations.update_bios_as_needed(
+        session_table=session_table,
+        llm_client=None,
+        body={'users': [{'name': 'Seth', 'role': 'Wizard'}, {'name': 'Ana', 'role': 'Rogue'}]},
+        session=session,
+        stream_to_connections=lambda message: None
+    )
+
+    assert len(updates) == 1
+    assert updates[0]['ExpressionAttributeValues'][':user_bios'] == {'Seth': 'Seth the wizard', 'Ana': 'Ana the rogue'}
+
+
+def test_update_bios_as_needed_serves_cached_bios(monkeypatch):
+    cache = BioCache(table=FakeCacheTable(), version='v1')
+    cache.put({'name': 'Seth', 'role': 'Wizard'}, 'Seth', 'Seth the wizard')
+    thread_bios = []
+    generated_for = []
+    monkeypatch.setattr(session_operations, 'BIO_CACHE_ENABLED', True)
+    monkeypatch.setattr(session_operations, 'bio_cache', cache)
+    monkeypatch.setattr(
+        session_operations.prompt_helper, 'add_bios_to_thread',
+        lambda llm_client, thread_id, users, bios: thread_bios.append(bios)
+    )
+
+    def generate_character_bios(llm_client, users, thread_id, stream_to_connections):
+        generated_for.extend(user['name'] for user in users)
+        return {'Ana': 'Ana the rogue'}
+    monkeypatch.setattr(session_operations.prompt_helper, 'generate_character_bios', generate_character_bios)
+    session_table = type('FakeTable', (), {'update_item': lambda self, **kwargs: None})()
+    body = {'users': [{'name': 'Seth', 'role': 'Wizard'}, {'name': 'Ana', 'role': 'Rogue'}]}
+    session = {'session_id': 'test-session-id', 'thread_id': 'thread', 'user_set': [], 'user_bios': {}}
+
+    bios = session_operations.update_bios_as_needed(session_table, None, body, session, lambda message: None)
+
+    assert bios == {'Seth': 'Seth the wizard', 'Ana': 'Ana the rogue'}
+    assert generated_for == ['Ana']
+    assert thread_bios == [{'Seth': 'Seth the wizard'}]
+    assert cache.get({'name': 'Ana', 'role': 'Rogue'}) == ('Ana', 'Ana the rogue')
+
+
+def test_update_bios_as_needed_fresh_bios_skips_cache(monkeypatch):
+    updates = []
+    monkeypatch.setattr(session_operations, 'BIO_CACHE_ENABLED', True)
+    monkeypatch.setattr(session_operations, 'bio_cache', None)
+    monkeypatch.setattr(
+        session_operations.prompt_helper, 'generate_character_bios',
+        lambda llm_client, users, thread_id, stream_to_connections: {'Seth': 'Seth the wizard'}
+    )
+    session_table = type('FakeTable', (), {'update_item': lambda self, **kwargs: updates.append(kwargs)})()
+    body = {'users': [{'name': 'Seth', 'role': 'Wizard'}], 'fresh_bios': True}
+    session = {'session_id': 'test-session-id', 'thread_id': 'thread', 'user_set': [], 'user_bios': {}}
+
+    session_operations.update_bios_as_needed(session_table, None, body, session, lambda message: None)
+
+    assert updates[0]['ExpressionAttributeValues'][':fresh_bios'] is True
@@ -0,0 +1,138 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+import utils.session_manager as session_manager
+import utils.session_purge as session_purge
+
+
+class FakeTable:
+    """Keeps items by key and records each batch of deletes."""
+    def __init__(self, name, key, items=()):
+        self.name = name
+        self.key = key
+        self.items = {tuple(item[k] for k in key): item for item in items}
+        self.deleted = []
+        self.meta = SimpleNamespace(client=self)
+
+    def batch_get_item(self, RequestItems):
+        keys = RequestItems[self.name]['Keys']
+        found = [self.items[(key['session_id'],)] for key in keys if (key['session_id'],) in self.items]
+        return {'Responses': {self.name: found}, 'UnprocessedKeys': {}}
+
+    def scan(self, Segment, TotalSegments, FilterExpression, **kwargs):
+        cutoff = FilterExpression._values[1]
+        items = sorted(
+            (item for item in self.items.values() if item['expiration_time'] < cutoff),
+            key=lambda item: item['session_id']
+        )
+        return {'Items': [item for i, item in enumerate(items) if i % TotalSegments == Segment]}
+
+    def query(self, **kwargs):
+        session_id = kwargs['KeyConditionExpression']._values[1]
+        return {'Items': [item for item in self.items.values() if item['session_id'] == session_id]}
+
+    @contextmanager
+    def batch_writer(self):
+        batch = SimpleNamespace(delete_item=lambda Key: self.deleted.append(Key))
+        yield batch
+        for key in self.deleted:
+            self.items.pop(tuple(key[k] for k in self.key), None)
+
+
+class NotFoundError(Exception):
+    status_code = 404
+
+
+@pytest.fixture
+def tables():
+    session_table = FakeTable('dd-infra-sessions', ('session_id',), [
+        {'session_id': 'kept', 'thread_id': 'thread-kept', 'expiration_time': 500},
+        {'session_id': 'old', 'thread_id': 'thread-old', 'expiration_time': 100},
+        {'session_id': 'stuck', 'thread_id': 'thread-stuck', 'expiration_time': 100},
+        {'session_id': 'threadless', 'expiration_time': 100},
+    ])
+    turn_table = FakeTable('dd-infra-turns', ('session_id', 'turn'), [
+        {'session_id': 'old', 'turn': 1}, {'session_id': 'old', 'turn': 2},
+        {'session_id': 'stuck', 'turn': 1}, {'session_id': 'kept', 'turn': 1},
+    ])
+    connection_table = FakeTable('dd-infra-connections', ('connection_id',), [
+        {'session_id': 'old', 'connection_id': 'conn-old'},
+        {'session_id': 'kept', 'connection_id': 'conn-kept'},
+    ])
+    return session_table, connection_table, turn_table
+
+
+@pytest.fixture
+def deleted_threads(monkeypatch):
+    deleted = []
+
+    def delete_thread(llm_client, thread_id):
+        if thread_id == 'thread-stuck':
+            raise RuntimeError('rate limited')
+        if thread_id == 'thread-gone':
+            raise NotFoundError()
+        deleted.append(thread_id)
+    monkeypatch.setattr(session_purge.prompt_helper, 'delete_thread', delete_thread)
+    return deleted
+
+
+def test_purge_by_ids_deletes_sessions_turns_connections_and_threads(tables, deleted_threads):
+    session_table, connection_table, turn_table = tables
+
+    report = session_purge.purge_sessions(
+        session_table, connection_table, turn_table, llm_client=None,
+        session_ids=['old', 'old', 'missing']
+    )
+
+    assert deleted_threads == ['thread-old']
+    assert set(session_table.items) == {('kept',), ('stuck',), ('threadless',)}
+    assert set(turn_table.items) == {('stuck', 1), ('kept', 1)}
+    assert set(connection_table.items) == {('conn-kept',)}
+    assert report['sessions'] == 1
+    assert report['purged'] == 1
+    assert report['items_deleted'] == 4
+    assert report['failures'] == []
+
+
+def test_purge_by_expiry_keeps_sessions_whose_thread_failed(tables, deleted_threads):
+    session_table, connection_table, turn_table = tables
+
+    report = session_purge.purge_sessions(
+        session_table, connection_table, turn_table, llm_client=None, expired_before=200
+    )
+
+    assert deleted_threads == ['thread-old']
+    assert set(session_table.items) == {('kept',), ('stuck',)}
+    assert ('stuck', 1) in turn_table.items
+    assert report['purged'] == 2
+    assert report['failures'] == [{'session_id': 'stuck', 'error': 'rate limited'}]
+    assert report['sessions_per_second'] > 0
+
+
+def test_purge_treats_missing_thread_as_deleted(deleted_threads):
+    assert session_purge._delete_thread(None, {'session_id': 's', 'thread_id': 'thread-gone'}) is None
+
+
+def test_purge_needs_ids_or_cutoff(tables):
+    with pytest.raises(ValueError):
+        session_purge.purge_sessions(*tables, llm_client=None)
+
+
+def test_delete_session_deletes_thread(monkeypatch):
+    deleted = []
+    monkeypatch.setattr(
+        session_manager.session_operations, 'get_session',
+        lambda session_table, session_id: {'session_id': session_id, 'thread_id': 'thread-1'}
+    )
+    monkeypatch.setattr(session_manager.session_operations, 'delete_session', lambda **kwargs: None)
+    monkeypatch.setattr(
+        session_manager.prompt_helper, 'delete_thread',
+        lambda llm_client, thread_id: deleted.append(thread_id)
+    )
+
+    response = session_manager.delete_session(None, 'test-session-id', None, None, None)
+
+    assert response['statusCode'] == 200
+    assert deleted == ['thread-1']
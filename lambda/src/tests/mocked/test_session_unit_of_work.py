@@ -0,0 +1,197 @@
+import boto3
+import pytest
+from botocore.stub import ANY, Stubber
+
+import utils.session_manager as session_manager
+from utils.dynamodb_calls import counter as dynamodb_calls
+from utils.session_unit_of_work import SessionUnitOfWork
+
+
+@pytest.fixture
+def dynamodb():
+    return boto3.resource('dynamodb', region_name='us-west-1')
+
+
+@pytest.fixture
+def tables(dynamodb):
+    dynamodb_calls.instrument(dynamodb.meta.client)
+    dynamodb_calls.reset()
+    with Stubber(dynamodb.meta.client) as stubber:
+        yield (
+            dynamodb.Table('dd-infra-sessions'),
+            dynamodb.Table('dd-infra-connections'),
+            dynamodb.Table('dd-infra-turns'),
+            stubber,
+        )
+        stubber.assert_no_pending_responses()
+
+
+def test_exists_reads_only_the_key(tables):
+    session_table, _, _, stubber = tables
+    stubber.add_response('get_item', {'Item': {'session_id': {'S': 'test-session-id'}}}, {
+        'TableName': 'dd-infra-sessions',
+        'Key': {'session_id': 'test-session-id'},
+        'ProjectionExpression': '#a0',
+        'ExpressionAttributeNames': {'#a0': 'session_id'},
+    })
+
+    assert SessionUnitOfWork(session_table, None, 'test-session-id').exists()
+    assert dynamodb_calls.snapshot() == {'GetItem': 1}
+
+
+def test_commit_merges_session_changes_into_one_update(tables):
+    session_table, _, _, stubber = tables
+    stubber.add_response('update_item', {}, {
+        'TableName': 'dd-infra-sessions',
+        'Key': {'session_id': 'test-session-id'},
+        'UpdateExpression': 'SET #u0 = :u1, #u1 = :u2 ADD #u2 :u3 REMOVE #u3, #u4',
+        'ConditionExpression': '(lease_owner = :lease_owner)',
+        'ExpressionAttributeNames': {
+            '#u0': 'user_set', '#u1': 'thread_id', '#u2': 'version',
+            '#u3': 'lease_owner', '#u4': 'lease_expires_at',
+        },
+        'ExpressionAttributeValues': {
+            ':lease_owner': 'owner', ':u1': [], ':u2': 'thread', ':u3': 2,
+        },
+    })
+    unit_of_work = SessionUnitOfWork(session_table, None, 'test-session-id')
+    unit_of_work.set('user_set', [])
+    unit_of_work.set('thread_id', 'thread')
+    unit_of_work.add('version', 1)
+    unit_of_work.add('version', 1)
+    unit_of_work.release_lease('owner')
+
+    unit_of_work.commit()
+
+    assert dynamodb_calls.total == 1
+    assert not unit_of_work.pending
+
+
+def test_acquire_lease_loads_session_from_lease_write(tables):
+    session_table, _, _, stubber = tables
+    stubber.add_response('update_item', {'Attributes': {
+        'session_id': {'S': 'test-session-id'},
+        'turn_count': {'N': '4'},
+        'lease_owner': {'S': 'owner'},
+    }}, {
+        'TableName': 'dd-infra-sessions',
+        'Key': {'session_id': 'test-session-id'},
+        'UpdateExpression': ANY,
+        'ConditionExpression': ANY,
+        'ExpressionAttributeValues': ANY,
+        'ReturnValues': 'ALL_NEW',
+    })
+    unit_of_work = SessionUnitOfWork(session_table, None, 'test-session-id')
+
+    assert unit_of_work.acquire_lease('owner')
+    assert unit_of_work.session == {'session_id': 'test-session-id', 'turn_count': 4}
+    assert dynamodb_calls.snapshot() == {'UpdateItem': 1}
+
+
+def test_add_entry_creates_missing_session_before_lease(monkeypatch, tables):
+    session_table, connection_table, turn_table, stubber = tables
+    stubber.add_client_error('update_item', service_error_code='ConditionalCheckFailedException')
+    stubber.add_response('get_item', {})
+    stubber.add_response('put_item', {}, {'TableName': 'dd-infra-sessions', 'Item': ANY, 'ConditionExpression': ANY})
+    stubber.add_response('update_item', {'Attributes': {
+        'session_id': {'S': 'test-session-id'},
+        'turn_count': {'N': '0'},
+    }})
+    sessions = []
+
+    def run_turn(session, **kwargs):
+        sessions.append(dict(session))
+        raise RuntimeError("model unavailable")
+    monkeypatch.setattr(session_manager, 'ensure_thread', lambda unit_of_work, llm_client: None)
+    monkeypatch.setattr(session_manager, 'run_turn', run_turn)
+    monkeypatch.setattr(session_manager.session_operations, 'release_turn_lease', lambda **kwargs: None)
+
+    session_manager.add_entry(
+        session_table=session_table,
+        llm_client=None,
+        session_id='test-session-id',
+        message={'user': 'Seth', 'msg': 'I swing.'},
+        connection_table=connection_table,
+        turn_table=turn_table
+    )
+
+    assert sessions == [{'session_id': 'test-session-id', 'turn_count': 0}]
+
+
+def test_turn_reads_session_with_lease_and_writes_once(monkeypatch, dynamodb, tables):
+    session_table, connection_table, turn_table, stubber = tables
+    stubber.add_response('update_item', {'Attributes': {
+        'session_id': {'S': 'test-session-id'},
+        'thread_id': {'S': 'thread'},
+        'user_set': {'L': []},
+        'turn_count': {'N': '4'},
+        'expiration_time': {'N': '100'},
+        'lease_owner': {'S': 'conn:owner'},
+    }})
+    stubber.add_response('query', {'Items': []})
+    stubber.add_response('put_item', {}, {'TableName': 'dd-infra-replay', 'Item': ANY})
+    stubber.add_response('transact_write_items', {}, {'TransactItems': ANY})
+    monkeypatch.setattr(session_manager, 'replay_table', dynamodb.Table('dd-infra-replay'))
+    transactions = []
+    session_table.meta.client.meta.events.register(
+        'before-parameter-build.dynamodb.TransactWriteItems',
+        lambda params, **kwargs: transactions.append(params)
+    )
+    monkeypatch.setattr(
+        session_manager.session_operations.prompt_helper, 'process_action',
+        lambda llm_client, thread_id, user_action, stream_to_connections: 'The orc falls.'
+    )
+
+    response = session_manager.add_entry(
+        session_table=session_table,
+        llm_client=None,
+        session_id='test-session-id',
+        message={'user': 'Seth', 'msg': 'I swing.'},
+        connection_table=connection_table,
+        turn_table=turn_table,
+        connection_id='conn'
+    )
+
+    assert response['statusCode'] == 200
+    session_update = transactions[0]['TransactItems'][0]['Update']
+    assert {'replay_turn', 'replay_next_seq'} <= set(session_update['ExpressionAttributeNames'].values())
+    assert 'frames' not in session_update['ExpressionAttributeNames'].values()
+    # The replay buffer is written to its own table, outside the transaction
+    assert dynamodb_calls.snapshot() == {'UpdateItem': 1, 'Query': 1, 'PutItem': 1, 'TransactWriteItems': 1}
+
+
+def test_transaction_numbers_turns_from_read_count(tables):
+    session_table, _, turn_table, stubber = tables
+    transactions = []
+    stubber.add_response('transact_write_items', {}, {'TransactItems': ANY})
+    session_table.meta.client.meta.events.register(
+        'before-parameter-build.dynamodb.TransactWriteItems',
+        lambda params, **kwargs: transactions.append(params)
+    )
+    unit_of_work = SessionUnitOfWork(session_table, turn_table, 'test-session-id')
+    unit_of_work.session = {'session_id': 'test-session-id', 'turn_count': 4, 'expiration_time': 100}
+
+    first_turn = unit_of_work.append_turns([{'user': 'Seth', 'msg': 'I swing.'}, {'user': 'Dungeon Master', 'msg': 'Hit.'}])
+    unit_of_work.commit()
+
+    items = transactions[0]['TransactItems']
+    assert first_turn == 5
+    assert items[0]['Update']['ConditionExpression'] == '(turn_count = :read_turn_count)'
+    assert [item['Put']['Item']['turn'] for item in items[1:]] == [{'N': '5'}, {'N': '6'}]
+
+
+def test_first_action_creates_thread(monkeypatch):
+    created = []
+    monkeypatch.setattr(
+        session_manager.prompt_helper, 'create_thread',
+        lambda llm_client: created.append(llm_client) or 'new-thread'
+    )
+    unit_of_work = SessionUnitOfWork(None, None, 'test-session-id')
+    unit_of_work.session = {'session_id': 'test-session-id'}
+
+    session_manager.ensure_thread(unit_of_work, llm_client='llm')
+    session_manager.ensure_thread(unit_of_work, llm_client='llm')
+
+    assert created == ['llm']
+    assert unit_of_work.session['thread_id'] == 'new-thread'
+    assert 'attribute_not_exists(thread_id)' in unit_of_work.update_request()['ConditionExpression']
@@ -0,0 +1,100 @@
+import time
+
+from utils.stream_buffer import CoalescingBuffer
+
+
+def make_buffer(**kwargs):
+    frames = []
+    options = {'flush_bytes': 64, 'flush_interval': 60, 'flush_on_sentence': True}
+    options.update(kwargs)
+    return CoalescingBuffer(frames.append, **options), frames
+
+
+def test_first_delta_is_sent_immediately():
+    buffer, frames = make_buffer()
+
+    buffer.write('Seth')
+    buffer.write(' rolls')
+    buffer.write(' a')
+
+    assert frames == ['Seth']
+
+
+def test_sentence_boundary_flushes():
+    buffer, frames = make_buffer()
+
+    for delta in ['Seth', ' rolls', ' a', ' 3', '.', ' The', ' orc']:
+        buffer.write(delta)
+    buffer.close()
+
+    assert frames == ['Seth', ' rolls a 3.', ' The orc']
+
+
+def test_newlines_are_sent_as_their_own_frame():
+    buffer, frames = make_buffer()
+
+    for delta in ['Seth', ' rolls', ' a 3', '.\n\n', 'The orc', ' falls\n', 'Hank']:
+        buffer.write(delta)
+    buffer.close()
+
+    assert frames == ['Seth', ' rolls a 3.', '\n\n', 'The orc falls', '\n', 'Hank']
+    assert all('\n' not in frame or frame.strip('\n') == '' for frame in frames)
+
+
+def test_size_threshold_flushes():
+    buffer, frames = make_buffer(flush_bytes=8, flush_on_sentence=False)
+
+    for delta in ['a', 'bc', 'def', 'ghi', 'j']:
+        buffer.write(delta)
+
+    assert frames == ['a', 'bcdefghi']
+
+
+def test_time_window_flushes():
+    buffer, frames = make_buffer(flush_interval=0, flush_on_sentence=False)
+
+    for delta in ['a', 'b', 'c']:
+        buffer.write(delta)
+
+    assert frames == ['a', 'b', 'c']
+
+
+def test_time_window_flushes_while_the_model_pauses():
+    buffer, frames = make_buffer(flush_interval=0.05, flush_on_sentence=False)
+
+    buffer.write('Seth')
+    buffer.write(' rolls')
+    deadline = time.monotonic() + 2
+    while len(frames) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert frames == ['Seth', ' rolls']
+    buffer.close()
+    assert frames == ['Seth', ' rolls']
+
+
+def test_flush_due_waits_for_the_deadline_without_a_timer():
+    buffer, frames = make_buffer(flush_interval=0.05, flush_on_sentence=False, flush_timer=False)
+
+    buffer.write('Seth')
+    buffer.write(' rolls')
+    buffer.flush_due()
+    assert frames == ['Seth']
+    time.sleep(buffer.deadline() - time.monotonic())
+    buffer.flush_due()
+
+    assert frames == ['Seth', ' rolls']
+    assert buffer.deadline() is None
+
+
+def test_close_flushes_remainder():
+    buffer, frames = make_buffer(flush_on_sentence=False)
+
+    for delta in ['a', 'b', 'c']:
+        buffer.write(delta)
+    assert frames == ['a']
+    buffer.close()
+
+    assert frames == ['a', 'bc']
+    assert buffer.deltas_in == 3
+    assert buffer.frames_out == 2
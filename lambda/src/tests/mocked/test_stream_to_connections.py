@@ -0,0 +1,260 @@
+import json
+import threading
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+import utils.connection_sender as connection_sender
+import utils.session_manager as session_manager
+from utils.connection_registry import registry as connection_registry
+from utils.replay_buffer import ReplayBuffer
+
+
+class GoneException(ClientError):
+    def __init__(self):
+        super().__init__({'Error': {'Code': 'GoneException'}}, 'PostToConnection')
+
+
+class LimitExceededException(ClientError):
+    def __init__(self):
+        super().__init__({'Error': {'Code': 'LimitExceededException'}}, 'PostToConnection')
+
+
+class FakeManagementClient:
+    """
+    Records every frame posted to each connection.
+
+    Posts wait on `barrier` when one is given, so they only get through if
+    they are in flight together. Posts to `blocked` connections wait until
+    `release` is set.
+    """
+    class exceptions:
+        GoneException = GoneException
+
+    def __init__(self, gone=(), blocked=(), throttle=None, barrier=None):
+        self.gone = set(gone)
+        self.blocked = set(blocked)
+        self.release = threading.Event()
+        self.throttle = dict(throttle or {})
+        self.barrier = barrier
+        self.frames = {}
+        self.lock = threading.Lock()
+
+    def post_to_connection(self, Data, ConnectionId):
+        if self.barrier is not None:
+            self.barrier.wait(timeout=5)
+        if ConnectionId in self.blocked:
+            self.release.wait(timeout=5)
+        if ConnectionId in self.gone:
+            raise GoneException()
+        with self.lock:
+            if self.throttle.get(ConnectionId):
+                self.throttle[ConnectionId] -= 1
+                raise LimitExceededException()
+        with self.lock:
+            self.frames.setdefault(ConnectionId, []).append(Data)
+
+
+@pytest.fixture
+def removed(monkeypatch):
+    removed = []
+    monkeypatch.setattr(
+        session_manager.session_operations,
+        'expire_connections',
+        lambda connection_table, session_id, connection_ids: removed.extend(connection_ids)
+    )
+    return removed
+
+
+def make_stream(client, connection_ids, concurrent=True):
+    stream = session_manager.StreamToConnections(
+        api_gateway_management_client=client,
+        session_id='test-session-id',
+        connection_id=connection_ids[0],
+        connection_table=None,
+        concurrent=concurrent
+    )
+    stream.connection_ids = list(connection_ids)
+    return stream
+
+
+def test_concurrent_fan_out_keeps_frame_order():
+    client = FakeManagementClient()
+    stream = make_stream(client, ['a', 'b', 'c', 'd'])
+
+    for token in ['The', ' orc', ' falls', '.']:
+        stream({'token': token})
+    stream.flush()
+
+    for connection_id in ['a', 'b', 'c', 'd']:
+        assert client.frames[connection_id] == [b'{"token": "The"}', b'{"token": " orc"}', b'{"token": " falls"}', b'{"token": "."}']
+    summary = stream.latency_summary()
+    assert summary['a']['frames'] == 4
+    assert summary['a']['max'] >= summary['a']['mean']
+
+
+def test_concurrent_fan_out_is_parallel():
+    # Serial posts would break the barrier, and no frame would be recorded
+    client = FakeManagementClient(barrier=threading.Barrier(4))
+    stream = make_stream(client, ['a', 'b', 'c', 'd'])
+
+    stream('token')
+    stream.flush()
+
+    assert client.frames == {connection_id: [b'token'] for connection_id in 'abcd'}
+
+
+def test_gone_connection_is_removed(removed):
+    client = FakeManagementClient(gone={'b'})
+    stream = make_stream(client, ['a', 'b', 'c'])
+    connection_registry.put('test-session-id', ['a', 'b', 'c'])
+
+    stream({'msg': 'hello'})
+    stream.flush()
+    stream('again')
+    stream.flush()
+
+    assert removed == []
+    stream.expire_stale_connections()
+    assert removed == ['b']
+    assert stream.stale_connection_ids == []
+    assert connection_registry.get('test-session-id') == ['a', 'c']
+    assert stream.connection_ids == ['a', 'c']
+    assert client.frames['a'] == [b'{"msg": "hello"}', b'again']
+
+
+def test_serial_mode(removed):
+    client = FakeManagementClient(gone={'a'})
+    stream = make_stream(client, ['a', 'b'], concurrent=False)
+
+    stream('token')
+    stream.expire_stale_connections()
+
+    assert removed == ['a']
+    assert client.frames == {'b': [b'token']}
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(connection_sender, 'backoff_delay', lambda attempt: 0)
+
+
+def test_throttled_frames_are_retried(no_backoff):
+    client = FakeManagementClient(throttle={'b': 2})
+    stream = make_stream(client, ['a', 'b'])
+
+    stream({'msg': 'hello'})
+    stream.flush()
+
+    assert client.frames['b'] == [b'{"msg": "hello"}']
+    assert stream.queue_stats()['b']['retries'] == 2
+    assert stream.queue_stats()['a']['retries'] == 0
+
+
+def unpack(frames):
+    chunks = []
+    for data in frames:
+        frame = json.loads(data)
+        chunks.extend(frame['frames'] if frame.get('type') == 'batch' else [frame])
+    return chunks
+
+
+def test_slow_connection_does_not_hold_up_others():
+    client = FakeManagementClient(blocked={'b'})
+    stream = make_stream(client, ['a', 'b'])
+    stream.replay = ReplayBuffer(turn=3)
+
+    for token in ['The', ' orc', '\n\n', '.']:
+        stream(token)
+
+    # a gets every frame while b's first post is still stuck
+    assert stream.senders['a'].wait(timeout=5)
+    assert len(unpack(client.frames['a'])) == 4
+    assert 'b' not in client.frames
+    client.release.set()
+    stream.flush()
+
+    # Frames queued behind b's stuck post are batched rather than sent one by one
+    chunks = unpack(client.frames['b'])
+    assert [(chunk['turn'], chunk['seq'], chunk['text']) for chunk in chunks] == [
+        (3, 0, 'The'), (3, 1, ' orc'), (3, 2, '\n\n'), (3, 3, '.')
+    ]
+    assert len(client.frames['b']) <= 2
+    assert stream.queue_stats()['b']['merged'] == 4 - len(client.frames['b'])
+
+
+def test_unsequenced_frames_are_never_merged():
+    client = FakeManagementClient(blocked={'a'})
+    stream = make_stream(client, ['a'])
+
+    for frame in ['Hit', 'The', ' orc']:
+        stream(frame)
+    client.release.set()
+    stream.flush()
+
+    assert client.frames['a'] == [b'Hit', b'The', b' orc']
+
+
+@pytest.mark.parametrize('drop_policy, expected, dropped', [
+    ('drop_oldest', [b'{"n": 0}', b'{"n": 3}', b'{"n": 4}'], 2),
+    ('drop_newest', [b'{"n": 0}', b'{"n": 1}', b'{"n": 2}'], 2),
+    ('disconnect', [b'{"n": 0}'], 4),
+])
+def test_drop_policy_when_queue_is_full(drop_policy, expected, dropped):
+    client = FakeManagementClient()
+    sender = connection_sender.ConnectionSender(client, 'a', depth=2, drop_policy=drop_policy)
+
+    assert sender.put({'n': 0}, b'{"n": 0}')
+    sender._post(connection_sender.batch_frame(sender._queue.popleft()[0]))
+    for n in range(1, 5):
+        assert not sender.put({'n': n}, f'{{"n": {n}}}'.encode())
+    sender.drain()
+
+    assert client.frames['a'] == expected
+    assert sender.stats()['dropped'] == dropped
+
+
+class UnreachableManagementClient(FakeManagementClient):
+    def post_to_connection(self, Data, ConnectionId):
+        raise EndpointConnectionError(endpoint_url='https://example.execute-api.us-east-1.amazonaws.com')
+
+
+def test_connection_error_does_not_strand_the_queue():
+    stream = make_stream(UnreachableManagementClient(), ['a', 'b'])
+
+    stream({'msg': 'hello'})
+    stream({'msg': 'again'})
+
+    assert stream.flush(timeout=1)
+    assert stream.queue_stats()['a']['failed'] >= 1
+    assert stream.queue_stats()['a']['queue_depth'] == 0
+
+
+def test_drain_always_goes_idle(monkeypatch):
+    sender = connection_sender.ConnectionSender(FakeManagementClient(), 'a')
+    monkeypatch.setattr(sender, '_post', lambda message_bytes: 1 / 0)
+
+    assert sender.put({'n': 0}, b'{"n": 0}')
+    sender.put({'n': 1}, b'{"n": 1}')
+    with pytest.raises(ZeroDivisionError):
+        sender.drain()
+
+    assert sender.wait(0)
+    assert sender.put({'n': 2}, b'{"n": 2}')
+
+
+def test_finish_gives_up_on_a_stuck_connection(monkeypatch, removed):
+    release = threading.Event()
+
+    class StuckManagementClient(FakeManagementClient):
+        def post_to_connection(self, Data, ConnectionId):
+            release.wait(5)
+
+    monkeypatch.setattr(session_manager, 'SEND_DRAIN_TIMEOUT', 0.1)
+    stream = make_stream(StuckManagementClient(), ['a'])
+    stream({'msg': 'hello'})
+    try:
+        stream.finish()
+        assert not stream.flush(timeout=0)
+    finally:
+        release.set()
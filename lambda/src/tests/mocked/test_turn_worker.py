@@ -0,0 +1,147 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import utils.session_manager as session_manager
+import utils.websocket_handler as websocket_handler
+import utils.turn_worker as turn_worker
+from utils.turn_queue import LocalTurnQueue, SQSTurnQueue, make_turn_job
+
+ENDPOINT_URL = 'https://example.execute-api.us-east-1.amazonaws.com/production'
+
+
+@pytest.fixture
+def turn_queue(tmp_path):
+    return LocalTurnQueue(path=str(tmp_path / 'turns.jsonl'))
+
+
+@pytest.fixture
+def management_clients(monkeypatch):
+    clients = []
+    monkeypatch.setattr(
+        turn_worker.client_pool, 'get_management_client',
+        lambda endpoint_url: clients.append(endpoint_url) or SimpleNamespace(endpoint_url=endpoint_url)
+    )
+    return clients
+
+
+def test_local_queue_receives_jobs_in_order(turn_queue):
+    for msg in ('first', 'second', 'third'):
+        turn_queue.send(make_turn_job('test-session-id', 'conn', {'user': 'Seth', 'msg': msg}, ENDPOINT_URL))
+
+    first = turn_queue.receive(max_messages=2)
+    rest = turn_queue.receive(max_messages=2)
+
+    assert [json.loads(r['body'])['message']['msg'] for r in first['Records']] == ['first', 'second']
+    assert len(rest['Records']) == 1
+    assert len(turn_queue) == 0
+
+
+def test_sqs_queue_groups_fifo_jobs_by_session():
+    sent = []
+    queue = SQSTurnQueue('https://sqs/turns.fifo', sqs_client=SimpleNamespace(send_message=lambda **kwargs: sent.append(kwargs)))
+
+    job = make_turn_job('test-session-id', 'conn', {'msg': 'hi'}, ENDPOINT_URL)
+    queue.send(job)
+
+    assert sent[0]['MessageGroupId'] == 'test-session-id'
+    assert sent[0]['MessageDeduplicationId'] == job['job_id']
+
+
+def test_handle_message_queues_turn_without_running_it(monkeypatch, turn_queue):
+    monkeypatch.setattr(websocket_handler, 'TURN_DISPATCH', 'queue')
+    monkeypatch.setattr(websocket_handler, 'get_turn_queue', lambda: turn_queue)
+    monkeypatch.setattr(
+        websocket_handler.session_operations, 'get_session_id_for_connection',
+        lambda connection_table, connection_id: 'test-session-id'
+    )
+    monkeypatch.setattr(session_manager, 'add_entry', lambda **kwargs: pytest.fail("turn should be queued"))
+
+    status_code = websocket_handler.handle_message(
+        session_table=None,
+        connection_table=None,
+        turn_table=None,
+        connection_id='conn',
+        event_body={'user': 'Seth', 'msg': 'I cast a fireball.'},
+        llm_client=None,
+        api_gateway_management_client=SimpleNamespace(meta=SimpleNamespace(endpoint_url=ENDPOINT_URL))
+    )
+
+    assert status_code == 200
+    assert len(turn_queue) == 1
+
+
+def test_local_worker_runs_queued_turns(monkeypatch, turn_queue, management_clients):
+    entries = []
+    monkeypatch.setattr(session_manager, 'add_entry', lambda **kwargs: entries.append(kwargs) or {'statusCode': 200, 'body': '"Hit."'})
+    turn_queue.send(make_turn_job('test-session-id', 'conn', {'user': 'Seth', 'msg': 'I cast a fireball.'}, ENDPOINT_URL))
+
+    jobs_run = turn_worker.run_local_worker(turn_queue, None, None, None, None)
+
+    assert jobs_run == 1
+    assert entries[0]['session_id'] == 'test-session-id'
+    assert entries[0]['connection_id'] == 'conn'
+    assert entries[0]['message'] == {'user': 'Seth', 'msg': 'I cast a fireball.'}
+    assert management_clients == [ENDPOINT_URL]
+
+
+def test_handle_turn_jobs_reports_failed_jobs(monkeypatch, turn_queue, management_clients):
+    def add_entry(**kwargs):
+        if kwargs['message']['msg'] == 'bad':
+            raise RuntimeError("boom")
+        return {'statusCode': 200, 'body': '"Hit."'}
+    monkeypatch.setattr(session_manager, 'add_entry', add_entry)
+    good = make_turn_job('test-session-id', 'conn', {'msg': 'good'}, ENDPOINT_URL)
+    bad = make_turn_job('test-session-id', 'conn', {'msg': 'bad'}, ENDPOINT_URL)
+    turn_queue.send(good)
+    turn_queue.send(bad)
+
+    response = turn_worker.handle_turn_jobs(turn_queue.receive(), None, None, None, None, turn_queue=turn_queue)
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': bad['job_id']}]}
+
+
+def test_expired_failing_job_is_dead_lettered(monkeypatch, turn_queue, management_clients):
+    dead_letters = []
+    monkeypatch.setattr(session_manager, 'add_entry', lambda **kwargs: 1 / 0)
+    monkeypatch.setattr(turn_worker, 'get_dead_letter_queue', lambda: SimpleNamespace(send=dead_letters.append))
+    fresh = make_turn_job('test-session-id', 'conn', {'msg': 'fresh'}, ENDPOINT_URL)
+    expired = make_turn_job('test-session-id', 'conn', {'msg': 'expired'}, ENDPOINT_URL)
+    expired['enqueued_at'] -= turn_worker.TURN_JOB_MAX_AGE
+    turn_queue.send(fresh)
+    turn_queue.send(expired)
+
+    response = turn_worker.handle_turn_jobs(turn_queue.receive(), None, None, None, None, turn_queue=turn_queue)
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': fresh['job_id']}]}
+    assert [job['job_id'] for job in dead_letters] == [expired['job_id']]
+
+
+def test_job_is_retried_when_lease_is_held(monkeypatch, turn_queue, management_clients):
+    monkeypatch.setattr(
+        session_manager, 'add_entry',
+        lambda **kwargs: {'statusCode': 200, 'body': session_manager.LEASE_HELD_BODY}
+    )
+    job = make_turn_job('test-session-id', 'conn', {'user': 'Seth', 'msg': 'I swing.'}, ENDPOINT_URL)
+    turn_queue.send(job)
+
+    monkeypatch.setattr(turn_worker, 'LEASE_RETRY_DELAY', 30)
+
+    response = turn_worker.handle_turn_jobs(turn_queue.receive(), None, None, None, None, turn_queue=turn_queue)
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': job['job_id']}]}
+    # Held back for the retry delay, not dropped
+    assert len(turn_queue) == 1
+    assert turn_queue.receive()['Records'] == []
+
+
+def test_sqs_queue_defers_job_with_visibility_timeout():
+    calls = []
+    queue = SQSTurnQueue('https://sqs/turns.fifo', sqs_client=SimpleNamespace(
+        change_message_visibility=lambda **kwargs: calls.append(kwargs)
+    ))
+
+    queue.defer({'messageId': 'm', 'receiptHandle': 'receipt'}, 7)
+
+    assert calls == [{'QueueUrl': 'https://sqs/turns.fifo', 'ReceiptHandle': 'receipt', 'VisibilityTimeout': 7}]
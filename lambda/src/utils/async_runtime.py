@@ -0,0 +1,64 @@
+import asyncio
+import contextlib
+from typing import Any
+
+import structlog
+
+from utils.prompt_helper import apig_session
+
+logger = structlog.get_logger(__name__)
+
+# One event loop for the life of the container. aioboto3 clients and the async
+# OpenAI client hold connections bound to the loop they were opened on, so
+# keeping the loop lets warm invocations reuse them.
+_loop = None
+_exit_stack = None
+_clients: dict[str, Any] = {}
+_tables: dict[str, Any] = {}
+
+
+def get_loop():
+    global _loop, _exit_stack
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        _exit_stack = None
+        _clients.clear()
+        _tables.clear()
+    return _loop
+
+
+def run(coro):
+    """Runs a coroutine to completion on the shared event loop."""
+    return get_loop().run_until_complete(coro)
+
+
+async def _enter(context_manager):
+    global _exit_stack
+    if _exit_stack is None:
+        _exit_stack = contextlib.AsyncExitStack()
+    return await _exit_stack.enter_async_context(context_manager)
+
+
+async def get_client(service_name, endpoint_url=None):
+    key = (service_name, endpoint_url)
+    if key not in _clients:
+        _clients[key] = await _enter(apig_session.client(service_name, endpoint_url=endpoint_url))
+        logger.info("Async client opened", service=service_name, endpoint_url=endpoint_url)
+    return _clients[key]
+
+
+async def get_table(table_name):
+    if table_name not in _tables:
+        if 'dynamodb' not in _clients:
+            _clients['dynamodb'] = await _enter(apig_session.resource('dynamodb'))
+        _tables[table_name] = await _clients['dynamodb'].Table(table_name)
+    return _tables[table_name]
+
+
+async def close():
+    global _exit_stack
+    if _exit_stack is not None:
+        await _exit_stack.aclose()
+        _exit_stack = None
+    _clients.clear()
+    _tables.clear()
@@ -0,0 +1,71 @@
+import asyncio
+
+import structlog
+
+from botocore.exceptions import ClientError
+
+from utils.connection_registry import registry as connection_registry
+from utils.session_operations import (
+    TURN_LEASE_SECONDS,
+    acquire_lease_request,
+    connection_batches,
+    connection_ids_query,
+    expired_connection_item,
+    is_condition_failure,
+    release_lease_request,
+)
+
+logger = structlog.get_logger(__name__)
+
+# Counterparts of session_operations for aioboto3 tables, used by the async
+# turn pipeline. Requests are built by the same helpers as the sync versions.
+
+
+async def acquire_turn_lease(session_table, session_id, owner, lease_seconds=TURN_LEASE_SECONDS):
+    try:
+        response = await session_table.update_item(**acquire_lease_request(session_id, owner, lease_seconds))
+        return response['Attributes']
+    except ClientError as e:
+        if is_condition_failure(e):
+            logger.info("Turn lease not acquired")
+            return None
+        raise
+
+
+async def release_turn_lease(session_table, session_id, owner):
+    try:
+        await session_table.update_item(**release_lease_request(session_id, owner))
+    except ClientError as e:
+        if not is_condition_failure(e):
+            logger.exception("Couldn't release turn lease", exc_info=e)
+
+
+async def get_connection_ids(connection_table, session_id):
+    query_kwargs = connection_ids_query(session_id)
+    connection_ids = []
+    while True:
+        response = await connection_table.query(**query_kwargs)
+        connection_ids.extend(item['connection_id'] for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return connection_ids
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+async def expire_connections(connection_table, session_id, connection_ids):
+    await asyncio.gather(*[
+        _expire_connection_batch(connection_table, session_id, batch)
+        for batch in connection_batches(connection_ids)
+    ])
+    for connection_id in connection_ids:
+        connection_registry.discard(connection_id)
+
+
+async def _expire_connection_batch(connection_table, session_id, connection_ids):
+    async with connection_table.batch_writer() as batch:
+        for connection_id in connection_ids:
+            await batch.put_item(Item=expired_connection_item(session_id, connection_id))
+
+
+async def save_replay(replay_table, session_id, segment):
+    await replay_table.put_item(Item=dict(segment, session_id=session_id))
+
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import boto3
+import structlog
+from botocore.exceptions import ClientError
+
+from utils.dynamodb_calls import counter as dynamodb_calls
+from utils.lazy import LazyObject
+
+logger = structlog.get_logger(__name__)
+
+BIO_CACHE_ENABLED = os.getenv('BIO_CACHE', 'off') == 'on'
+BIO_CACHE_SIZE = int(os.getenv('BIO_CACHE_SIZE', '256'))
+BIO_CACHE_TTL = int(os.getenv('BIO_CACHE_TTL', str(3600 * 24 * 30)))
+BIO_CACHE_TABLE = os.getenv('BIO_CACHE_TABLE', 'dd-infra-bio-cache')
+
+
+def normalize(text):
+    return ' '.join(str(text).split()).casefold()
+
+
+def prompt_version(instructions, model):
+    """Changes whenever the bio prompt or model does, so stale bios are never served."""
+    return hashlib.sha256(f"{model}\n{instructions}".encode('utf-8')).hexdigest()[:12]
+
+
+def cache_key(user, version):
+    return f"{version}#{normalize(user['name'])}#{normalize(user.get('role', ''))}"
+
+
+def character_for(user, bios):
+    """The character name under which a user's bio was generated, if any."""
+    first_name = normalize(user['name']).split(' ')[0]
+    for character in bios:
+        if normalize(character) == first_name:
+            return character
+    return None
+
+
+class BioCache:
+    """
+    Two tier cache of generated character bios keyed by normalised name, role
+    and prompt version.
+
+    The first tier is an LRU held for the life of a warm container. Misses fall
+    through to a shared DynamoDB table whose items expire after `ttl` seconds.
+    Table errors are logged and treated as misses, so the cache can only ever
+    save an LLM run, never fail one.
+    """
+    def __init__(self, table, version, max_size=BIO_CACHE_SIZE, ttl=BIO_CACHE_TTL):
+        self.table = table
+        self.version = version
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.lru_hits = 0
+        self.table_hits = 0
+        self.misses = 0
+        self.puts = 0
+
+    def get(self, user):
+        """
+        :return: A (character, bio) pair, or None on a miss.
+        """
+        key = cache_key(user, self.version)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.lru_hits += 1
+                return self._entries[key]
+        try:
+            item = self.table.get_item(Key={'cache_key': key}).get('Item')
+        except ClientError as e:
+            logger.exception("Couldn't read bio cache", exc_info=e)
+            item = None
+        if item is None or int(item.get('expiration_time', 0)) <= time.time():
+            with self._lock:
+                self.misses += 1
+            return None
+        entry = (item['character'], item['bio'])
+        with self._lock:
+            self.table_hits += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, user, character, bio):
+        key = cache_key(user, self.version)
+        with self._lock:
+            self.puts += 1
+            self._remember(key, (character, bio))
+        try:
+            self.table.put_item(Item={
+                'cache_key': key,
+                'character': character,
+                'bio': bio,
+                'expiration_time': int(time.time()) + self.ttl,
+            })
+        except ClientError as e:
+            logger.exception("Couldn't write bio cache", exc_info=e)
+
+    def lookup(self, users):
+        """
+        Splits users into those with a cached bio and those without.
+
+        :return: A dict of character name to bio for the hits, and the list of
+                 users that missed.
+        """
+        bios = {}
+        missed = []
+        for user in users:
+            entry = self.get(user)
+            if entry is None:
+                missed.append(user)
+            else:
+                bios[entry[0]] = entry[1]
+        return bios, missed
+
+    def store(self, users, bios):
+        """Caches the generated bio of each user it can be matched back to."""
+        for user in users:
+            character = character_for(user, bios)
+            if character is not None:
+                self.put(user, character, bios[character])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.lru_hits = 0
+            self.table_hits = 0
+            self.misses = 0
+            self.puts = 0
+
+    def stats(self):
+        lookups = self.lru_hits + self.table_hits + self.misses
+        return {
+            'lru_hits': self.lru_hits,
+            'table_hits': self.table_hits,
+            'misses': self.misses,
+            'puts': self.puts,
+            'hit_rate': (self.lru_hits + self.table_hits) / lookups if lookups else 0.0,
+            'size': len(self._entries),
+        }
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+def _create_bio_cache():
+    from utils import prompt_helper
+    table = boto3.resource('dynamodb').Table(BIO_CACHE_TABLE)
+    dynamodb_calls.instrument(table.meta.client)
+    return BioCache(
+        table=table,
+        version=prompt_version(
+            prompt_helper.assistant_instructions,
+            f"{prompt_helper.ASSISTANT_ID}/{prompt_helper.BIO_MODEL}"
+        )
+    )
+
+bio_cache = LazyObject('bio_cache', _create_bio_cache)
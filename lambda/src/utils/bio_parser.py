@@ -0,0 +1,67 @@
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+BIO_START = '_____________________'
+BIO_END = '====================='
+
+
+class BioStreamParser:
+    """
+    Splits a streamed character bio response into one bio per character.
+
+    Text is fed in as it arrives. A bio opens after a `BIO_START` line, is named
+    after the first word of its first line and closes on a `BIO_END` line, at
+    which point `on_bio(name, bio)` is called straight away. `close` must be
+    called at the end of the stream; a final bio with no end delimiter is
+    emitted then.
+    """
+    def __init__(self, on_bio=None):
+        self.on_bio = on_bio
+        self.bios = {}
+        self._partial_line = ''
+        self._character = None
+        self._content = []
+
+    def feed(self, text):
+        if not text:
+            return
+        lines = (self._partial_line + text).split('\n')
+        self._partial_line = lines.pop()
+        for line in lines:
+            self._parse_line(line)
+
+    def close(self):
+        if self._partial_line:
+            self._parse_line(self._partial_line)
+            self._partial_line = ''
+        if self._character and self._content:
+            self._emit('\n'.join(self._content).replace('^', ''))
+        return self.bios
+
+    def _parse_line(self, line):
+        line = line.strip()
+        if line == BIO_END:
+            if self._character and self._content:
+                self._emit('\n'.join(self._content))
+        elif line == BIO_START:
+            return
+        elif not self._character and line and not line.startswith(BIO_START):
+            # First non-empty line after a delimiter names the character
+            self._character = line.split()[0]
+            self._content.append(line)
+        elif self._character and line:
+            self._content.append(line)
+
+    def _emit(self, bio):
+        character = self._character
+        self.bios[character] = bio
+        self._character = None
+        self._content = []
+        if self.on_bio is not None:
+            self.on_bio(character, bio)
+
+
+def bio_event(character, bio):
+    """The structured frame sent to connections when a character's bio completes."""
+    return {'type': 'character_bio', 'character': character, 'bio': bio}
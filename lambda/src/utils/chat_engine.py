@@ -0,0 +1,191 @@
+import json
+import os
+import random
+import time
+
+import structlog
+
+from utils import prompt_helper
+from utils.metrics import metrics
+from utils.session_operations import DUNGEON_MASTER
+from utils.stream_buffer import CoalescingBuffer
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = structlog.get_logger(__name__)
+
+# 'chat' builds each prompt locally and runs it through Chat Completions
+# instead of running the assistant on the session's thread
+DM_ENGINE = os.getenv('DM_ENGINE', 'assistants')
+CHAT_MODEL = os.getenv('CHAT_MODEL', 'gpt-4o-mini')
+# Tokens allowed for the session's context after the static instructions
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '6000'))
+# Most recent turns read for each prompt; the window is cut from these
+HISTORY_FETCH_TURNS = int(os.getenv('HISTORY_FETCH_TURNS', '60'))
+SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', '400'))
+# Turns that fell out of the window are folded into the summary in batches,
+# once there are this many of them or they add up to this many tokens
+SUMMARY_BATCH_TURNS = int(os.getenv('SUMMARY_BATCH_TURNS', '8'))
+SUMMARY_BATCH_TOKENS = int(os.getenv('SUMMARY_BATCH_TOKENS', '1500'))
+# Overhead of the role and separators around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+
+
+def count_tokens(text):
+    global _encoding
+    if tiktoken is None:
+        # Close enough for English prose to keep a window inside its budget
+        return len(text) // 4 + 1
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding('o200k_base')
+    return len(_encoding.encode(text))
+
+
+def to_chat_message(turn):
+    if turn['user'] == DUNGEON_MASTER:
+        return {'role': 'assistant', 'content': turn['msg']}
+    # Actions are sent in the same shape the assistant receives them
+    return {'role': 'user', 'content': json.dumps({'user': turn['user'], 'msg': turn['msg']})}
+
+
+def build_messages(session, turns, user_action, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Assembles the prompt for an action from the session's history.
+
+    The static instructions come first and are identical for every session, so
+    the provider can reuse its cached prefix. The party, the running story
+    summary and as many of the most recent turns as fit in `budget` tokens
+    follow, oldest first, then the action itself.
+
+    :param turns: The session's most recent turns, oldest first.
+    :return: The messages, and the turns that did not fit in the window.
+    """
+    messages = [{'role': 'system', 'content': prompt_helper.assistant_instructions}]
+    if session.get('user_bios'):
+        messages.append({
+            'role': 'system',
+            'content': f"The party:\n{prompt_helper.format_bios(session['user_bios'])}"
+        })
+    if session.get('story_summary'):
+        messages.append({'role': 'system', 'content': f"The story so far:\n{session['story_summary']}"})
+    action_message = to_chat_message(user_action)
+
+    remaining = budget - sum(
+        count_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS
+        for message in messages[1:] + [action_message]
+    )
+    window_start = len(turns)
+    while window_start > 0:
+        cost = count_tokens(turns[window_start - 1]['msg']) + MESSAGE_OVERHEAD_TOKENS
+        if cost > remaining:
+            break
+        remaining -= cost
+        window_start -= 1
+
+    messages.extend(to_chat_message(turn) for turn in turns[window_start:])
+    messages.append(action_message)
+    return messages, turns[:window_start]
+
+
+def unsummarized_turns(session, older_turns):
+    if 'summary_through' not in session:
+        return list(older_turns)
+    summarized_through = int(session['summary_through'])
+    return [turn for turn in older_turns if int(turn['turn']) > summarized_through]
+
+
+def summary_due(turns):
+    """
+    Whether the turns outside the window are enough to summarize. Until they
+    are, they drop out of the prompt without a summary call on every turn.
+    """
+    if not turns:
+        return False
+    return (len(turns) >= SUMMARY_BATCH_TURNS
+            or sum(count_tokens(turn['msg']) for turn in turns) >= SUMMARY_BATCH_TOKENS)
+
+
+def process_action(llm_client, session, turns, user_action, stream_to_connections):
+    """
+    Chat Completions counterpart of `prompt_helper.process_action`.
+
+    :return: The reply, and the turns that fell out of the window without yet
+             being folded into the session's story summary, once there are
+             enough of them to summarize (see `summary_due`).
+    """
+    logger.info("Processing action", engine='chat', action=user_action)
+    try:
+        messages, older_turns = build_messages(session, turns, user_action)
+        reply = stream_chat(llm_client, messages, stream_to_connections)
+        unsummarized = unsummarized_turns(session, older_turns)
+        logger.info(
+            "Action processed successfully",
+            window_turns=len(turns) - len(older_turns),
+            unsummarized_turns=len(unsummarized)
+        )
+        return reply, unsummarized if summary_due(unsummarized) else []
+    except Exception as e:
+        logger.error("Error processing action", error=str(e))
+        return random.choice(prompt_helper.error_responses), []
+
+
+def stream_chat(llm_client, messages, stream_to_connections):
+    buffer = CoalescingBuffer(stream_to_connections)
+    parts = []
+    usage = None
+    started = time.perf_counter()
+    first_token_at = None
+    stream = llm_client.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=messages,
+        stream=True,
+        stream_options={'include_usage': True}
+    )
+    try:
+        for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage.model_dump()
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(chunk.choices[0].delta.content)
+                buffer.write(chunk.choices[0].delta.content)
+    finally:
+        buffer.close()
+    if first_token_at is not None:
+        metrics.record('chat.time_to_first_token', first_token_at - started)
+    metrics.record('chat.run', time.perf_counter() - started)
+    logger.info(
+        "Chat completion streamed",
+        usage=usage,
+        time_to_first_token=first_token_at - started if first_token_at else None,
+        duration=time.perf_counter() - started
+    )
+    return ''.join(parts)
+
+
+def summarize(llm_client, summary, turns):
+    """
+    Folds turns into the running story summary.
+
+    :return: The new summary.
+    """
+    transcript = '\n'.join(f"{turn['user']}: {turn['msg']}" for turn in turns)
+    prompt = (
+        "Update the summary of this Dungeons and Dragons session with the new events. "
+        "Keep every character, item, injury and unresolved thread that may matter later. "
+        "Reply with the summary only.\n\n"
+        f"Summary so far:\n{summary or 'The session has just begun.'}\n\n"
+        f"New events:\n{transcript}"
+    )
+    completion = llm_client.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=[{'role': 'user', 'content': prompt}],
+        max_tokens=SUMMARY_MAX_TOKENS
+    )
+    return completion.choices[0].message.content
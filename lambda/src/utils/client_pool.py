@@ -0,0 +1,63 @@
+import threading
+import time
+from typing import Any
+
+import boto3
+import structlog
+from botocore.config import Config
+
+from utils.session_manager import FANOUT_MAX_WORKERS
+
+logger = structlog.get_logger(__name__)
+
+# Clients are thread safe and live for the life of a warm container
+_clients: dict[str, Any] = {}
+_lock = threading.Lock()
+_stats = {'created': 0, 'reused': 0, 'construction_seconds': 0.0}
+
+
+def get_management_client(endpoint_url):
+    """
+    Returns the API Gateway management client for an endpoint, constructing it
+    on first use. The connection pool is sized to the fan-out thread pool so
+    concurrent posts never wait for a connection.
+
+    :param endpoint_url: The https URL of the websocket API stage.
+    """
+    with _lock:
+        client = _clients.get(endpoint_url)
+        if client is not None:
+            _stats['reused'] += 1
+            return client
+        start = time.perf_counter()
+        client = boto3.client(
+            "apigatewaymanagementapi",
+            endpoint_url=endpoint_url,
+            config=Config(max_pool_connections=FANOUT_MAX_WORKERS)
+        )
+        _stats['construction_seconds'] += time.perf_counter() - start
+        _stats['created'] += 1
+        _clients[endpoint_url] = client
+        logger.info("Created API Gateway management client", endpoint_url=endpoint_url, **pool_stats())
+        return client
+
+
+def pool_stats():
+    """
+    :return: Clients created and reused, and the construction time saved by
+             reuse, estimated from the mean construction time.
+    """
+    created = _stats['created']
+    mean_construction = _stats['construction_seconds'] / created if created else 0.0
+    return {
+        'clients_created': created,
+        'clients_reused': _stats['reused'],
+        'construction_seconds': _stats['construction_seconds'],
+        'construction_saved_seconds': _stats['reused'] * mean_construction,
+    }
+
+
+def clear():
+    with _lock:
+        _clients.clear()
+        _stats.update(created=0, reused=0, construction_seconds=0.0)
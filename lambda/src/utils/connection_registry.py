@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+REGISTRY_TTL = float(os.getenv('CONNECTION_REGISTRY_TTL', '15'))
+
+
+class ConnectionRegistry:
+    """
+    In-process cache of the connection IDs for each session.
+
+    Lives for the life of a warm Lambda container. Entries expire after `ttl`
+    seconds so connections made through other containers are picked up. Connects,
+    disconnects and GoneExceptions seen by this container update the cached
+    entries directly.
+    """
+    def __init__(self, ttl=REGISTRY_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, session_id):
+        """
+        :return: The cached connection IDs for the session, or None when there is
+                 no live entry.
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry[0] <= time.monotonic():
+                self._entries.pop(session_id, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(entry[1])
+
+    def put(self, session_id, connection_ids):
+        with self._lock:
+            self._entries[session_id] = (time.monotonic() + self.ttl, list(connection_ids))
+
+    def add(self, session_id, connection_id):
+        # Only extend a live entry; a partial list would hide other connections
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and connection_id not in entry[1]:
+                entry[1].append(connection_id)
+
+    def discard(self, connection_id):
+        with self._lock:
+            for _, connection_ids in self._entries.values():
+                if connection_id in connection_ids:
+                    connection_ids.remove(connection_id)
+
+    def invalidate(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'sessions': len(self._entries),
+        }
+
+
+registry = ConnectionRegistry()
@@ -0,0 +1,200 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import structlog
+from botocore.exceptions import ClientError
+
+logger = structlog.get_logger(__name__)
+
+SEND_QUEUE_DEPTH = int(os.getenv('SEND_QUEUE_DEPTH', '64'))
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', '5'))
+SEND_BACKOFF_BASE = float(os.getenv('SEND_BACKOFF_BASE', '0.05'))
+SEND_BACKOFF_MAX = float(os.getenv('SEND_BACKOFF_MAX', '1.0'))
+# What a full queue does with a new frame: 'drop_oldest', 'drop_newest',
+# or 'disconnect' to stop sending to the connection altogether
+SEND_DROP_POLICY = os.getenv('SEND_DROP_POLICY', 'drop_oldest')
+# How long the end of a turn waits for the send queues to drain
+SEND_DRAIN_TIMEOUT = float(os.getenv('SEND_DRAIN_TIMEOUT', '10'))
+# API Gateway rejects websocket frames over 32 KB
+MAX_FRAME_BYTES = 32 * 1024
+
+THROTTLING_CODES = ('LimitExceededException', 'TooManyRequestsException', 'ThrottlingException')
+DROP_POLICIES = ('drop_oldest', 'drop_newest', 'disconnect')
+BATCH_PREFIX = b'{"type": "batch", "frames": ['
+BATCH_SUFFIX = b']}'
+
+
+def is_throttled(error):
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in THROTTLING_CODES
+
+
+def backoff_delay(attempt, base=SEND_BACKOFF_BASE, cap=SEND_BACKOFF_MAX):
+    # Full jitter, so throttled senders don't retry in lockstep
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def is_mergeable(message):
+    # Only sequenced frames are merged, into a batch the client unpacks, so
+    # each keeps its own sequence number
+    return isinstance(message, dict) and 'seq' in message
+
+
+def batch_frame(parts):
+    if len(parts) == 1:
+        return parts[0]
+    return BATCH_PREFIX + b', '.join(parts) + BATCH_SUFFIX
+
+
+def fits_batch(parts, message_bytes):
+    size = len(BATCH_PREFIX) + len(BATCH_SUFFIX) + sum(len(part) + 2 for part in parts)
+    return size + len(message_bytes) <= MAX_FRAME_BYTES
+
+
+class ConnectionSender:
+    """
+    The send queue of one websocket connection.
+
+    Frames are queued and posted in order by a single drain at a time, so a
+    slow or throttled connection falls behind without holding up the others.
+    Sequenced frames that queue up behind a send in flight are merged into one
+    batch frame. Throttled posts are retried with exponential backoff and
+    jitter. When the queue holds `depth` frames, `drop_policy` decides what
+    gives.
+    """
+    def __init__(self, api_gateway_management_client, connection_id, on_sent=None, on_gone=None,
+                 depth=SEND_QUEUE_DEPTH, drop_policy=SEND_DROP_POLICY, max_retries=SEND_MAX_RETRIES):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy {drop_policy!r}")
+        self.api_gateway_management_client = api_gateway_management_client
+        self.connection_id = connection_id
+        self.on_sent = on_sent
+        self.on_gone = on_gone
+        self.depth = depth
+        self.drop_policy = drop_policy
+        self.max_retries = max_retries
+        self.gone = False
+        self.disconnected = False
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._draining = False
+        self._idle = threading.Event()
+        self._idle.set()
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.retries = 0
+        self.failed = 0
+        self.max_depth = 0
+
+    def put(self, message, message_bytes):
+        """
+        Queues a frame.
+
+        :return: True if a drain must be started for the frame to be sent.
+        """
+        with self._lock:
+            if self.gone or self.disconnected:
+                self.dropped += 1
+                return False
+            mergeable = is_mergeable(message)
+            last = self._queue[-1] if self._queue else None
+            if mergeable and last is not None and last[1] and fits_batch(last[0], message_bytes):
+                last[0].append(message_bytes)
+                self.merged += 1
+            elif len(self._queue) >= self.depth:
+                self._apply_drop_policy(message_bytes, mergeable)
+            else:
+                self._queue.append(([message_bytes], mergeable))
+            self.max_depth = max(self.max_depth, len(self._queue))
+            if self._draining or not self._queue:
+                return False
+            self._draining = True
+            self._idle.clear()
+            return True
+
+    def _apply_drop_policy(self, message_bytes, mergeable):
+        self.dropped += 1
+        if self.drop_policy == 'drop_oldest':
+            self._queue.popleft()
+            self._queue.append(([message_bytes], mergeable))
+        elif self.drop_policy == 'disconnect':
+            self.dropped += len(self._queue)
+            self._queue.clear()
+            self.disconnected = True
+            logger.warning("Connection fell too far behind, no longer sending", connection_id=self.connection_id)
+
+    def drain(self):
+        """Posts queued frames until the queue is empty."""
+        finished = False
+        try:
+            while True:
+                with self._lock:
+                    if not self._queue or self.gone:
+                        self._queue.clear()
+                        self._draining = False
+                        self._idle.set()
+                        finished = True
+                        return
+                    parts, _ = self._queue.popleft()
+                self._post(batch_frame(parts))
+        finally:
+            # Whatever stopped the drain, a waiter must not hang on it
+            if not finished:
+                with self._lock:
+                    self.dropped += len(self._queue)
+                    self._queue.clear()
+                    self._draining = False
+                    self._idle.set()
+
+    def _post(self, message_bytes):
+        start = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.api_gateway_management_client.post_to_connection(
+                    Data=message_bytes, ConnectionId=self.connection_id
+                )
+                self.sent += 1
+                if self.on_sent:
+                    self.on_sent(self.connection_id, time.perf_counter() - start)
+                return
+            except self.api_gateway_management_client.exceptions.GoneException as e:
+                logger.info("Connection %s is gone, removing.", self.connection_id, exc_info=e)
+                self.gone = True
+                if self.on_gone:
+                    self.on_gone(self.connection_id)
+                return
+            except ClientError as e:
+                if is_throttled(e) and attempt < self.max_retries:
+                    self.retries += 1
+                    time.sleep(backoff_delay(attempt))
+                    continue
+                logger.exception("Couldn't post to connection %s.", self.connection_id, exc_info=e)
+                self.failed += 1
+                return
+            except Exception as e:
+                # Connection errors and timeouts from botocore aren't ClientErrors
+                logger.exception("Couldn't post to connection %s.", self.connection_id, exc_info=e)
+                self.failed += 1
+                return
+
+    def wait(self, timeout=None):
+        return self._idle.wait(timeout)
+
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+
+    def stats(self):
+        return {
+            'queue_depth': len(self._queue),
+            'max_depth': self.max_depth,
+            'sent': self.sent,
+            'merged': self.merged,
+            'dropped': self.dropped,
+            'retries': self.retries,
+            'failed': self.failed,
+            'drop_policy': self.drop_policy,
+        }
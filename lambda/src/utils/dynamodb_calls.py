@@ -0,0 +1,42 @@
+import threading
+from collections import Counter
+
+
+class DynamoDBCallCounter:
+    """
+    Counts DynamoDB API calls by operation.
+
+    Hooked into a client's event system, so every call made through the client
+    or a resource built on it is counted, batch writers included. The handler
+    resets it at the start of each invocation and logs it at the end.
+    """
+    def __init__(self):
+        self._calls = Counter()
+        self._lock = threading.Lock()
+
+    def instrument(self, client):
+        client.meta.events.register(
+            'before-parameter-build.dynamodb',
+            self._record,
+            unique_id='dynamodb-call-counter'
+        )
+        return client
+
+    def _record(self, model, **kwargs):
+        with self._lock:
+            self._calls[model.name] += 1
+
+    def reset(self):
+        with self._lock:
+            self._calls.clear()
+
+    @property
+    def total(self):
+        return sum(self._calls.values())
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._calls)
+
+
+counter = DynamoDBCallCounter()
@@ -0,0 +1,173 @@
+import asyncio
+import time
+
+from openai import AssistantEventHandler, AsyncAssistantEventHandler
+from typing_extensions import override
+
+from utils.metrics import metrics
+from utils.stream_buffer import CoalescingBuffer
+
+
+class ReplyCapture:
+    """Assembles the assistant's reply from a run's events."""
+    def _init_capture(self):
+        self._text_parts = []
+        self.final_text = None
+        self.usage = None
+        # Handlers are built just before the run starts
+        self._started = time.perf_counter()
+
+    @property
+    def response_text(self):
+        """
+        The assistant's reply, taken from the completed message, or assembled
+        from the deltas if the stream ended before the message completed.
+        """
+        if self.final_text is not None:
+            return self.final_text
+        if self._text_parts:
+            return ''.join(self._text_parts)
+        return None
+
+    def _capture_delta(self, delta):
+        if not self._text_parts:
+            metrics.record('openai.time_to_first_token', time.perf_counter() - self._started)
+        self._text_parts.append(delta.value or '')
+
+    def _capture_message(self, message):
+        texts = [block.text.value for block in message.content if block.type == 'text']
+        if texts:
+            self.final_text = texts[0]
+
+    def _capture_usage(self, event):
+        if event.event == 'thread.run.completed' and event.data.usage:
+            self.usage = event.data.usage.model_dump()
+
+    def _write_tool_call_delta(self, delta):
+        if delta.type == 'code_interpreter':
+            if delta.code_interpreter.input:
+                self.buffer.write(delta.code_interpreter.input)
+            if delta.code_interpreter.outputs:
+                self.buffer.write(f"\n\noutput >")
+                for output in delta.code_interpreter.outputs:
+                    if output.type == "logs":
+                        self.buffer.write(f"\n{output.logs}")
+
+
+class EventHandler(ReplyCapture, AssistantEventHandler):
+    def __init__(self, stream_to_connections, on_delta=None):
+        super().__init__()
+        self._init_capture()
+        self.stream_to_connections = stream_to_connections
+        # Sees each text delta after it has been written to the buffer
+        self.on_delta = on_delta
+        # Deltas are coalesced before they reach the websocket
+        self.buffer = CoalescingBuffer(stream_to_connections)
+
+    @override
+    def on_text_created(self, text) -> None:
+        self.buffer.write(text.value)
+
+    @override
+    def on_text_delta(self, delta, snapshot):
+        self._capture_delta(delta)
+        self.buffer.write(delta.value)
+        if self.on_delta is not None:
+            self.on_delta(delta.value)
+
+    @override
+    def on_message_done(self, message):
+        self._capture_message(message)
+
+    @override
+    def on_event(self, event):
+        self._capture_usage(event)
+
+    @override
+    def on_tool_call_created(self, tool_call):
+        self.buffer.write(f"\nassistant > {tool_call.type}\n")
+
+    @override
+    def on_tool_call_delta(self, delta, snapshot):
+        self._write_tool_call_delta(delta)
+
+    @override
+    def on_end(self):
+        self.buffer.flush()
+
+
+class AsyncEventHandler(ReplyCapture, AsyncAssistantEventHandler):
+    """
+    Streams a run's coalesced frames into an asyncio queue.
+
+    The queue is bounded, so a slow fan-out holds back reading from the model
+    rather than letting frames pile up in memory. Buffered text is flushed at
+    its deadline by a task on the event loop, rather than the buffer's timer
+    thread, so it is sent even while the model pauses.
+    """
+    def __init__(self, frames):
+        super().__init__()
+        self._init_capture()
+        self.frames = frames
+        self._pending = []
+        self._drain_lock = asyncio.Lock()
+        self._deadline_task = None
+        self.buffer = CoalescingBuffer(self._pending.append, flush_timer=False)
+
+    async def _drain(self):
+        await self._put_pending()
+        if self.buffer.deadline() is not None and (self._deadline_task is None or self._deadline_task.done()):
+            self._deadline_task = asyncio.create_task(self._flush_on_deadline())
+
+    async def _put_pending(self):
+        # Frames keep their order when the deadline task drains alongside a delta
+        async with self._drain_lock:
+            while self._pending:
+                await self.frames.put(self._pending.pop(0))
+
+    async def _flush_on_deadline(self):
+        while (deadline := self.buffer.deadline()) is not None:
+            await asyncio.sleep(deadline - time.monotonic())
+            self.buffer.flush_due()
+            await self._put_pending()
+
+    async def close(self):
+        if self._deadline_task is not None:
+            self._deadline_task.cancel()
+            await asyncio.gather(self._deadline_task, return_exceptions=True)
+        self.buffer.close()
+        await self._drain()
+
+    @override
+    async def on_text_created(self, text) -> None:
+        self.buffer.write(text.value)
+        await self._drain()
+
+    @override
+    async def on_text_delta(self, delta, snapshot):
+        self._capture_delta(delta)
+        self.buffer.write(delta.value)
+        await self._drain()
+
+    @override
+    async def on_message_done(self, message):
+        self._capture_message(message)
+
+    @override
+    async def on_event(self, event):
+        self._capture_usage(event)
+
+    @override
+    async def on_tool_call_created(self, tool_call):
+        self.buffer.write(f"\nassistant > {tool_call.type}\n")
+        await self._drain()
+
+    @override
+    async def on_tool_call_delta(self, delta, snapshot):
+        self._write_tool_call_delta(delta)
+        await self._drain()
+
+    @override
+    async def on_end(self):
+        self.buffer.flush()
+        await self._drain()
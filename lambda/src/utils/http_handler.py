@@ -1,49 +1,85 @@
+import base64
+import gzip
 import json
 import os
 import structlog
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 import utils.session_manager as session_manager
+import utils.client_pool as client_pool
+from utils import async_runtime
 
 logger = structlog.get_logger(__name__)
 
 wss_url = os.getenv("WEBSOCKET_API_URL")
-
-import boto3
+MAX_PAGE_SIZE = 500
+# Bodies smaller than this are sent as-is; compressing them saves next to nothing
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', '1024'))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
 
 
 response_headers = {
     "Access-Control-Allow-Origin": "*",
-    "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,Access-Control-Allow-Headers,Access-Control-Allow-Origin",
+    "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,Access-Control-Allow-Headers,Access-Control-Allow-Origin,If-None-Match",
     "Access-Control-Allow-Methods": "DELETE,GET,OPTIONS,POST",
+    "Access-Control-Expose-Headers": "ETag",
     "Content-Type": "text/html"
 }
 
-def handle_http_request(event, session_table, connection_table, llm_client):
+def handle_http_request(event, session_table, connection_table, turn_table, llm_client):
     method = event['httpMethod']
     session_id = event['pathParameters']['id']
     structlog.contextvars.bind_contextvars(session_id=session_id)   
 
     if method == 'GET':
         logger.info("Handling GET request")
-        response = session_manager.get_session(session_table, session_id)
+        try:
+            since, limit = parse_turn_cursor(event.get('queryStringParameters') or {})
+        except ValueError as e:
+            since = limit = None
+            response = {
+                'statusCode': 400,
+                'body': json.dumps({'error': str(e)}),
+            }
+        else:
+            response = session_manager.get_session(
+                session_table,
+                session_id,
+                turn_table,
+                since=since,
+                limit=limit,
+                if_none_match=get_header(event, 'If-None-Match')
+            )
     elif method == 'POST':
         logger.info("Handling POST request")
-        body = json.loads(event['body'])
+        body = event['body']
+        if event.get('isBase64Encoded'):
+            body = base64.b64decode(body)
+        body = json.loads(body)
         stage = event.get("requestContext", {}).get("stage")
-        api_gateway_management_client = boto3.client(
-            "apigatewaymanagementapi", endpoint_url=f"{wss_url}/{stage}"
-        )
-        response = session_manager.add_entry(
+        api_gateway_management_client = client_pool.get_management_client(f"{wss_url}/{stage}")
+        logger.info("API Gateway management client ready", **client_pool.pool_stats())
+        entry_kwargs = dict(
             session_table=session_table,
             llm_client=llm_client,
             session_id=session_id,
             message=body,
             connection_table=connection_table,
+            turn_table=turn_table,
             api_gateway_management_client=api_gateway_management_client
         )
+        if session_manager.TURN_PIPELINE == 'async':
+            response = async_runtime.run(session_manager.add_entry_async(**entry_kwargs))
+        else:
+            response = session_manager.add_entry(**entry_kwargs)
     elif method == 'DELETE':
         logger.info("Handling DELETE request")
-        response = session_manager.delete_session(session_table, session_id, connection_table)
+        response = session_manager.delete_session(session_table, session_id, connection_table, turn_table, llm_client)
     else:
         logger.warning("Unsupported HTTP method", method=method)
         response = {
@@ -52,5 +88,97 @@ def handle_http_request(event, session_table, connection_table, llm_client):
             }
 
         logger.info("Lambda function completed", response_status=response['statusCode'])
-    response['headers'] = response_headers
+    response['headers'] = response_headers | response.get('headers', {})
+    compress_response(response, get_header(event, 'Accept-Encoding'))
     return response
+
+
+def choose_encoding(accept_encoding):
+    """
+    Picks the best content encoding the client accepts.
+
+    :param accept_encoding: The Accept-Encoding request header, or None.
+    :return: 'br', 'gzip' or None when neither is acceptable.
+    """
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    supported = ['br', 'gzip'] if brotli is not None else ['gzip']
+    candidates = [
+        coding for coding in supported
+        if accepted.get(coding, accepted.get('*', 0.0)) > 0
+    ]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda coding: accepted.get(coding, accepted.get('*', 0.0)))
+
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def compress_response(response, accept_encoding, min_bytes=COMPRESSION_MIN_BYTES):
+    """
+    Compresses the response body in place when the client accepts it and the
+    body is at least `min_bytes`. Compressed bodies are base64 encoded for API
+    Gateway.
+    """
+    body = response.get('body')
+    if not body or response.get('isBase64Encoded'):
+        return response
+    data = body.encode('utf-8')
+    if len(data) < min_bytes:
+        return response
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return response
+    compressed = compress_body(data, encoding)
+    if len(compressed) >= len(data):
+        return response
+    response['body'] = base64.b64encode(compressed).decode('ascii')
+    response['isBase64Encoded'] = True
+    response['headers'] = response.get('headers', {}) | {
+        'Content-Encoding': encoding,
+        'Vary': 'Accept-Encoding',
+    }
+    return response
+
+
+def parse_turn_cursor(query_parameters):
+    """
+    Reads the `since` turn cursor and `limit` page size from a GET request.
+
+    :return: A tuple of (since, limit); either is None when not supplied.
+    :raises ValueError: When a parameter is not an integer or the limit is out
+                        of range.
+    """
+    since = query_parameters.get('since')
+    limit = query_parameters.get('limit')
+    try:
+        since = int(since) if since is not None else None
+        limit = int(limit) if limit is not None else None
+    except ValueError:
+        raise ValueError("since and limit must be integers")
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return since, limit
+
+
+def get_header(event, name):
+    headers = event.get('headers') or {}
+    for key, value in headers.items():
+        if key.lower() == name.lower():
+            return value
+    return None
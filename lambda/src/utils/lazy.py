@@ -0,0 +1,58 @@
+import importlib
+import threading
+import time
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+# Name of each lazily loaded resource to the seconds its first load took
+_load_times: dict[str, float] = {}
+
+
+class LazyObject:
+    """
+    Stands in for an expensive object until it is first used.
+
+    The factory runs once, on the first attribute access or call to `get`, and
+    the time it took is recorded under `name` so cold start cost can be
+    attributed to the route that paid for it.
+    """
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    start = time.perf_counter()
+                    self._value = self._factory()
+                    record_load_time(self._name, time.perf_counter() - start)
+                    self._loaded = True
+        return self._value
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
+
+
+def lazy_import(module_name):
+    return LazyObject(module_name, lambda: importlib.import_module(module_name))
+
+
+def record_load_time(name, seconds):
+    # Only the first load is a cold start cost; later refreshes are not
+    if name not in _load_times:
+        _load_times[name] = seconds
+        logger.info("Lazy resource loaded", resource=name, load_seconds=seconds)
+
+
+def load_times():
+    return dict(_load_times)
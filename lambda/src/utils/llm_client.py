@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+
+import boto3
+import structlog
+
+from utils import lazy
+
+logger = structlog.get_logger(__name__)
+
+SECRET_ID = 'dd_open_ai_key'
+SECRET_TTL = float(os.getenv('LLM_SECRET_TTL', '3600'))
+
+
+def is_auth_failure(error):
+    # Matched on the status code so openai needn't be imported to check
+    return getattr(error, 'status_code', None) == 401
+
+
+class LLMClientProvider:
+    """
+    Process-wide OpenAI client shared by every code path.
+
+    The API key is read from Secrets Manager on first use and again once it is
+    older than `ttl` seconds, or straight away after the API rejects it. A new
+    key gets a new OpenAI client, but every client is built on the same HTTP
+    client, so warm invocations keep reusing one keep-alive connection pool.
+
+    The provider can be passed anywhere an OpenAI client is expected. Calls made
+    through it are retried once with a refreshed key on an auth failure.
+    """
+    def __init__(self, secret_id=SECRET_ID, ttl=SECRET_TTL):
+        self.secret_id = secret_id
+        self.ttl = ttl
+        self._client = None
+        self._api_key = None
+        self._fetched_at = None
+        self._http_client = None
+        self._async_client = None
+        self._async_api_key = None
+        self._async_http_client = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._client is None or time.monotonic() - self._fetched_at >= self.ttl:
+                self._refresh()
+            return self._client
+
+    def get_async(self):
+        """
+        An AsyncOpenAI client using the current API key. Its HTTP client is
+        bound to the event loop it is first used on, so it should only be used
+        from the shared loop in `async_runtime`.
+        """
+        self.get()
+        with self._lock:
+            if self._async_client is None or self._async_api_key != self._api_key:
+                import openai
+                from openai import AsyncOpenAI
+
+                if self._async_http_client is None:
+                    self._async_http_client = openai.DefaultAsyncHttpxClient()
+                self._async_api_key = self._api_key
+                self._async_client = AsyncOpenAI(api_key=self._api_key, http_client=self._async_http_client)
+            return self._async_client
+
+    def invalidate(self):
+        with self._lock:
+            self._fetched_at = None
+            self._client = None
+
+    def _refresh(self):
+        import openai
+        from openai import OpenAI
+
+        start = time.perf_counter()
+        secret_client = boto3.client('secretsmanager')
+        api_key = secret_client.get_secret_value(SecretId=self.secret_id)["SecretString"]
+        self._fetched_at = time.monotonic()
+        if self._client is not None and api_key == self._api_key:
+            return
+        if self._http_client is None:
+            self._http_client = openai.DefaultHttpxClient()
+        openai.api_key = api_key
+        self._api_key = api_key
+        self._client = OpenAI(api_key=api_key, http_client=self._http_client)
+        lazy.record_load_time('llm_client', time.perf_counter() - start)
+        logger.info("LLM client refreshed")
+
+    def __getattr__(self, attr):
+        return _ClientPath(self, (attr,))
+
+
+class _ClientPath:
+    """An attribute path on the provider's current client, resolved at call time."""
+    def __init__(self, provider, path):
+        self._provider = provider
+        self._path = path
+
+    def __getattr__(self, attr):
+        return _ClientPath(self._provider, self._path + (attr,))
+
+    def _resolve(self):
+        target = self._provider.get()
+        for attr in self._path:
+            target = getattr(target, attr)
+        return target
+
+    def __call__(self, *args, **kwargs):
+        try:
+            return self._resolve()(*args, **kwargs)
+        except Exception as e:
+            if not is_auth_failure(e):
+                raise
+            logger.warning("LLM auth failure, refreshing API key", call='.'.join(self._path))
+            self._provider.invalidate()
+            return self._resolve()(*args, **kwargs)
+
+
+provider = LLMClientProvider()
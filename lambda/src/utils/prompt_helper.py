@@ -1,24 +1,33 @@
 import json
-import openai
 import os
-import aioboto3
-from openai import OpenAI, AssistantEventHandler
 import structlog
 import random
-import boto3
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from typing_extensions import override
+from utils.bio_parser import BIO_END, BIO_START, BioStreamParser, bio_event
+from utils.lazy import LazyObject
+from utils.metrics import metrics
+from utils.llm_client import is_auth_failure, provider as llm_provider
 
 logger = structlog.get_logger(__name__)
 
 ASSISTANT_ID = os.getenv('ASSISTANT_ID', 'asst_JVSlwnmtTuU58GOrCkD9x11b')
 
+# 'parallel' generates each new character's bio as its own completion
+BIO_GENERATION = os.getenv('BIO_GENERATION', 'thread')
+BIO_CONCURRENCY = int(os.getenv('BIO_CONCURRENCY', '4'))
+BIO_MODEL = os.getenv('BIO_MODEL', 'gpt-4o-mini')
+
 domain = os.getenv('DOMAIN')
 stage = os.getenv('STAGE')
-apig_session = aioboto3.Session()
-apig_management_client = apig_session.client(
-    "apigatewaymanagementapi", endpoint_url=f"https://{domain}/{stage}"
-)
+
+
+def _create_apig_session():
+    import aioboto3
+    return aioboto3.Session()
+
+# openai and aioboto3 are only imported by the routes that use them
+apig_session = LazyObject('aioboto3_session', _create_apig_session)
 
 # One time creation of the assistant
 def create_assistant(llm_client):
@@ -31,6 +40,7 @@ def create_assistant(llm_client):
     logger.info("Created assistant", assistant_id=assistant.id)
     return assistant.id
 
+@metrics.timed('openai.create_thread')
 def create_thread(llm_client):
     logger.info("Creating thread")
     thread = llm_client.beta.threads.create()
@@ -38,20 +48,23 @@ def create_thread(llm_client):
     return thread.id
 
 def setup_llm():
+    """
+    Returns the process-wide LLM client. The secret is fetched and the OpenAI
+    client built on first use, then refreshed on a TTL or an auth failure.
+    """
     logger.info("Setting up LLM")
-    secret_client = boto3.client('secretsmanager')
-
-    try:
-        response = secret_client.get_secret_value(SecretId='dd_open_ai_key')
-        openai.api_key = response["SecretString"]
-        llm_client = OpenAI(api_key=response["SecretString"])
-        logger.info("LLM setup completed")
-        return llm_client
-    except Exception as e:
-        logger.error("Error setting up LLM", error=str(e))
-        raise
-
-def generate_character_bios(llm_client, users, thread_id, stream_to_connections):
+    return llm_provider
+
+def generate_character_bios(llm_client, users, thread_id, stream_to_connections, on_bio=None):
+    """
+    Streams bios for the users and parses them as they arrive. Each bio's
+    card is sent as soon as the bio is complete, through the run's coalescing
+    buffer so it can't overtake text still held there.
+
+    :param on_bio: Called with the character name and bio after each card is
+                   sent, before the rest have finished streaming.
+    :return: A dict of character name to bio.
+    """
     logger.info("Generating character bios", users=users, thread_id=thread_id)
     if not users:
         logger.warning("No users provided for character bio generation")
@@ -67,93 +80,238 @@ def generate_character_bios(llm_client, users, thread_id, stream_to_connections)
             return the generated character bios
         """
         
-        # repo
-        with llm_client.beta.threads.runs.stream(
+        from utils.event_handler import EventHandler
+        event_handler = EventHandler(stream_to_connections)
+
+        def send_bio(character, bio):
+            event_handler.buffer.send_frame(bio_event(character, bio))
+            if on_bio is not None:
+                on_bio(character, bio)
+
+        parser = BioStreamParser(on_bio=send_bio)
+        event_handler.on_delta = parser.feed
+        response_text = stream_run(
+            llm_client=llm_client,
             thread_id=thread_id,
-            assistant_id=ASSISTANT_ID,
+            stream_to_connections=stream_to_connections,
             additional_instructions=additional_instructions,
-            event_handler=EventHandler(stream_to_connections),
-
-        ) as stream:
-            stream.until_done()
-
-        messages = llm_client.beta.threads.messages.list(thread_id=thread_id)
-        response_text = messages.data[0].content[0].text.value
-        logger.info("Character bios generated successfully")
-        try:
-            bios_dict_list = split_user_bios(response_text)
-            return bios_dict_list
-        except Exception as e:
+            event_handler=event_handler
+        )
+        bios = parser.close()
+        if not bios:
             logger.warning("Invalid markdown response for character bios", response=response_text)
-            return response_text
+        logger.info("Character bios generated successfully", characters=list(bios))
+        return bios
     except Exception as e:
         logger.error("Error generating character bios", error=str(e))
         raise
 
+_bio_executor = None
+
+def get_bio_executor():
+    global _bio_executor
+    if _bio_executor is None:
+        _bio_executor = ThreadPoolExecutor(
+            max_workers=BIO_CONCURRENCY,
+            thread_name_prefix='bios'
+        )
+    return _bio_executor
+
+@metrics.timed('openai.bio')
+def generate_character_bio(llm_client, user):
+    """
+    Generates one user's bio as a standalone completion.
+
+    :return: A dict of character name to bio. If the reply has no usable
+             delimiters the whole reply is used as the user's bio.
+    """
+    completion = llm_client.chat.completions.create(
+        model=BIO_MODEL,
+        messages=[
+            {"role": "system", "content": assistant_instructions},
+            {"role": "user", "content": json.dumps([user])},
+        ]
+    )
+    response_text = completion.choices[0].message.content
+    bios = split_user_bios(response_text)
+    if len(bios) != 1:
+        logger.warning("Unexpected bio format", user=user, characters=list(bios))
+        return {user['name']: response_text.strip()}
+    return bios
+
+def generate_character_bios_parallel(llm_client, users, thread_id, on_bio=None):
+    """
+    Generates bios for several users at once, at most BIO_CONCURRENCY at a
+    time. A user whose bio fails is left out rather than failing the rest.
+
+    The bios are added to the thread afterwards so the assistant knows the
+    party when it runs the next action. Without a `thread_id`, as with the
+    chat engine, the party is sent with each prompt instead.
+
+    :return: A dict of character name to bio.
+    """
+    logger.info("Generating character bios in parallel", users=users, thread_id=thread_id)
+    executor = get_bio_executor()
+    futures = {
+        executor.submit(generate_character_bio, llm_client, user): user
+        for user in users
+    }
+    bios = {}
+    for future in as_completed(futures):
+        try:
+            character_bios = future.result()
+        except Exception as e:
+            logger.error("Error generating character bio", user=futures[future], error=str(e))
+            continue
+        for character, bio in character_bios.items():
+            bios[character] = bio
+            if on_bio is not None:
+                on_bio(character, bio)
+
+    if bios and thread_id is not None:
+        add_bios_to_thread(llm_client=llm_client, thread_id=thread_id, users=users, bios=bios)
+    logger.info("Character bios generated successfully", characters=list(bios))
+    return bios
+
+def add_bios_to_thread(llm_client, thread_id, users, bios):
+    """Records bios made outside the thread as if the assistant had written them."""
+    llm_client.beta.threads.messages.create(
+        thread_id=thread_id,
+        role="user",
+        content=[{"type": "text", "text": json.dumps(users)}]
+    )
+    llm_client.beta.threads.messages.create(
+        thread_id=thread_id,
+        role="assistant",
+        content=[{"type": "text", "text": format_bios(bios)}]
+    )
+
+def format_bios(bios):
+    return '\n'.join(
+        f"{BIO_START}\n{bio}\n{BIO_END}" for bio in bios.values()
+    )
+
 def split_user_bios(character_text):
     logger.info("Parsing character markdown")
-    try:
-        if isinstance(character_text, str):
-            characters = {}
-            current_character = None
-            current_content = []
-            
-            for line in character_text.split('\n'):
-                line = line.strip()
-                if line == '=====================':
-                    # Handle end delimiter
-                    if current_character and current_content:
-                        # Replace "^" with actual newlines
-                        characters[current_character] = '\n'.join(current_content)
-                        current_character = None
-                        current_content = []
-                elif line == '_____________________':
-                    # Handle start delimiter - wait for next line for character name
-                    continue
-                elif not current_character and line and not line.startswith('_____________________'):
-                    # First non-empty line after delimiter is character name
-                    current_character = line.split()[0]  # Take first word as character name
-                    current_content.append(line)
-                elif current_character and line:
-                    current_content.append(line)
-            
-            # Handle the last character if they don't have an end delimiter
-            if current_character and current_content:
-                characters[current_character] = '\n'.join(current_content).replace('^', '')
-            
-            logger.info("Character markdown parsed successfully")
-            return characters
-        else:
-            logger.warning("Received JSON format instead of markdown")
-            return {}
-            
-    except Exception as e:
-        logger.error("Error parsing character content", error=str(e))
-        raise
+    if not isinstance(character_text, str):
+        logger.warning("Received JSON format instead of markdown")
+        return {}
+    parser = BioStreamParser()
+    parser.feed(character_text)
+    characters = parser.close()
+    logger.info("Character markdown parsed successfully")
+    return characters
 
 def process_action(llm_client, thread_id, user_action, stream_to_connections):
     logger.info("Processing action", thread_id=thread_id, action=user_action)
     try:
-        message = llm_client.beta.threads.messages.create(
+        with metrics.timer('openai.messages_create'):
+            message = llm_client.beta.threads.messages.create(
+                thread_id=thread_id,
+                role="user",
+                content=[{"type": "text", "text": json.dumps(user_action)}]
+            )
+        assistant_reply = stream_run(
+            llm_client=llm_client,
             thread_id=thread_id,
-            role="user",
-            content=[{"type": "text", "text": json.dumps(user_action)}]
+            stream_to_connections=stream_to_connections
         )
-        with llm_client.beta.threads.runs.stream(
+        logger.info("Action processed successfully")
+        return assistant_reply
+    except Exception as e:
+        logger.error("Error processing action", error=str(e))
+        return random.choice(error_responses)
+
+def stream_run(llm_client, thread_id, stream_to_connections, additional_instructions=None, on_delta=None, event_handler=None):
+    """
+    Runs the assistant on a thread, streaming its reply to the connections.
+
+    :param on_delta: Called with the text of each delta as it arrives.
+    :param event_handler: The EventHandler to stream through, when the caller
+                          needs its buffer. `on_delta` is ignored then.
+    :return: The text of the assistant's reply, as assembled from the stream.
+    """
+    from utils.event_handler import EventHandler
+    if event_handler is None:
+        event_handler = EventHandler(stream_to_connections, on_delta=on_delta)
+    run_kwargs = {}
+    if additional_instructions:
+        run_kwargs['additional_instructions'] = additional_instructions
+    try:
+        with metrics.timer('openai.run'), llm_client.beta.threads.runs.stream(
             thread_id=thread_id,
             assistant_id=ASSISTANT_ID,
-            event_handler=EventHandler(stream_to_connections),
+            event_handler=event_handler,
+            **run_kwargs
         ) as stream:
             stream.until_done()
-        
-        messages = llm_client.beta.threads.messages.list(thread_id=thread_id)
-        assistant_reply = messages.data[0].content[0].text.value
+    finally:
+        event_handler.buffer.close()
+    logger.info("Run completed", usage=event_handler.usage)
+
+    if event_handler.response_text is None:
+        # Only reached if the stream carried no text; not expected in practice
+        logger.warning("No text captured from stream, listing thread messages")
+        with metrics.timer('openai.messages_list'):
+            messages = llm_client.beta.threads.messages.list(thread_id=thread_id)
+        return messages.data[0].content[0].text.value
+    return event_handler.response_text
+
+async def process_action_async(llm_client, thread_id, user_action, frames):
+    """
+    Async counterpart of `process_action`. Coalesced frames of the reply are
+    put on the `frames` queue as they stream in.
+    """
+    logger.info("Processing action", thread_id=thread_id, action=user_action)
+    try:
+        async_client = llm_client.get_async()
+        with metrics.timer('openai.messages_create'):
+            await async_client.beta.threads.messages.create(
+                thread_id=thread_id,
+                role="user",
+                content=[{"type": "text", "text": json.dumps(user_action)}]
+            )
+        assistant_reply = await stream_run_async(
+            async_client=async_client,
+            thread_id=thread_id,
+            frames=frames
+        )
         logger.info("Action processed successfully")
         return assistant_reply
     except Exception as e:
         logger.error("Error processing action", error=str(e))
+        if is_auth_failure(e):
+            # The next turn builds its client with a fresh key
+            llm_provider.invalidate()
         return random.choice(error_responses)
 
+async def stream_run_async(async_client, thread_id, frames, additional_instructions=None):
+    from utils.event_handler import AsyncEventHandler
+    event_handler = AsyncEventHandler(frames)
+    run_kwargs = {}
+    if additional_instructions:
+        run_kwargs['additional_instructions'] = additional_instructions
+    try:
+        with metrics.timer('openai.run'):
+            async with async_client.beta.threads.runs.stream(
+                thread_id=thread_id,
+                assistant_id=ASSISTANT_ID,
+                event_handler=event_handler,
+                **run_kwargs
+            ) as stream:
+                await stream.until_done()
+    finally:
+        await event_handler.close()
+    logger.info("Run completed", usage=event_handler.usage)
+
+    if event_handler.response_text is None:
+        logger.warning("No text captured from stream, listing thread messages")
+        with metrics.timer('openai.messages_list'):
+            messages = await async_client.beta.threads.messages.list(thread_id=thread_id)
+        return messages.data[0].content[0].text.value
+    return event_handler.response_text
+
+@metrics.timed('openai.delete_thread')
 def delete_thread(llm_client, thread_id):
     logger.info("Deleting thread", thread_id=thread_id)
     try:
@@ -163,35 +321,6 @@ def delete_thread(llm_client, thread_id):
         logger.error("Error deleting thread", thread_id=thread_id, error=str(e))
         raise
 
-class EventHandler(AssistantEventHandler):
-    def __init__(self, stream_to_connections):
-        super().__init__()
-        self.stream_to_connections = stream_to_connections
-
-    @override
-    def on_text_created(self, text) -> None:
-        self.stream_to_connections(text)
-
-    @override
-    def on_text_delta(self, delta, snapshot):
-        self.stream_to_connections(delta.value)
-      
-    @override
-    def on_tool_call_created(self, tool_call):
-        self.stream_to_connections(f"\nassistant > {tool_call.type}\n")
-  
-    @override
-    def on_tool_call_delta(self, delta, snapshot):
-        if delta.type == 'code_interpreter':
-            if delta.code_interpreter.input:
-                self.stream_to_connections(delta.code_interpreter.input)
-            if delta.code_interpreter.outputs:
-                self.stream_to_connections(f"\n\noutput >")
-                for output in delta.code_interpreter.outputs:
-                    if output.type == "logs":
-                        self.stream_to_connections(f"\n{output.logs}")
-
-
 # The assistant_instructions variable remains unchanged
 # This is not updated automatically. Needs to be updated manually.
 assistant_instructions =  """
@@ -0,0 +1,159 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import boto3
+
+from utils.dynamodb_calls import counter as dynamodb_calls
+from utils.lazy import LazyObject
+
+REPLAY_BUFFER_FRAMES = int(os.getenv('REPLAY_BUFFER_FRAMES', '256'))
+# Bounds the frames waiting for a flush, kept well under the 400 KB item limit
+REPLAY_BUFFER_BYTES = int(os.getenv('REPLAY_BUFFER_BYTES', str(32 * 1024)))
+REPLAY_FLUSH_INTERVAL = float(os.getenv('REPLAY_FLUSH_INTERVAL', '1.0'))
+# Replay segments keyed by session and first sequence number, out of the
+# session item that every turn reads and writes
+REPLAY_TABLE = os.getenv('REPLAY_TABLE', 'dd-infra-replay')
+
+
+def envelope(message, turn, seq):
+    """
+    Wraps a frame with its turn and sequence number. Text becomes a `chunk`
+    frame; dict frames, like character bios, keep their fields.
+    """
+    if isinstance(message, dict):
+        return dict(message, turn=turn, seq=seq)
+    text = message if isinstance(message, str) else getattr(message, 'value', str(message))
+    return {'type': 'chunk', 'turn': turn, 'seq': seq, 'text': text}
+
+
+class ReplayBuffer:
+    """
+    The enveloped frames of a session's current turn that are yet to be saved.
+
+    Frames are numbered from `next_seq` and kept encoded, oldest first, up to
+    `max_frames` frames and `max_bytes` bytes. `take_segment` hands over the
+    frames added since the last segment, which are saved as one small item of
+    the replay table, so each flush writes only what is new. A client that
+    reconnects through another Lambda is sent the frames saved so far, which
+    trail the live stream by up to one flush interval; frames dropped by the
+    bounds or by a failed save leave a gap that makes it resync. `position`
+    is all the session item keeps, so a later run on the same turn continues
+    the sequence.
+    """
+    def __init__(self, turn, next_seq=0, expiration_time=None, max_frames=REPLAY_BUFFER_FRAMES, max_bytes=REPLAY_BUFFER_BYTES):
+        self.turn = turn
+        self.first_seq = next_seq
+        self.next_seq = next_seq
+        self.expiration_time = expiration_time
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        # Tells this run's segments from those of an earlier run of the turn
+        self.started_at = int(time.time() * 1000)
+        self._frames = deque()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_session(cls, session, turn):
+        """Continues the session's sequence when the buffer is already on this turn."""
+        next_seq = 0
+        if session.get('replay_turn') is not None and int(session['replay_turn']) == turn:
+            next_seq = int(session.get('replay_next_seq', 0))
+        return cls(turn, next_seq=next_seq, expiration_time=session.get('expiration_time'))
+
+    def append(self, message):
+        """
+        :return: The enveloped frame.
+        """
+        with self._lock:
+            frame = envelope(message, self.turn, self.next_seq)
+            encoded = json.dumps(frame)
+            self._frames.append(encoded)
+            self._bytes += len(encoded)
+            self.next_seq += 1
+            while len(self._frames) > self.max_frames or (self._bytes > self.max_bytes and len(self._frames) > 1):
+                self._bytes -= len(self._frames.popleft())
+                self.first_seq += 1
+            return frame
+
+    def take_segment(self, complete=False):
+        """
+        :return: The frames added since the last segment, as a replay item
+                 without its session_id.
+        """
+        with self._lock:
+            segment = {
+                'turn': self.turn,
+                'started_at': self.started_at,
+                'first_seq': self.first_seq,
+                'next_seq': self.next_seq,
+                'frames': list(self._frames),
+                'complete': complete,
+            }
+            self._frames.clear()
+            self._bytes = 0
+            self.first_seq = self.next_seq
+        if self.expiration_time is not None:
+            segment['expiration_time'] = self.expiration_time
+        return segment
+
+    def position(self):
+        with self._lock:
+            return {'replay_turn': self.turn, 'replay_next_seq': self.next_seq}
+
+
+def merge_segments(segments):
+    """
+    Joins the saved segments of the latest run of a session's latest turn.
+
+    :return: The turn's replay, with its turn, first_seq, next_seq, frames
+             and whether it is complete, or None if there are no segments.
+             Frames before a gap are left out, so a client behind it resyncs.
+    """
+    if not segments:
+        return None
+    latest = max((int(segment['turn']), int(segment['started_at'])) for segment in segments)
+    replay = None
+    for segment in sorted(segments, key=lambda segment: int(segment['first_seq'])):
+        if (int(segment['turn']), int(segment['started_at'])) != latest:
+            continue
+        if replay is None or int(segment['first_seq']) != replay['next_seq']:
+            replay = {'turn': latest[0], 'first_seq': int(segment['first_seq']), 'frames': []}
+        replay['frames'].extend(segment.get('frames', []))
+        replay['next_seq'] = int(segment['next_seq'])
+        replay['complete'] = bool(segment['complete'])
+    return replay
+
+
+def frames_after(replay, turn, seq):
+    """
+    Finds the persisted frames a client is missing.
+
+    :param replay: The session's replay, as joined by `merge_segments`, or
+                   None if it has none.
+    :param turn: The turn of the last frame the client has.
+    :param seq: The sequence number of the last frame the client has.
+    :return: The missing frames, encoded, or None when they are no longer
+             buffered and the client must refetch the session instead.
+    """
+    if replay is None:
+        return []
+    replay_turn = int(replay['turn'])
+    first_seq = int(replay['first_seq'])
+    if int(turn) > replay_turn:
+        return []
+    # Only the latest turn is buffered, and only its newest frames
+    if int(turn) < replay_turn or int(seq) + 1 < first_seq:
+        return None
+    return list(replay.get('frames', [])[max(0, int(seq) + 1 - first_seq):])
+
+
+def _create_replay_table():
+    table = boto3.resource('dynamodb').Table(REPLAY_TABLE)
+    dynamodb_calls.instrument(table.meta.client)
+    return table
+
+replay_table = LazyObject('replay_table', _create_replay_table)
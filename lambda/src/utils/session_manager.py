@@ -1,35 +1,93 @@
+import asyncio
 import json
 import os
 import random
+import threading
+import time
+import uuid
 import structlog
 import boto3
+from concurrent.futures import ThreadPoolExecutor, wait as wait_for_futures
 
 logger = structlog.get_logger(__name__)
 import utils.session_operations as session_operations
+import utils.async_session_operations as async_session_operations
 import utils.prompt_helper as prompt_helper
-from openai.types.beta.threads.text import Text
+from utils.connection_registry import registry as connection_registry
+from utils.connection_sender import (
+    SEND_DRAIN_TIMEOUT, SEND_DROP_POLICY, SEND_MAX_RETRIES, ConnectionSender, backoff_delay, is_throttled
+)
+from utils.metrics import metrics
+from utils.replay_buffer import REPLAY_FLUSH_INTERVAL, REPLAY_TABLE, ReplayBuffer, replay_table
+from utils.session_unit_of_work import AsyncSessionUnitOfWork, SessionUnitOfWork
 
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 
+FANOUT_MAX_WORKERS = int(os.getenv('FANOUT_MAX_WORKERS', '8'))
+FANOUT_MODE = os.getenv('FANOUT_MODE', 'concurrent')
+# 'async' runs chat turns through add_entry_async on the shared event loop
+TURN_PIPELINE = os.getenv('TURN_PIPELINE', 'sync')
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '32'))
+# The reply when another turn holds the session's lease; the action is not run
+LEASE_HELD_BODY = "Wait a moment, I'm still divining what happened with the last action."
 
-def get_session(session_table, session_id):
-    logger.info("Retrieving session")
+# Shared across warm invocations so the worker threads are only started once
+_fanout_executor = None
+
+def get_fanout_executor():
+    global _fanout_executor
+    if _fanout_executor is None:
+        _fanout_executor = ThreadPoolExecutor(
+            max_workers=FANOUT_MAX_WORKERS,
+            thread_name_prefix='fanout'
+        )
+    return _fanout_executor
+
+
+def get_session(session_table, session_id, turn_table, since=None, limit=None, if_none_match=None):
+    logger.info("Retrieving session", since=since, limit=limit)
     try:
         # Retrieve session from DynamoDB
         session = session_operations.get_session(
             session_table=session_table, 
             session_id=session_id
         )
-        if session:
-            logger.info("Session retrieved successfully")
+        if session and if_none_match == session_operations.session_etag(session):
+            logger.info("Session not modified")
+            response = {
+                'statusCode': 304,
+                'body': '',
+                'headers': {'ETag': if_none_match},
+            }
+        elif session:
+            session_operations.load_turns(
+                session_table=session_table,
+                turn_table=turn_table,
+                session=session,
+                since=since,
+                limit=limit
+            )
+            logger.info("Session retrieved successfully", turns=len(session['turns']))
+            if session['turns']:
+                last_turn = int(session['turns'][-1]['turn'])
+            else:
+                last_turn = since if since is not None else int(session.get('turn_count', 0))
             response = {
                 'statusCode': 200,
                 'body': json.dumps({
                     'users': session.get('user_set', []),
-                    'chat_history': session.get('chat_history', []),
-                    'user_bios': session.get('user_bios', {})
+                    'chat_history': [
+                        session_operations.to_chat_history(turn) for turn in session['turns']
+                    ],
+                    'user_bios': session.get('user_bios', {}),
+                    'last_turn': last_turn,
+                    'has_more': session['has_more_turns']
 
-                })
+                }),
+                'headers': {
+                    'ETag': session_operations.session_etag(session),
+                    'Content-Type': 'application/json',
+                },
             }
         else:
             logger.warning("Session not found")
@@ -50,31 +108,104 @@ def get_session(session_table, session_id):
 
     return response
 
-def add_entry(session_table, llm_client, session_id, message, connection_table, connection_id=None, api_gateway_management_client=None):
+def add_entry(session_table, llm_client, session_id, message, connection_table, turn_table, connection_id=None, api_gateway_management_client=None):
     logger.info("Adding entry to session")
     
     try:
-        # Retrieve existing session or create a new one
-        session = session_operations.get_or_create_session(
-            session_table=session_table,
-            llm_client=llm_client,
-            session_id=session_id
-        )
-        processing_check = session_operations.check_processing_flag_to_session(
-            session_table=session_table,
-            session_id=session_id
+        # Only one turn may run against a session's thread at a time. The
+        # session is read from the lease write, so no other turn commits in
+        # between; the turn's writes are staged on the unit of work and
+        # committed together when the turn completes
+        unit_of_work = SessionUnitOfWork(session_table, turn_table, session_id)
+        lease_owner = f"{connection_id or 'http'}:{uuid.uuid4()}"
+        lease_requested_at = time.perf_counter()
+        lease_acquired = unit_of_work.acquire_lease(lease_owner)
+        if not lease_acquired and not unit_of_work.exists():
+            logger.info("Creating new session")
+            session_operations.create_session(
+                session_table=session_table,
+                session_id=session_id
+            )
+            lease_acquired = unit_of_work.acquire_lease(lease_owner)
+        lease_acquired_at = time.perf_counter()
+        logger.info(
+            "Turn lease requested",
+            acquired=lease_acquired,
+            lease_wait=lease_acquired_at - lease_requested_at
         )
-        if processing_check:
+        if not lease_acquired:
             return {
                 'statusCode': 200,
-                'body': "Wait a moment, I'm still divining what happened with the last action.",
+                'body': LEASE_HELD_BODY,
             }
-        stream_to_connections = StreamToConnections(
-            api_gateway_management_client=api_gateway_management_client,
-            session_id=session_id,
-            connection_id=connection_id,
-            connection_table=connection_table
+        committed = False
+        try:
+            ensure_thread(unit_of_work, llm_client)
+            response = run_turn(
+                session_table=session_table,
+                llm_client=llm_client,
+                session=unit_of_work.session,
+                message=message,
+                connection_table=connection_table,
+                turn_table=turn_table,
+                connection_id=connection_id,
+                api_gateway_management_client=api_gateway_management_client,
+                unit_of_work=unit_of_work
+            )
+            # The lease is released by the same write that saves the turn
+            unit_of_work.release_lease(lease_owner)
+            unit_of_work.commit()
+            committed = True
+        finally:
+            if not committed:
+                session_operations.release_turn_lease(
+                    session_table=session_table,
+                    session_id=session_id,
+                    owner=lease_owner
+                )
+            logger.info("Turn lease released", lease_hold=time.perf_counter() - lease_acquired_at)
+       
+    except Exception as e:
+        logger.error(
+            "Error adding entry",
+            error=str(e),
+            exc_info=e
         )
+
+        response = {
+            'statusCode': 200,
+            'body': json.dumps({'error': random.choice(prompt_helper.error_responses)}),
+        }
+
+    return response
+
+
+@metrics.timed('turn.ensure_thread')
+def ensure_thread(unit_of_work, llm_client):
+    """Gives a session its OpenAI thread on its first action."""
+    from utils import chat_engine
+    # The chat engine builds each prompt itself and never uses a thread
+    if chat_engine.DM_ENGINE == 'chat' or unit_of_work.session.get('thread_id'):
+        return
+    # Creation latency is recorded as the openai.create_thread metric
+    thread_id = prompt_helper.create_thread(llm_client)
+    unit_of_work.set('thread_id', thread_id)
+    unit_of_work.require('attribute_not_exists(thread_id)')
+    logger.info("Thread assigned", thread_id=thread_id)
+
+
+@metrics.timed('turn.run')
+def run_turn(session_table, llm_client, session, message, connection_table, turn_table, connection_id=None, api_gateway_management_client=None, unit_of_work=None):
+    session_id = session['session_id']
+    stream_to_connections = StreamToConnections(
+        api_gateway_management_client=api_gateway_management_client,
+        session_id=session_id,
+        connection_id=connection_id,
+        connection_table=connection_table,
+        replay_table=replay_table,
+        replay=ReplayBuffer.for_session(session, turn=int(session.get('turn_count', 0)) + 1)
+    )
+    try:
         stream_to_connections.get_connection_ids(
             connection_table=connection_table,
             session_id=session_id
@@ -93,7 +224,8 @@ def add_entry(session_table, llm_client, session_id, message, connection_table,
                 llm_client=llm_client,
                 body=message,
                 session=session,
-                stream_to_connections=stream_to_connections
+                stream_to_connections=stream_to_connections,
+                unit_of_work=unit_of_work
             )
             if len(new_user_bios_dict_list) == 0:
                 user_bios_json = [session['user_bios'][character] for character in session['user_bios'].keys()]
@@ -112,35 +244,127 @@ def add_entry(session_table, llm_client, session_id, message, connection_table,
         if new_user_bios_dict_list:
             segue_text = f"""
 
-            I see new members have joined our party: 
-            
-            {bios_text}
+        I see new members have joined our party: 
+        
+        {bios_text}
 
-            Now as for that action...
-            """
+        Now as for that action...
+        """
             stream_to_connections(message="Now as for that action...")
-            
+        
 
         dm_response = session_operations.add_message_to_session(
             session_table=session_table,
+            turn_table=turn_table,
             llm_client=llm_client,
             body=message,
             session=session,
-            stream_to_connections=stream_to_connections
+            stream_to_connections=stream_to_connections,
+            unit_of_work=unit_of_work
         )
 
         # add new user bios before the response
         if segue_text:
             dm_response = f"""
-            {segue_text}
-            {dm_response}
-            """
+        {segue_text}
+        {dm_response}
+        """
 
-        response = {
+        return {
             'statusCode': 200,
             'body': json.dumps(dm_response),
         }
-       
+    finally:
+        # Every queued frame is sent before the turn's writes are committed
+        stream_to_connections.finish()
+        position = stream_to_connections.replay.position()
+        if unit_of_work is not None:
+            for attribute, value in position.items():
+                unit_of_work.set(attribute, value)
+        else:
+            session_operations.save_replay_position(session_table, session_id, position)
+
+
+async def add_entry_async(session_table, llm_client, session_id, message, connection_table, turn_table, connection_id=None, api_gateway_management_client=None):
+    """
+    Async counterpart of `add_entry`, taking the same arguments.
+
+    Reading the model's stream and posting frames to the connections run as
+    concurrent tasks joined by a bounded queue. As in `add_entry`, the session
+    is read from the lease write and the turns, the version bump and the lease
+    release are committed in one transaction when the turn completes. Tables
+    and the management client are swapped for aioboto3 equivalents of the same
+    name and endpoint. New sessions, messages carrying users and the chat
+    engine go through the sync path.
+    """
+    logger.info("Adding entry to session", pipeline='async')
+    from utils import async_runtime
+    from utils import chat_engine
+
+    sync_entry_kwargs = dict(
+        session_table=session_table,
+        llm_client=llm_client,
+        session_id=session_id,
+        message=message,
+        connection_table=connection_table,
+        turn_table=turn_table,
+        connection_id=connection_id,
+        api_gateway_management_client=api_gateway_management_client
+    )
+    if ('users' in message or 'user' not in message or 'msg' not in message
+            or chat_engine.DM_ENGINE == 'chat'):
+        return await asyncio.to_thread(add_entry, **sync_entry_kwargs)
+
+    try:
+        unit_of_work = AsyncSessionUnitOfWork(
+            await async_runtime.get_table(session_table.name),
+            await async_runtime.get_table(turn_table.name),
+            session_id
+        )
+        lease_owner = f"{connection_id or 'http'}:{uuid.uuid4()}"
+        lease_requested_at = time.perf_counter()
+        lease_acquired = await unit_of_work.acquire_lease(lease_owner)
+        lease_acquired_at = time.perf_counter()
+        logger.info(
+            "Turn lease requested",
+            acquired=lease_acquired,
+            lease_wait=lease_acquired_at - lease_requested_at
+        )
+        if not lease_acquired:
+            if not await unit_of_work.exists():
+                return await asyncio.to_thread(add_entry, **sync_entry_kwargs)
+            return {
+                'statusCode': 200,
+                'body': LEASE_HELD_BODY,
+            }
+        committed = False
+        try:
+            await asyncio.to_thread(ensure_thread, unit_of_work, llm_client)
+            response = await run_turn_async(
+                unit_of_work=unit_of_work,
+                llm_client=llm_client,
+                message=message,
+                connection_table=await async_runtime.get_table(connection_table.name),
+                replay_table=await async_runtime.get_table(REPLAY_TABLE),
+                connection_id=connection_id,
+                api_gateway_management_client=await async_runtime.get_client(
+                    'apigatewaymanagementapi',
+                    endpoint_url=api_gateway_management_client.meta.endpoint_url
+                )
+            )
+            # The lease is released by the same write that saves the turn
+            unit_of_work.release_lease(lease_owner)
+            await unit_of_work.commit()
+            committed = True
+        finally:
+            if not committed:
+                await async_session_operations.release_turn_lease(
+                    session_table=unit_of_work.session_table,
+                    session_id=session_id,
+                    owner=lease_owner
+                )
+            logger.info("Turn lease released", lease_hold=time.perf_counter() - lease_acquired_at)
+
     except Exception as e:
         logger.error(
             "Error adding entry",
@@ -156,9 +380,75 @@ def add_entry(session_table, llm_client, session_id, message, connection_table,
     return response
 
 
-def delete_session(session_table, session_id, connection_table):
+async def run_turn_async(unit_of_work, llm_client, message, connection_table, replay_table=None, connection_id=None, api_gateway_management_client=None):
+    """
+    Streams one action's reply to the session's connections and stages the
+    turns and replay position on `unit_of_work`, which the caller commits.
+    """
+    session = unit_of_work.session
+    session_id = session['session_id']
+    stream_to_connections = AsyncStreamToConnections(
+        api_gateway_management_client=api_gateway_management_client,
+        session_id=session_id,
+        connection_id=connection_id,
+        connection_table=connection_table
+    )
+    user_action = {
+        'user': message['user'],
+        'msg': message['msg']
+    }
+    await stream_to_connections.get_connection_ids(
+        connection_table=connection_table,
+        session_id=session_id
+    )
+    stream_to_connections.replay = ReplayBuffer.for_session(session, turn=int(session.get('turn_count', 0)) + 1)
+
+    frames = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    fanout_task = asyncio.create_task(stream_to_connections.consume(frames))
+    try:
+        await frames.put(f"\n\n {user_action['user']}: {user_action['msg']} \n\n")
+
+        action_task = asyncio.create_task(prompt_helper.process_action_async(
+            llm_client=llm_client,
+            thread_id=session['thread_id'],
+            user_action=user_action,
+            frames=frames
+        ))
+        # A fan-out that dies would leave the run blocked on a full frame queue
+        await asyncio.wait((action_task, fanout_task), return_when=asyncio.FIRST_COMPLETED)
+        if not action_task.done():
+            action_task.cancel()
+            await asyncio.gather(action_task, return_exceptions=True)
+            fanout_task.result()
+        dm_response = action_task.result()
+        sent_response = dm_response.replace("\u2018", "'").replace("\u2019", "'")
+        # Numbered from the turn count the lease read; the commit checks it
+        unit_of_work.append_turns([user_action, {'user': session_operations.DUNGEON_MASTER, 'msg': sent_response}])
+    finally:
+        if not fanout_task.done():
+            await frames.put(None)
+        await fanout_task
+        await stream_to_connections.expire_stale_connections()
+        if replay_table is not None:
+            await async_session_operations.save_replay(
+                replay_table, session_id, stream_to_connections.replay.take_segment(complete=True)
+            )
+        for attribute, value in stream_to_connections.replay.position().items():
+            unit_of_work.set(attribute, value)
+
+    logger.info(
+        "Fan-out latency",
+        latency=stream_to_connections.latency_summary(),
+        connection_registry=connection_registry.stats()
+    )
+    return {
+        'statusCode': 200,
+        'body': json.dumps(sent_response),
+    }
+
+
+def delete_session(session_table, session_id, connection_table, turn_table, llm_client):
     logger.info("Deleting session")
-    llm_client = prompt_helper.setup_llm()
     try:
         # Retrieve session from DynamoDB
         session = session_operations.get_session(
@@ -166,7 +456,7 @@ def delete_session(session_table, session_id, connection_table):
             session_id=session_id
         )
         if session:
-            thread_id = session.get('ThreadId')
+            thread_id = session.get('thread_id')
 
             # Delete the OpenAI thread if it exists
             if thread_id:
@@ -181,7 +471,8 @@ def delete_session(session_table, session_id, connection_table):
             session_operations.delete_session(
                 session_table=session_table,
                 session_id=session_id,
-                connection_table=connection_table
+                connection_table=connection_table,
+                turn_table=turn_table
             )
 
             logger.info("Session deleted successfully")
@@ -206,12 +497,44 @@ def delete_session(session_table, session_id, connection_table):
 
 
 class StreamToConnections:  
-    def __init__(self, api_gateway_management_client, session_id, connection_id, connection_table):
+    """
+    Posts each frame of a streamed response to every connection in a session.
+
+    Each connection has its own send queue (see `ConnectionSender`). In
+    concurrent mode the queues are drained in parallel on a bounded thread
+    pool, so a slow or throttled connection falls behind on its own rather
+    than holding up the rest; in serial mode each frame is sent to every
+    connection before the call returns. Either way frames arrive in order on
+    any single connection. `finish` waits for the queues to empty.
+
+    Connections found gone are dropped from the stream straight away, but
+    only expired in DynamoDB by `expire_stale_connections`, in batches once
+    the run is over, so no write holds up the stream.
+
+    With a `replay` buffer each frame is wrapped in a turn and sequence
+    envelope and kept. The frames added since the last flush are saved to
+    `replay_table` as one segment in the background every
+    `REPLAY_FLUSH_INTERVAL` seconds, and the rest by `finish`, so a client
+    that reconnects mid-reply can resume from its last frame. It is sent what
+    was flushed, up to `REPLAY_FLUSH_INTERVAL` behind the live stream, and
+    resumes again for the rest while the turn is incomplete.
+    """
+    def __init__(self, api_gateway_management_client, session_id, connection_id, connection_table, concurrent=None, drop_policy=SEND_DROP_POLICY, replay_table=None, replay=None):
         self.session_id = session_id
         self.api_gateway_management_client = api_gateway_management_client
         self._connection_id = connection_id
         self.connection_table = connection_table
         self.connection_ids = []
+        self.stale_connection_ids = []
+        self.concurrent = FANOUT_MODE == 'concurrent' if concurrent is None else concurrent
+        self.drop_policy = drop_policy
+        self.senders = {}
+        self.latency_stats = {}
+        self._lock = threading.Lock()
+        self.replay_table = replay_table
+        self.replay = replay
+        self._replay_saved_at = time.monotonic()
+        self._replay_save = None
     
     
     @property
@@ -219,47 +542,244 @@ class StreamToConnections:
         return self._connection_id
     
     def get_connection_ids(self, connection_table, session_id):
-        self.connection_ids = session_operations.get_connection_ids(
-            connection_table=connection_table,
-            session_id=session_id
-        )
+        connection_ids = connection_registry.get(session_id)
+        if connection_ids is None:
+            connection_ids = session_operations.get_connection_ids(
+                connection_table=connection_table,
+                session_id=session_id
+            )
+            connection_registry.put(session_id, connection_ids)
+        self.connection_ids = connection_ids
     
     def __call__(self, message):
+        """
+        Queues a single frame for all connections.
+
+        :param message: The frame to send. Dicts and lists are sent as JSON.
+        """
         # logger.info("Streaming to connections", connection_id=self.connection_id, connection_ids=self.connection_ids)
+        message = self.sequence(message)
+        if self.replay is not None and self.replay_table is not None:
+            self._save_replay_periodically()
+        message_bytes = encode_message(message)
+        for connection_id in list(self.connection_ids):
+            sender = self.sender(connection_id)
+            if sender.put(message, message_bytes):
+                if self.concurrent:
+                    get_fanout_executor().submit(sender.drain)
+                else:
+                    sender.drain()
 
-        # Convert message to bytes
-        if isinstance(message, dict):
-            message_bytes = json.dumps(message).encode('utf-8')
-        elif isinstance(message, str):
-            message_bytes = message.encode('utf-8')
-        elif isinstance(message, list):
-            message_bytes = json.dumps(message).encode('utf-8')
-        elif isinstance(message, int):
-            message_bytes = str(message).encode('utf-8')
-        elif isinstance(message, float):
-            message_bytes = str(message).encode('utf-8')
-        elif isinstance(message, bool):
-            message_bytes = str(message).encode('utf-8')
-        elif isinstance(message, Text):
-            message_bytes = message.value.encode('utf-8')
-        else:
-            message_bytes = str(message).encode('utf-8')
+    def sender(self, connection_id):
+        sender = self.senders.get(connection_id)
+        if sender is None:
+            sender = self.senders[connection_id] = ConnectionSender(
+                api_gateway_management_client=self.api_gateway_management_client,
+                connection_id=connection_id,
+                on_sent=self._record_latency,
+                on_gone=self._drop_gone_connection,
+                drop_policy=self.drop_policy
+            )
+        return sender
+
+    def sequence(self, message):
+        if self.replay is None:
+            return message
+        return self.replay.append(message)
+
+    def _save_replay_periodically(self):
+        now = time.monotonic()
+        if now - self._replay_saved_at < REPLAY_FLUSH_INTERVAL:
+            return
+        if self._replay_save is not None and not self._replay_save.done():
+            return
+        self._replay_saved_at = now
+        self._replay_save = get_fanout_executor().submit(self._save_replay, self.replay.take_segment())
+
+    def _save_replay(self, segment):
+        try:
+            session_operations.save_replay(self.replay_table, self.session_id, segment)
+        except (BotoCoreError, ClientError) as e:
+            logger.exception("Couldn't save replay buffer", exc_info=e)
 
-        for other_conn_id in self.connection_ids:
+    def flush(self, timeout=None):
+        """
+        Waits for every connection's queued frames to be sent.
+
+        :param timeout: Seconds to wait in all, or None to wait as long as it takes.
+        :return: True if everything was sent in time.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining():
+            return None if deadline is None else max(0, deadline - time.monotonic())
+
+        drained = all([sender.wait(remaining()) for sender in list(self.senders.values())])
+        if self._replay_save is not None:
+            drained = not wait_for_futures([self._replay_save], remaining()).not_done and drained
+        return drained
+
+    def finish(self):
+        with metrics.timer('fanout.drain'):
+            drained = self.flush(SEND_DRAIN_TIMEOUT)
+        if not drained:
+            logger.warning("Send queues didn't drain in time", timeout=SEND_DRAIN_TIMEOUT, send_queues=self.queue_stats())
+        if self.replay is not None and self.replay_table is not None:
+            self._save_replay(self.replay.take_segment(complete=True))
+        self.expire_stale_connections()
+        logger.info(
+            "Fan-out latency",
+            latency=self.latency_summary(),
+            send_queues=self.queue_stats(),
+            connection_registry=connection_registry.stats()
+        )
+
+    def _drop_gone_connection(self, other_conn_id):
+        connection_registry.discard(other_conn_id)
+        with self._lock:
+            if other_conn_id in self.connection_ids:
+                self.connection_ids.remove(other_conn_id)
+            self.stale_connection_ids.append(other_conn_id)
+
+    def expire_stale_connections(self):
+        with self._lock:
+            stale_connection_ids, self.stale_connection_ids = self.stale_connection_ids, []
+        if not stale_connection_ids:
+            return
+        try:
+            session_operations.expire_connections(
+                connection_table=self.connection_table,
+                session_id=self.session_id,
+                connection_ids=stale_connection_ids
+            )
+            logger.info("Expired stale connections", connection_ids=stale_connection_ids)
+        except ClientError as e:
+            logger.exception("Couldn't expire connections %s.", stale_connection_ids, exc_info=e)
+
+    def _record_latency(self, other_conn_id, latency):
+        metrics.record('fanout.post', latency)
+        with self._lock:
+            stats = self.latency_stats.setdefault(
+                other_conn_id, {'frames': 0, 'total': 0.0, 'max': 0.0}
+            )
+            stats['frames'] += 1
+            stats['total'] += latency
+            stats['max'] = max(stats['max'], latency)
+
+    def latency_summary(self):
+        """
+        :return: Per-connection frame count, mean and max post latency in seconds
+                 across every frame sent so far.
+        """
+        with self._lock:
+            return {
+                connection_id: {
+                    'frames': stats['frames'],
+                    'mean': stats['total'] / stats['frames'],
+                    'max': stats['max'],
+                }
+                for connection_id, stats in self.latency_stats.items()
+            }
+
+    def queue_stats(self):
+        """
+        :return: Per-connection send queue depth, merges, drops and throttling
+                 retries.
+        """
+        return {connection_id: sender.stats() for connection_id, sender in list(self.senders.items())}
+
+
+def encode_message(message):
+    # Convert message to bytes
+    if isinstance(message, dict):
+        return json.dumps(message).encode('utf-8')
+    elif isinstance(message, str):
+        return message.encode('utf-8')
+    elif isinstance(message, list):
+        return json.dumps(message).encode('utf-8')
+    elif isinstance(message, int):
+        return str(message).encode('utf-8')
+    elif isinstance(message, float):
+        return str(message).encode('utf-8')
+    elif isinstance(message, bool):
+        return str(message).encode('utf-8')
+    elif isinstance(getattr(message, 'value', None), str):
+        # openai Text objects, matched by shape so openai isn't imported here
+        return message.value.encode('utf-8')
+    else:
+        return str(message).encode('utf-8')
+
+
+class AsyncStreamToConnections(StreamToConnections):
+    """
+    StreamToConnections for an aioboto3 management client.
+
+    `consume` posts each frame from a queue to every connection concurrently,
+    waiting for a frame to reach all connections before sending the next, so
+    frames stay in order on each connection. The frame queue is the send
+    queue here; throttled posts are retried with the same backoff as
+    `ConnectionSender`.
+    """
+    async def get_connection_ids(self, connection_table, session_id):
+        connection_ids = connection_registry.get(session_id)
+        if connection_ids is None:
+            connection_ids = await async_session_operations.get_connection_ids(
+                connection_table=connection_table,
+                session_id=session_id
+            )
+            connection_registry.put(session_id, connection_ids)
+        self.connection_ids = connection_ids
+
+    async def consume(self, frames):
+        while (message := await frames.get()) is not None:
+            await self(message)
+
+    async def __call__(self, message):
+        message_bytes = encode_message(self.sequence(message))
+        results = await asyncio.gather(*[
+            self._post(connection_id, message_bytes)
+            for connection_id in list(self.connection_ids)
+        ])
+        latencies = {}
+        for other_conn_id, latency, gone in results:
+            latencies[other_conn_id] = latency
+            self._record_latency(other_conn_id, latency)
+            if gone:
+                self._drop_gone_connection(other_conn_id)
+        return latencies
+
+    async def _post(self, other_conn_id, message_bytes):
+        start = time.perf_counter()
+        gone = False
+        for attempt in range(SEND_MAX_RETRIES + 1):
             try:
-                # if other_conn_id != self._connection_id:
-                send_response = self.api_gateway_management_client.post_to_connection(
+                await self.api_gateway_management_client.post_to_connection(
                     Data=message_bytes, ConnectionId=other_conn_id
                 )
             except self.api_gateway_management_client.exceptions.GoneException as e:
                 logger.info("Connection %s is gone, removing.", other_conn_id, exc_info=e)
-                try:
-                    session_operations.remove_connection_id_from_session(
-                        connection_table=self.connection_table,
-                        connection_id=other_conn_id
-                    )
-                    self.connection_ids.remove(other_conn_id)
-                except ClientError as e:
-                    logger.exception("Couldn't remove connection %s.", other_conn_id, exc_info=e)
+                gone = True
             except ClientError as e:
+                if is_throttled(e) and attempt < SEND_MAX_RETRIES:
+                    await asyncio.sleep(backoff_delay(attempt))
+                    continue
                 logger.exception("Couldn't post to connection %s.", other_conn_id, exc_info=e)
+            except Exception as e:
+                # Connection errors and timeouts from botocore aren't ClientErrors
+                logger.exception("Couldn't post to connection %s.", other_conn_id, exc_info=e)
+            break
+        return other_conn_id, time.perf_counter() - start, gone
+
+    async def expire_stale_connections(self):
+        stale_connection_ids, self.stale_connection_ids = self.stale_connection_ids, []
+        if not stale_connection_ids:
+            return
+        try:
+            await async_session_operations.expire_connections(
+                connection_table=self.connection_table,
+                session_id=self.session_id,
+                connection_ids=stale_connection_ids
+            )
+            logger.info("Expired stale connections", connection_ids=stale_connection_ids)
+        except ClientError as e:
+            logger.exception("Couldn't expire connections %s.", stale_connection_ids, exc_info=e)
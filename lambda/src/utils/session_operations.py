@@ -1,25 +1,51 @@
 import json
+import os
 import time
 import structlog
+from concurrent.futures import ThreadPoolExecutor
 from . import prompt_helper
-from boto3.dynamodb.conditions import Key
+from .bio_cache import BIO_CACHE_ENABLED, bio_cache
+from .bio_parser import bio_event
+from .connection_registry import registry as connection_registry
+from .metrics import metrics
+from .replay_buffer import merge_segments
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
 
 logger = structlog.get_logger(__name__)
 connection_ids = []
 
-def create_session(session_table, llm_client, session_id):
-    thread_id = prompt_helper.create_thread(llm_client)
+CONNECTION_SESSION_INDEX = 'session_id-index'
+# Matches the Lambda timeout so a crashed turn frees the session
+TURN_LEASE_SECONDS = int(os.getenv('TURN_LEASE_SECONDS', '300'))
+DUNGEON_MASTER = 'Dungeon Master'
+# BatchWriteItem takes at most 25 items per request
+CONNECTION_BATCH_SIZE = 25
+TEARDOWN_CONCURRENCY = int(os.getenv('TEARDOWN_CONCURRENCY', '4'))
+CONNECTION_EXPIRY_SECONDS = 30
+
+@metrics.timed('dynamodb.create_session')
+def create_session(session_table, session_id):
+    # The OpenAI thread is assigned on the session's first action
     session = {
         'session_id': session_id,
         'user_set': [],
-        'dialogue': [],
-        'chat_history': [],
-        'thread_id': thread_id,
+        'turn_count': 0,
         'expiration_time': int(time.time()) + 3600 * 24 * 7
     }
-    session_table.put_item(Item=session)
+    try:
+        session_table.put_item(
+            Item=session,
+            ConditionExpression='attribute_not_exists(session_id)'
+        )
+    except ClientError as e:
+        if not is_condition_failure(e):
+            raise
+        logger.info("Session created by another request")
+        return get_session(session_table=session_table, session_id=session_id)
     return session
 
+@metrics.timed('dynamodb.add_connection_id_to_session')
 def add_connection_id_to_session(connection_table, session_id, connection_id):
     connection_table.put_item(
         Item={
@@ -29,63 +55,312 @@ def add_connection_id_to_session(connection_table, session_id, connection_id):
         }
     )
 
+@metrics.timed('dynamodb.get_session_id_for_connection')
 def get_session_id_for_connection(connection_table, connection_id):
     connection = connection_table.get_item(Key={'connection_id': connection_id})
     return connection['Item']['session_id'] if 'Item' in connection else None
 
+@metrics.timed('dynamodb.remove_connection_id_from_session')
 def remove_connection_id_from_session(connection_table, connection_id):
-    connection_table.update_item(
-        Key={'connection_id': connection_id},
-        UpdateExpression='SET expiration_time = :expiration_time',
-        ExpressionAttributeValues={':expiration_time': int(time.time()+30)}
-    )
+    connection_table.update_item(**expire_connection_request(connection_id))
+
+def expire_connection_request(connection_id):
+    return {
+        'Key': {'connection_id': connection_id},
+        'UpdateExpression': 'SET expiration_time = :expiration_time',
+        'ExpressionAttributeValues': {':expiration_time': int(time.time()) + CONNECTION_EXPIRY_SECONDS},
+    }
+
+def expired_connection_item(session_id, connection_id):
+    # BatchWriteItem can't update, so the whole connection item is rewritten
+    return {
+        'session_id': session_id,
+        'connection_id': connection_id,
+        'expiration_time': int(time.time()) + CONNECTION_EXPIRY_SECONDS,
+    }
+
+def connection_batches(connection_ids):
+    connection_ids = list(dict.fromkeys(connection_ids))
+    return [
+        connection_ids[i:i + CONNECTION_BATCH_SIZE]
+        for i in range(0, len(connection_ids), CONNECTION_BATCH_SIZE)
+    ]
+
+_teardown_executor = None
 
+def get_teardown_executor():
+    global _teardown_executor
+    if _teardown_executor is None:
+        _teardown_executor = ThreadPoolExecutor(
+            max_workers=TEARDOWN_CONCURRENCY,
+            thread_name_prefix='teardown'
+        )
+    return _teardown_executor
+
+@metrics.timed('dynamodb.expire_connections')
+def expire_connections(connection_table, session_id, connection_ids):
+    """
+    Expires a session's connections with batched writes of up to 25 items.
+    When there is more than one batch they are written concurrently.
+    """
+    batches = connection_batches(connection_ids)
+    if len(batches) > 1:
+        executor = get_teardown_executor()
+        futures = [
+            executor.submit(_expire_connection_batch, connection_table, session_id, batch)
+            for batch in batches
+        ]
+        for future in futures:
+            future.result()
+    elif batches:
+        _expire_connection_batch(connection_table, session_id, batches[0])
+    for connection_id in connection_ids:
+        connection_registry.discard(connection_id)
+
+def _expire_connection_batch(connection_table, session_id, connection_ids):
+    # The batch writer resends unprocessed items
+    with connection_table.batch_writer() as batch:
+        for connection_id in connection_ids:
+            batch.put_item(Item=expired_connection_item(session_id, connection_id))
+
+def connection_ids_query(session_id):
+    return {
+        'IndexName': CONNECTION_SESSION_INDEX,
+        'KeyConditionExpression': Key('session_id').eq(session_id),
+        'FilterExpression': Attr('expiration_time').gt(int(time.time())),
+        'ProjectionExpression': 'connection_id',
+    }
+
+@metrics.timed('dynamodb.get_connection_ids')
 def get_connection_ids(connection_table, session_id):
+    query_kwargs = connection_ids_query(session_id)
+    connection_ids = []
+    # Follow LastEvaluatedKey so large parties are never cut off at a page
+    while True:
+        page = connection_table.query(**query_kwargs)
+        connection_ids.extend(connection['connection_id'] for connection in page['Items'])
+        if 'LastEvaluatedKey' not in page:
+            return connection_ids
+        query_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+@metrics.timed('dynamodb.acquire_turn_lease')
+def acquire_turn_lease(session_table, session_id, owner, lease_seconds=TURN_LEASE_SECONDS):
+    """
+    Takes the session's turn lease with a conditional write. Succeeds when the
+    session exists and no lease is held or the held lease has expired.
+
+    :return: The session item as written by the lease, or None if another turn
+             holds the lease or the session doesn't exist.
+    """
+    try:
+        response = session_table.update_item(**acquire_lease_request(session_id, owner, lease_seconds))
+        return response['Attributes']
+    except ClientError as e:
+        if is_condition_failure(e):
+            logger.info("Turn lease not acquired")
+            return None
+        raise
+
+def acquire_lease_request(session_id, owner, lease_seconds):
     current_time = int(time.time())
-    connection_ids = connection_table.scan(
-        FilterExpression=Key('session_id').eq(session_id) & Key('expiration_time').gt(current_time),
-        ProjectionExpression='connection_id'
-    )
-    return [connection['connection_id'] for connection in connection_ids['Items']] if connection_ids['Items'] else []
+    return {
+        'Key': {'session_id': session_id},
+        'UpdateExpression': 'SET lease_owner = :owner, lease_expires_at = :expires_at',
+        'ConditionExpression': 'attribute_exists(session_id) AND (attribute_not_exists(lease_owner) OR lease_expires_at < :now)',
+        'ExpressionAttributeValues': {
+            ':owner': owner,
+            ':expires_at': current_time + lease_seconds,
+            ':now': current_time
+        },
+        # The session as of the lease, so the turn needn't read it separately
+        'ReturnValues': 'ALL_NEW',
+    }
 
-def check_processing_flag_to_session(session_table, session_id):
-    session = session_table.get_item(Key={'session_id': session_id}, ProjectionExpression='processing')
-    return session.get('processing', False) 
+def release_lease_request(session_id, owner):
+    return {
+        'Key': {'session_id': session_id},
+        'UpdateExpression': 'REMOVE lease_owner, lease_expires_at',
+        'ConditionExpression': 'lease_owner = :owner',
+        'ExpressionAttributeValues': {':owner': owner},
+    }
 
-def get_session(session_table, session_id):
-    session = session_table.get_item(Key={'session_id': session_id})
-    return session['Item'] if 'Item' in session else None
+def is_condition_failure(error):
+    return error.response['Error']['Code'] == 'ConditionalCheckFailedException'
 
+@metrics.timed('dynamodb.release_turn_lease')
+def release_turn_lease(session_table, session_id, owner):
+    # A lease that expired and was taken over is left to its new owner
+    try:
+        session_table.update_item(**release_lease_request(session_id, owner))
+    except ClientError as e:
+        if not is_condition_failure(e):
+            logger.exception("Couldn't release turn lease", exc_info=e)
+            return
+        logger.warning("Turn lease expired before release", owner=owner)
 
-def delete_session(session_table, session_id, connection_table):
-    session_table.delete_item(Key={'session_id': session_id})
-    # get all connection ids    
-    connection_ids = get_connection_ids(connection_table, session_id)
-    for connection_id in connection_ids:
-        remove_connection_id_from_session(connection_table, connection_id)
+@metrics.timed('dynamodb.get_session')
+def get_session(session_table, session_id, turn_table=None, since=None, limit=None):
+    session = session_table.get_item(Key={'session_id': session_id})
+    if 'Item' not in session:
+        return None
+    session = session['Item']
+    if turn_table is not None:
+        load_turns(session_table, turn_table, session, since=since, limit=limit)
+    return session
 
-def get_or_create_session(session_table, llm_client, session_id):
-    # Retrieve existing session or create a new one
-    session = get_session(
-        session_table=session_table, 
-        session_id=session_id
+def session_etag(session):
+    # Every write that changes what GET returns bumps the session version
+    return f'W/"{int(session.get("version", 0))}"'
+
+def load_turns(session_table, turn_table, session, since=None, limit=None):
+    """
+    Loads the session's turns after `since`, at most `limit` of them, into
+    `session['turns']`. `session['has_more_turns']` is set when the page was cut
+    short by the limit.
+    """
+    if 'dialogue' in session:
+        migrate_inline_history(session_table, turn_table, session)
+    session['turns'], session['has_more_turns'] = get_turns_page(
+        turn_table, session['session_id'], since=since, limit=limit
     )
-    if session:
-        logger.info("Existing session found")
-    else:
-        logger.info("Creating new session")
-        session = create_session(
-            session_table=session_table, 
-            llm_client=llm_client, 
-            session_id=session_id
-        )
     return session
 
+@metrics.timed('dynamodb.get_turns_page')
+def get_turns_page(turn_table, session_id, since=None, limit=None):
+    key_condition = Key('session_id').eq(session_id)
+    if since is not None:
+        key_condition = key_condition & Key('turn').gt(since)
+    query_kwargs = {'KeyConditionExpression': key_condition}
+    if limit is not None:
+        query_kwargs['Limit'] = limit
+    page = turn_table.query(**query_kwargs)
+    if limit is None:
+        while 'LastEvaluatedKey' in page:
+            items = page['Items']
+            page = turn_table.query(**query_kwargs, ExclusiveStartKey=page['LastEvaluatedKey'])
+            page['Items'] = items + page['Items']
+    return page['Items'], 'LastEvaluatedKey' in page
+
+def to_dialogue(turn):
+    return {'user': turn['user'], 'msg': turn['msg']}
+
+def to_chat_history(turn):
+    if turn['user'] == DUNGEON_MASTER:
+        return {'role': DUNGEON_MASTER, 'content': turn['msg']}
+    return {'role': 'user', 'content': f"{turn['user']}: {turn['msg']}"}
+
+def migrate_inline_history(session_table, turn_table, session):
+    """
+    Moves history stored inline on a session item into the turns table.
+
+    Older sessions kept a `dialogue` and a `chat_history` list on the item. The
+    dialogue holds everything needed to rebuild both views, so it is written as
+    turns numbered up to 0, ahead of any turns appended since. The turn writes
+    are idempotent, so a migration that races another one is harmless.
+    """
+    dialogue = session.pop('dialogue')
+    session.pop('chat_history', None)
+    logger.info("Migrating inline session history", turns=len(dialogue))
+    with turn_table.batch_writer() as batch:
+        for offset, entry in enumerate(dialogue):
+            batch.put_item(Item={
+                'session_id': session['session_id'],
+                'turn': offset - len(dialogue) + 1,
+                'expiration_time': session['expiration_time'],
+                **to_dialogue(entry)
+            })
+    try:
+        session_table.update_item(
+            Key={'session_id': session['session_id']},
+            UpdateExpression='REMOVE dialogue, chat_history',
+            ConditionExpression='attribute_exists(dialogue)'
+        )
+    except ClientError as e:
+        if not is_condition_failure(e):
+            raise
 
-def update_bios_as_needed(session_table, llm_client, body, session, stream_to_connections):
+@metrics.timed('dynamodb.get_turns')
+def get_turns(turn_table, session_id):
+    query_kwargs = {'KeyConditionExpression': Key('session_id').eq(session_id)}
+    turns = []
+    while True:
+        page = turn_table.query(**query_kwargs)
+        turns.extend(page['Items'])
+        if 'LastEvaluatedKey' not in page:
+            return turns
+        query_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+@metrics.timed('dynamodb.get_recent_turns')
+def get_recent_turns(turn_table, session_id, limit):
+    """
+    :return: Up to `limit` of the session's latest turns, oldest first.
+    """
+    page = turn_table.query(
+        KeyConditionExpression=Key('session_id').eq(session_id),
+        ScanIndexForward=False,
+        Limit=limit
+    )
+    return list(reversed(page['Items']))
+
+@metrics.timed('dynamodb.append_turns')
+def append_turns(session_table, turn_table, session, entries):
+    """
+    Appends entries to the session's turn log. Turn numbers are reserved with an
+    atomic counter on the session item, then each entry is written as its own
+    item, so the cost of a write does not grow with the length of the session.
+    """
+    response = session_table.update_item(**reserve_turns_request(session['session_id'], len(entries)))
+    first_turn = int(response['Attributes']['turn_count']) - len(entries) + 1
+    with turn_table.batch_writer() as batch:
+        for offset, entry in enumerate(entries):
+            batch.put_item(Item=turn_item(session, first_turn + offset, entry))
+    return first_turn
+
+def reserve_turns_request(session_id, count):
+    return {
+        'Key': {'session_id': session_id},
+        'UpdateExpression': 'ADD turn_count :count, version :one',
+        'ExpressionAttributeValues': {':count': count, ':one': 1},
+        'ReturnValues': 'UPDATED_NEW',
+    }
+
+def turn_item(session, turn, entry):
+    return {
+        'session_id': session['session_id'],
+        'turn': turn,
+        'expiration_time': session['expiration_time'],
+        **entry
+    }
+
+
+@metrics.timed('dynamodb.delete_session')
+def delete_session(session_table, session_id, connection_table, turn_table):
+    session_table.delete_item(Key={'session_id': session_id})
+    turns = get_turns(turn_table, session_id)
+    with turn_table.batch_writer() as batch:
+        for turn in turns:
+            batch.delete_item(Key={'session_id': session_id, 'turn': turn['turn']})
+    connection_registry.invalidate(session_id)
+    expire_connections(
+        connection_table,
+        session_id,
+        get_connection_ids(connection_table, session_id)
+    )
+
+@metrics.timed('turn.update_bios')
+def update_bios_as_needed(session_table, llm_client, body, session, stream_to_connections, unit_of_work=None):
+    """
+    Generates bios for users new to the session and records the new user set.
+
+    :param unit_of_work: When given, the session changes are staged on it
+                         rather than written straight away.
+    """
+    from . import chat_engine
     new_users = []
     new_user_bios_dict_list = []
     updated_user_bios = {}
+    # The chat engine has no thread; it sends the party with each prompt
+    thread_id = None if chat_engine.DM_ENGINE == 'chat' else session['thread_id']
     # If no UserBios, generate new bios for all users
     if 'user_bios' not in session or not session['user_bios']:
         session['user_bios'] = {}
@@ -95,6 +370,9 @@ def update_bios_as_needed(session_table, llm_client, body, session, stream_to_co
             if user['name'] not in [u['name'] for u in session['user_set']]:
                 new_users.append(user)
     
+    def send_bio(character, bio):
+        stream_to_connections(message=bio_event(character, bio))
+
     if new_users:
         stream_to_connections(message="""
                               
@@ -103,62 +381,178 @@ def update_bios_as_needed(session_table, llm_client, body, session, stream_to_co
                               
                               
                               """)
-        new_user_bios_dict_list =  prompt_helper.generate_character_bios(
+        use_cache = BIO_CACHE_ENABLED and not body.get('fresh_bios', session.get('fresh_bios', False))
+        users_to_generate = new_users
+        new_user_bios_dict_list = {}
+        if use_cache:
+            new_user_bios_dict_list, users_to_generate = bio_cache.lookup(new_users)
+            logger.info("Bio cache lookup", **bio_cache.stats())
+            if new_user_bios_dict_list:
+                cached_users = [user for user in new_users if user not in users_to_generate]
+                # Cached bios are saved with the user set in the single update below
+                for character, bio in new_user_bios_dict_list.items():
+                    send_bio(character, bio)
+                if thread_id is not None:
+                    prompt_helper.add_bios_to_thread(
+                        llm_client=llm_client,
+                        thread_id=thread_id,
+                        users=cached_users,
+                        bios=new_user_bios_dict_list
+                    )
+
+        if not users_to_generate:
+            generated_bios = {}
+        elif thread_id is None or (prompt_helper.BIO_GENERATION == 'parallel' and len(users_to_generate) > 1):
+            # Generated with Chat Completions, then merged and saved with the
+            # user set in the single update below
+            generated_bios = prompt_helper.generate_character_bios_parallel(
+                llm_client=llm_client,
+                thread_id=thread_id,
+                users=users_to_generate,
+                on_bio=send_bio
+            )
+        else:
+            # Streamed bios send their own cards as they close; they are saved
+            # with the user set in the single update below, once the run is over
+            generated_bios = prompt_helper.generate_character_bios(
                 llm_client=llm_client,
-                thread_id=session['thread_id'],
-                users=new_users,
+                thread_id=thread_id,
+                users=users_to_generate,
                 stream_to_connections=stream_to_connections
-                
             )
+        if use_cache:
+            bio_cache.store(users_to_generate, generated_bios)
+        new_user_bios_dict_list = new_user_bios_dict_list | generated_bios
         character_dict = {char: new_user_bios_dict_list[char] for char in new_user_bios_dict_list}
         updated_user_bios = session['user_bios']|character_dict
         
     
+    changes = {}
     if new_users:
-        users = list({v['name']:v for v in session['user_set'] + new_users}.values())
+        changes['user_set'] = list({v['name']:v for v in session['user_set'] + new_users}.values())
+    if new_users or updated_user_bios:
+        changes['user_bios'] = updated_user_bios
+    if 'fresh_bios' in body:
+        # Opting out of the bio cache sticks for the rest of the session
+        changes['fresh_bios'] = bool(body['fresh_bios'])
+    if changes and unit_of_work is not None:
+        for attribute, value in changes.items():
+            unit_of_work.set(attribute, value)
+        unit_of_work.add('version', 1)
+    elif changes:
         session_table.update_item(
             Key={'session_id': session['session_id']}, 
-            UpdateExpression='SET user_set = :users, user_bios = :user_bios', 
-            ExpressionAttributeValues={':users': users, ':user_bios': updated_user_bios}
+            UpdateExpression=f"SET {', '.join(f'{attribute} = :{attribute}' for attribute in changes)} ADD version :one", 
+            ExpressionAttributeValues={f':{attribute}': value for attribute, value in changes.items()} | {':one': 1}
         )
-    elif updated_user_bios:
-        session_table.update_item(
-            Key={'session_id': session['session_id']}, 
-            UpdateExpression='SET user_bios = :user_bios', 
-            ExpressionAttributeValues={':user_bios': updated_user_bios}
-        )   
     return new_user_bios_dict_list
 
-def add_message_to_session(session_table, llm_client, body, session, stream_to_connections):
+@metrics.timed('turn.add_message')
+def add_message_to_session(session_table, turn_table, llm_client, body, session, stream_to_connections, unit_of_work=None):
      # Add user's action to dialogue
     user_action = {
         'user': body['user'],
         'msg': body['msg']
     }
-    session['dialogue'].append(user_action)
-    # Update chat history
-    session['chat_history'].append({'role': 'user', 'content': f"{body['user']}: {body['msg']}"})
+    from . import chat_engine
+
     # Process action and generate DM response
-    dm_response = prompt_helper.process_action(
-        llm_client=llm_client,
-        thread_id=session['thread_id'],
-        user_action=user_action,
-        stream_to_connections=stream_to_connections
-    )
+    unsummarized = []
+    if chat_engine.DM_ENGINE == 'chat':
+        dm_response, unsummarized = chat_engine.process_action(
+            llm_client=llm_client,
+            session=session,
+            turns=get_recent_turns(turn_table, session['session_id'], chat_engine.HISTORY_FETCH_TURNS),
+            user_action=user_action,
+            stream_to_connections=stream_to_connections
+        )
+    else:
+        dm_response = prompt_helper.process_action(
+            llm_client=llm_client,
+            thread_id=session['thread_id'],
+            user_action=user_action,
+            stream_to_connections=stream_to_connections
+        )
     sent_response = dm_response.replace("\u2018", "'").replace("\u2019", "'")
-    dm_dialogue = {
-        'user': 'Dungeon Master',
-        'msg': sent_response
-    }
-    session['dialogue'].append(dm_dialogue)
-
-    # Update chat history with assistant's response
-    session['chat_history'].append({'role': 'Dungeon Master', 'content': sent_response})
-    # Update session in DynamoDB
-    session_table.update_item(
-        Key={'session_id': session['session_id']}, 
-        UpdateExpression='SET dialogue = :dialogue, chat_history = :chat_history', 
-        ExpressionAttributeValues={':dialogue': session['dialogue'], ':chat_history': session['chat_history']}
-    )
+    entries = [
+        user_action,
+        {'user': DUNGEON_MASTER, 'msg': sent_response}
+    ]
+    if unit_of_work is not None:
+        unit_of_work.append_turns(entries)
+    else:
+        # Append only the new turns; earlier history is never rewritten
+        append_turns(
+            session_table=session_table,
+            turn_table=turn_table,
+            session=session,
+            entries=entries
+        )
+    if unsummarized:
+        # The reply has already streamed, so only the save waits on this
+        try:
+            summary = chat_engine.summarize(llm_client, session.get('story_summary'), unsummarized)
+            through = int(unsummarized[-1]['turn'])
+            if unit_of_work is not None:
+                unit_of_work.set('story_summary', summary)
+                unit_of_work.set('summary_through', through)
+            else:
+                save_story_summary(
+                    session_table=session_table,
+                    session_id=session['session_id'],
+                    summary=summary,
+                    through=through
+                )
+        except Exception as e:
+            logger.exception("Couldn't update story summary", exc_info=e)
     return sent_response
- 
\ No newline at end of file
+
+def replay_position_request(session_id, position):
+    names = {f'#r{i}': attribute for i, attribute in enumerate(position)}
+    return {
+        'Key': {'session_id': session_id},
+        'UpdateExpression': 'SET ' + ', '.join(f'{name} = :r{i}' for i, name in enumerate(names)),
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': {f':r{i}': value for i, value in enumerate(position.values())},
+    }
+
+@metrics.timed('dynamodb.save_replay')
+def save_replay(replay_table, session_id, segment):
+    """Saves a segment taken from a replay buffer as its own item."""
+    replay_table.put_item(Item=dict(segment, session_id=session_id))
+
+@metrics.timed('dynamodb.get_replay')
+def get_replay(replay_table, session_id):
+    """
+    :return: The session's replay, joined from its saved segments, or None if
+             it has none.
+    """
+    query_kwargs = {'KeyConditionExpression': Key('session_id').eq(session_id)}
+    segments = []
+    while True:
+        page = replay_table.query(**query_kwargs)
+        segments.extend(page['Items'])
+        if 'LastEvaluatedKey' not in page:
+            return merge_segments(segments)
+        query_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+def save_replay_position(session_table, session_id, position):
+    """
+    Saves where a replay buffer's sequence is up to on the session. It doesn't
+    bump the session version, since nothing GET returns changes.
+    """
+    session_table.update_item(**replay_position_request(session_id, position))
+
+@metrics.timed('dynamodb.save_story_summary')
+def save_story_summary(session_table, session_id, summary, through):
+    # Never replace a summary with one that covers fewer turns
+    try:
+        session_table.update_item(
+            Key={'session_id': session_id},
+            UpdateExpression='SET story_summary = :summary, summary_through = :through',
+            ConditionExpression='attribute_not_exists(summary_through) OR summary_through < :through',
+            ExpressionAttributeValues={':summary': summary, ':through': through}
+        )
+    except ClientError as e:
+        if not is_condition_failure(e):
+            raise
@@ -0,0 +1,181 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import structlog
+from boto3.dynamodb.conditions import Attr, Key
+
+import utils.prompt_helper as prompt_helper
+from utils.connection_registry import registry as connection_registry
+from utils.session_operations import CONNECTION_SESSION_INDEX
+
+logger = structlog.get_logger(__name__)
+
+PURGE_CONCURRENCY = int(os.getenv('PURGE_CONCURRENCY', '8'))
+PURGE_SCAN_SEGMENTS = int(os.getenv('PURGE_SCAN_SEGMENTS', '4'))
+# BatchGetItem takes at most 100 keys per request
+SESSION_BATCH_SIZE = 100
+
+
+def purge_sessions(session_table, connection_table, turn_table, llm_client, session_ids=None, expired_before=None):
+    """
+    Deletes sessions, their turns and connections, and their OpenAI threads.
+
+    Sessions are named by `session_ids`, or found by a parallel scan for
+    sessions whose expiration_time is before `expired_before`. Threads are
+    deleted first, `PURGE_CONCURRENCY` at a time. A session whose thread
+    couldn't be deleted keeps its items so a later purge can retry it. The
+    rest are deleted with batched writes.
+
+    :return: A report of what was deleted, the failures and the throughput.
+    """
+    started = time.perf_counter()
+    if session_ids is not None:
+        sessions = get_sessions(session_table, session_ids)
+    elif expired_before is not None:
+        sessions = scan_expired_sessions(session_table, expired_before)
+    else:
+        raise ValueError("Either session_ids or expired_before is required")
+    logger.info("Purging sessions", sessions=len(sessions))
+
+    failures = []
+    with ThreadPoolExecutor(max_workers=PURGE_CONCURRENCY, thread_name_prefix='purge') as executor:
+        thread_results = executor.map(lambda session: _delete_thread(llm_client, session), sessions)
+        purgeable = []
+        threads_deleted = 0
+        for session, error in zip(sessions, thread_results):
+            if error is None:
+                purgeable.append(session['session_id'])
+                threads_deleted += 'thread_id' in session
+            else:
+                failures.append({'session_id': session['session_id'], 'error': error})
+
+        turn_keys = executor.map(lambda session_id: get_turn_keys(turn_table, session_id), purgeable)
+        connection_keys = executor.map(lambda session_id: get_connection_keys(connection_table, session_id), purgeable)
+        turn_keys = [key for keys in turn_keys for key in keys]
+        connection_keys = [key for keys in connection_keys for key in keys]
+
+    # Turns and connections go first, so a failed purge never strands them
+    # without the session item that leads to them
+    delete_items(turn_table, turn_keys)
+    delete_items(connection_table, connection_keys)
+    delete_items(session_table, [{'session_id': session_id} for session_id in purgeable])
+    for session_id in purgeable:
+        connection_registry.invalidate(session_id)
+
+    seconds = time.perf_counter() - started
+    report = {
+        'sessions': len(sessions),
+        'purged': len(purgeable),
+        'threads_deleted': threads_deleted,
+        'items_deleted': len(turn_keys) + len(connection_keys) + len(purgeable),
+        'failures': failures,
+        'seconds': seconds,
+        'sessions_per_second': len(purgeable) / seconds if seconds else None,
+    }
+    logger.info("Sessions purged", **{k: v for k, v in report.items() if k != 'failures'}, failed=len(failures))
+    return report
+
+
+def get_sessions(session_table, session_ids):
+    """
+    :return: The session_id and thread_id of each session that exists.
+    """
+    session_ids = list(dict.fromkeys(session_ids))
+    client = session_table.meta.client
+    sessions = []
+    for i in range(0, len(session_ids), SESSION_BATCH_SIZE):
+        request = {session_table.name: {
+            'Keys': [{'session_id': session_id} for session_id in session_ids[i:i + SESSION_BATCH_SIZE]],
+            'ProjectionExpression': 'session_id, thread_id',
+        }}
+        while request:
+            response = client.batch_get_item(RequestItems=request)
+            sessions.extend(response['Responses'].get(session_table.name, []))
+            request = response.get('UnprocessedKeys')
+    return sessions
+
+
+def scan_expired_sessions(session_table, expired_before, segments=PURGE_SCAN_SEGMENTS):
+    """
+    Scans the session table in `segments` parallel segments.
+
+    :return: The session_id and thread_id of each session that expired before
+             `expired_before`.
+    """
+    with ThreadPoolExecutor(max_workers=segments, thread_name_prefix='purge-scan') as executor:
+        pages = executor.map(
+            lambda segment: _scan_segment(session_table, expired_before, segment, segments),
+            range(segments)
+        )
+        return [session for page in pages for session in page]
+
+
+def _scan_segment(session_table, expired_before, segment, segments):
+    scan_kwargs = {
+        'Segment': segment,
+        'TotalSegments': segments,
+        'FilterExpression': Attr('expiration_time').lt(int(expired_before)),
+        'ProjectionExpression': 'session_id, thread_id',
+    }
+    sessions = []
+    while True:
+        page = session_table.scan(**scan_kwargs)
+        sessions.extend(page['Items'])
+        if 'LastEvaluatedKey' not in page:
+            return sessions
+        scan_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+
+def get_turn_keys(turn_table, session_id):
+    query_kwargs = {
+        'KeyConditionExpression': Key('session_id').eq(session_id),
+        'ProjectionExpression': 'session_id, turn',
+    }
+    keys = []
+    while True:
+        page = turn_table.query(**query_kwargs)
+        keys.extend(page['Items'])
+        if 'LastEvaluatedKey' not in page:
+            return keys
+        query_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+
+def get_connection_keys(connection_table, session_id):
+    # Unlike get_connection_ids, expired connections are included
+    query_kwargs = {
+        'IndexName': CONNECTION_SESSION_INDEX,
+        'KeyConditionExpression': Key('session_id').eq(session_id),
+        'ProjectionExpression': 'connection_id',
+    }
+    keys = []
+    while True:
+        page = connection_table.query(**query_kwargs)
+        keys.extend({'connection_id': item['connection_id']} for item in page['Items'])
+        if 'LastEvaluatedKey' not in page:
+            return keys
+        query_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+
+def delete_items(table, keys):
+    # The batch writer sends 25 deletes per BatchWriteItem and resends unprocessed ones
+    with table.batch_writer() as batch:
+        for key in keys:
+            batch.delete_item(Key=key)
+
+
+def _delete_thread(llm_client, session):
+    """
+    :return: None if the session has no thread left, or the error that kept
+             it from being deleted.
+    """
+    thread_id = session.get('thread_id')
+    if not thread_id:
+        return None
+    try:
+        prompt_helper.delete_thread(llm_client=llm_client, thread_id=thread_id)
+    except Exception as e:
+        if getattr(e, 'status_code', None) == 404:
+            return None
+        return str(e)
+    return None
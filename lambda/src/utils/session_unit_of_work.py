@@ -0,0 +1,230 @@
+import structlog
+
+from utils.metrics import metrics
+from utils import async_session_operations, session_operations
+from utils.session_operations import turn_item
+
+logger = structlog.get_logger(__name__)
+
+# What a chat turn reads from the session item
+TURN_ATTRIBUTES = (
+    'session_id', 'thread_id', 'user_set', 'user_bios', 'turn_count',
+    'expiration_time', 'fresh_bios', 'story_summary', 'summary_through',
+    'replay_turn', 'replay_next_seq',
+)
+
+
+class SessionUnitOfWork:
+    """
+    Request-scoped reads and writes of one session and its turns.
+
+    The session item is read once, with only the attributes the route needs,
+    or taken from the write that acquires the turn lease.
+    Changes are staged and sent together by `commit`: a single UpdateItem when
+    only the session changes, or one TransactWriteItems when turns are
+    written as well, so a turn's writes all land or none do.
+    """
+    def __init__(self, session_table, turn_table, session_id):
+        self.session_table = session_table
+        self.turn_table = turn_table
+        self.session_id = session_id
+        self.session = None
+        self._sets = {}
+        self._adds = {}
+        self._removes = []
+        self._conditions = []
+        self._condition_values = {}
+        self._turns = []
+
+    @metrics.timed('dynamodb.session_load')
+    def load(self, attributes=TURN_ATTRIBUTES):
+        """
+        :return: The requested attributes of the session, or None if it
+                 doesn't exist.
+        """
+        if self.session is not None:
+            return self.session
+        response = self.session_table.get_item(**self.load_request(attributes))
+        self.session = response.get('Item')
+        return self.session
+
+    def load_request(self, attributes):
+        names = {f'#a{i}': attribute for i, attribute in enumerate(attributes)}
+        return {
+            'Key': {'session_id': self.session_id},
+            'ProjectionExpression': ', '.join(names),
+            'ExpressionAttributeNames': names,
+        }
+
+    def exists(self):
+        return self.load(attributes=('session_id',)) is not None
+
+    def acquire_lease(self, owner):
+        """
+        Takes the session's turn lease and loads the session from the item the
+        lease write returns, so no other turn can commit between the two.
+
+        :return: True if the lease was acquired, False if another turn holds it
+                 or the session doesn't exist.
+        """
+        item = session_operations.acquire_turn_lease(
+            session_table=self.session_table,
+            session_id=self.session_id,
+            owner=owner
+        )
+        return self._leased(item)
+
+    def _leased(self, item):
+        if item is None:
+            return False
+        self.session = {attribute: item[attribute] for attribute in TURN_ATTRIBUTES if attribute in item}
+        return True
+
+    def set(self, attribute, value):
+        self._sets[attribute] = value
+        if self.session is not None:
+            self.session[attribute] = value
+
+    def add(self, attribute, value):
+        self._adds[attribute] = self._adds.get(attribute, 0) + value
+
+    def remove(self, *attributes):
+        self._removes.extend(attributes)
+
+    def require(self, condition, values=None):
+        """Adds a condition the commit must meet. Placeholders must be unique."""
+        self._conditions.append(f'({condition})')
+        self._condition_values.update(values or {})
+
+    def release_lease(self, owner):
+        """Releases the turn lease in the commit, which only lands while it is still held."""
+        self.remove('lease_owner', 'lease_expires_at')
+        self.require('lease_owner = :lease_owner', {':lease_owner': owner})
+
+    def append_turns(self, entries):
+        """
+        Stages entries as the session's next turns.
+
+        Turn numbers follow the turn count that was read, and the commit checks
+        it is unchanged, so turns can't be numbered twice.
+
+        :return: The first of the new turn numbers.
+        """
+        turn_count = int(self.session.get('turn_count', 0))
+        if 'turn_count' in self.session and 'turn_count' not in self._sets:
+            self.require('turn_count = :read_turn_count', {':read_turn_count': turn_count})
+        elif 'turn_count' not in self._sets:
+            self.require('attribute_not_exists(turn_count)')
+        first_turn = turn_count + len(self._turns) + 1
+        for offset, entry in enumerate(entries):
+            self._turns.append(turn_item(self.session, first_turn + offset, entry))
+        self._sets['turn_count'] = turn_count + len(self._turns)
+        self.add('version', 1)
+        return first_turn
+
+    @property
+    def pending(self):
+        return bool(self._sets or self._adds or self._removes or self._turns)
+
+    def update_request(self):
+        names = {}
+        values = dict(self._condition_values)
+
+        def name(attribute):
+            placeholder = f'#u{len(names)}'
+            names[placeholder] = attribute
+            return placeholder
+
+        clauses = []
+        if self._sets:
+            assignments = []
+            for attribute, value in self._sets.items():
+                placeholder = f':u{len(values)}'
+                values[placeholder] = value
+                assignments.append(f'{name(attribute)} = {placeholder}')
+            clauses.append('SET ' + ', '.join(assignments))
+        if self._adds:
+            increments = []
+            for attribute, value in self._adds.items():
+                placeholder = f':u{len(values)}'
+                values[placeholder] = value
+                increments.append(f'{name(attribute)} {placeholder}')
+            clauses.append('ADD ' + ', '.join(increments))
+        if self._removes:
+            clauses.append('REMOVE ' + ', '.join(name(attribute) for attribute in dict.fromkeys(self._removes)))
+
+        request = {
+            'Key': {'session_id': self.session_id},
+            'UpdateExpression': ' '.join(clauses),
+            'ExpressionAttributeNames': names,
+        }
+        if self._conditions:
+            request['ConditionExpression'] = ' AND '.join(self._conditions)
+        if values:
+            request['ExpressionAttributeValues'] = values
+        return request
+
+    @metrics.timed('dynamodb.session_commit')
+    def commit(self):
+        if not self.pending:
+            return
+        request = self.update_request()
+        if not self._turns:
+            self.session_table.update_item(**request)
+        else:
+            # The resource's client takes plain Python values, as the tables do
+            self.session_table.meta.client.transact_write_items(TransactItems=self.transact_items(request))
+        self._committed()
+
+    def transact_items(self, request):
+        return [
+            {'Update': dict(request, TableName=self.session_table.name)}
+        ] + [
+            {'Put': {'TableName': self.turn_table.name, 'Item': item}}
+            for item in self._turns
+        ]
+
+    def _committed(self):
+        logger.info("Session changes committed", turns=len(self._turns), attributes=list(self._sets))
+        self._sets = {}
+        self._adds = {}
+        self._removes = []
+        self._conditions = []
+        self._condition_values = {}
+        self._turns = []
+
+
+class AsyncSessionUnitOfWork(SessionUnitOfWork):
+    """
+    `SessionUnitOfWork` over aioboto3 tables. Changes are staged the same way;
+    loading, the lease and the commit are awaited.
+    """
+    async def load(self, attributes=TURN_ATTRIBUTES):
+        if self.session is not None:
+            return self.session
+        with metrics.timer('dynamodb.session_load'):
+            response = await self.session_table.get_item(**self.load_request(attributes))
+        self.session = response.get('Item')
+        return self.session
+
+    async def exists(self):
+        return await self.load(attributes=('session_id',)) is not None
+
+    async def acquire_lease(self, owner):
+        item = await async_session_operations.acquire_turn_lease(
+            session_table=self.session_table,
+            session_id=self.session_id,
+            owner=owner
+        )
+        return self._leased(item)
+
+    async def commit(self):
+        if not self.pending:
+            return
+        request = self.update_request()
+        with metrics.timer('dynamodb.session_commit'):
+            if not self._turns:
+                await self.session_table.update_item(**request)
+            else:
+                await self.session_table.meta.client.transact_write_items(TransactItems=self.transact_items(request))
+        self._committed()
@@ -0,0 +1,141 @@
+import os
+import re
+import threading
+import time
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+FLUSH_BYTES = int(os.getenv('STREAM_FLUSH_BYTES', '256'))
+FLUSH_INTERVAL = float(os.getenv('STREAM_FLUSH_INTERVAL', '0.15'))
+FLUSH_ON_SENTENCE = os.getenv('STREAM_FLUSH_ON_SENTENCE', 'true').lower() == 'true'
+
+# Newline runs are always sent as their own frame. The frontend treats any
+# frame containing a newline as a line break and drops its text, so text
+# must never share a frame with a newline.
+NEWLINE_SPLIT = re.compile(r'(\n+)')
+SENTENCE_END = ('.', '!', '?', '."', '!"', '?"')
+
+
+class CoalescingBuffer:
+    """
+    Coalesces small text deltas into larger websocket frames.
+
+    The first delta of a stream is sent straight away to keep time-to-first-token
+    low. After that text is buffered until it reaches `flush_bytes`, has been held
+    for `flush_interval` seconds, or ends a sentence. Newlines flush the buffer and
+    are sent as a frame of their own. `close` must be called when the run ends to
+    send whatever is left.
+
+    The time window is kept by a timer thread, so text held when the model
+    pauses is still sent on time. A caller that can't be sent to from another
+    thread passes `flush_timer=False` and calls `flush_due` at `deadline`.
+    """
+    def __init__(self, send, flush_bytes=FLUSH_BYTES, flush_interval=FLUSH_INTERVAL, flush_on_sentence=FLUSH_ON_SENTENCE, flush_timer=True):
+        self.send = send
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.flush_on_sentence = flush_on_sentence
+        self.flush_timer = flush_timer
+        self._parts = []
+        self._size = 0
+        self._buffered_at = None
+        self._first_sent = False
+        self._timer = None
+        # Held while sending, so a timed flush can't reorder frames
+        self._lock = threading.RLock()
+        self.deltas_in = 0
+        self.frames_out = 0
+
+    def write(self, text):
+        if not text:
+            return
+        with self._lock:
+            self.deltas_in += 1
+            for part in NEWLINE_SPLIT.split(text):
+                if not part:
+                    continue
+                if part[0] == '\n':
+                    self.flush()
+                    self._send(part)
+                else:
+                    self._append(part)
+
+            if not self._first_sent:
+                self.flush()
+            elif self._should_flush():
+                self.flush()
+
+    def send_frame(self, message):
+        """Sends a non-text frame, flushing any buffered text ahead of it."""
+        with self._lock:
+            self.flush()
+            self._send(message)
+
+    def flush(self):
+        with self._lock:
+            if not self._parts:
+                return
+            text = ''.join(self._parts)
+            self._parts = []
+            self._size = 0
+            self._buffered_at = None
+            self._cancel_timer()
+            self._send(text)
+
+    def deadline(self):
+        """:return: When the buffered text is due, by `time.monotonic`, or None if there is none."""
+        with self._lock:
+            if self._buffered_at is None:
+                return None
+            return self._buffered_at + self.flush_interval
+
+    def flush_due(self):
+        """Flushes the buffered text if it has been held for the time window."""
+        with self._lock:
+            deadline = self.deadline()
+            if deadline is not None and time.monotonic() >= deadline:
+                self.flush()
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._cancel_timer()
+        logger.info("Stream coalesced", deltas_in=self.deltas_in, frames_out=self.frames_out)
+
+    def _append(self, text):
+        if self._buffered_at is None:
+            self._buffered_at = time.monotonic()
+            # The first delta is sent straight away, so it needs no timer
+            if self.flush_timer and self._first_sent:
+                self._timer = threading.Timer(self.flush_interval, self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        self._parts.append(text)
+        self._size += len(text.encode('utf-8'))
+
+    def _flush_on_timer(self):
+        try:
+            self.flush_due()
+        except Exception as e:
+            logger.exception("Timed flush failed", exc_info=e)
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _should_flush(self):
+        if not self._parts:
+            return False
+        if self._size >= self.flush_bytes:
+            return True
+        if time.monotonic() - self._buffered_at >= self.flush_interval:
+            return True
+        return self.flush_on_sentence and self._parts[-1].rstrip().endswith(SENTENCE_END)
+
+    def _send(self, message):
+        self._first_sent = True
+        self.frames_out += 1
+        self.send(message)
@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+import boto3
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+TURN_QUEUE_URL = os.getenv('TURN_QUEUE_URL')
+# Jobs that keep failing are moved here by the worker; see turn_worker
+TURN_DEAD_LETTER_QUEUE_URL = os.getenv('TURN_DEAD_LETTER_QUEUE_URL')
+# Where the local stand-in keeps jobs when no queue URL is configured
+LOCAL_TURN_QUEUE_PATH = os.getenv('LOCAL_TURN_QUEUE_PATH', '/tmp/dd-turn-queue.jsonl')
+
+
+def make_turn_job(session_id, connection_id, message, endpoint_url):
+    return {
+        'job_id': str(uuid.uuid4()),
+        'session_id': session_id,
+        'connection_id': connection_id,
+        'message': message,
+        'endpoint_url': endpoint_url,
+        'enqueued_at': time.time(),
+    }
+
+
+class SQSTurnQueue:
+    """
+    Sends turn jobs to SQS. On a FIFO queue jobs are grouped by session, so
+    turns for one session reach the worker one at a time and in order.
+    """
+    def __init__(self, queue_url, sqs_client=None):
+        self.queue_url = queue_url
+        self.sqs_client = sqs_client or boto3.client('sqs')
+
+    def send(self, job):
+        send_kwargs = {
+            'QueueUrl': self.queue_url,
+            'MessageBody': json.dumps(job),
+        }
+        if self.queue_url.endswith('.fifo'):
+            send_kwargs['MessageGroupId'] = job['session_id']
+            send_kwargs['MessageDeduplicationId'] = job['job_id']
+        self.sqs_client.send_message(**send_kwargs)
+
+    def defer(self, record, delay):
+        """Makes a received job visible again after `delay` seconds."""
+        self.sqs_client.change_message_visibility(
+            QueueUrl=self.queue_url,
+            ReceiptHandle=record['receiptHandle'],
+            VisibilityTimeout=delay
+        )
+
+
+class LocalTurnQueue:
+    """
+    File-backed stand-in for the SQS queue, one JSON job per line.
+
+    `receive` hands back jobs in the shape of an SQS event so they can be passed
+    straight to the worker entry point.
+    """
+    def __init__(self, path=LOCAL_TURN_QUEUE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, job):
+        with self._lock, open(self.path, 'a') as queue_file:
+            queue_file.write(json.dumps(job) + '\n')
+
+    def receive(self, max_messages=10):
+        now = time.time()
+        with self._lock:
+            if not os.path.exists(self.path):
+                return {'Records': []}
+            with open(self.path) as queue_file:
+                lines = [line for line in queue_file if line.strip()]
+            ready = [i for i, line in enumerate(lines) if json.loads(line).get('visible_at', 0) <= now][:max_messages]
+            with open(self.path, 'w') as queue_file:
+                queue_file.writelines(line for i, line in enumerate(lines) if i not in ready)
+        return {
+            'Records': [
+                {'messageId': json.loads(lines[i])['job_id'], 'body': lines[i].strip()}
+                for i in ready
+            ]
+        }
+
+    def defer(self, record, delay):
+        """Puts a received job back, to be received again after `delay` seconds."""
+        self.send(dict(json.loads(record['body']), visible_at=time.time() + delay))
+
+    def __len__(self):
+        with self._lock:
+            if not os.path.exists(self.path):
+                return 0
+            with open(self.path) as queue_file:
+                return sum(1 for line in queue_file if line.strip())
+
+
+_turn_queue = None
+
+def get_turn_queue():
+    global _turn_queue
+    if _turn_queue is None:
+        if TURN_QUEUE_URL:
+            _turn_queue = SQSTurnQueue(TURN_QUEUE_URL)
+        else:
+            logger.info("No turn queue configured, using local queue", path=LOCAL_TURN_QUEUE_PATH)
+            _turn_queue = LocalTurnQueue()
+    return _turn_queue
+
+def get_dead_letter_queue():
+    """:return: The dead-letter queue, or None when none is configured."""
+    if not TURN_DEAD_LETTER_QUEUE_URL:
+        return None
+    return SQSTurnQueue(TURN_DEAD_LETTER_QUEUE_URL)
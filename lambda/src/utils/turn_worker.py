@@ -0,0 +1,132 @@
+import json
+import os
+import random
+import time
+
+import structlog
+from botocore.exceptions import BotoCoreError, ClientError
+
+import utils.session_manager as session_manager
+import utils.client_pool as client_pool
+from utils import async_runtime
+from utils.turn_queue import get_dead_letter_queue, get_turn_queue
+
+logger = structlog.get_logger(__name__)
+
+# A job that finds the session's lease held is retried after this many
+# seconds, plus up to as many again of jitter, not the queue's visibility timeout
+LEASE_RETRY_DELAY = int(os.getenv('LEASE_RETRY_DELAY', '5'))
+# A job that fails for any other reason is redelivered after the visibility
+# timeout, until it is this old; then the worker moves it to the dead-letter queue
+TURN_JOB_MAX_AGE = int(os.getenv('TURN_JOB_MAX_AGE', '900'))
+
+
+class TurnLeaseHeld(Exception):
+    """Another turn on the session is running, so the job must be retried."""
+
+
+def handle_turn_jobs(event, session_table, connection_table, turn_table, llm_client, turn_queue=None):
+    """
+    Runs the turn jobs in an SQS event, streaming each reply to the session's
+    connections.
+
+    Jobs that found the session's lease held are retried after a short delay.
+    Since each retry counts as a receive, the queue's redrive allows many;
+    jobs that fail for other reasons are held to `TURN_JOB_MAX_AGE` instead.
+
+    :param turn_queue: The queue the event came from, used to reschedule jobs.
+    :return: The IDs of jobs that failed, in the partial batch response format,
+             so only those are redelivered.
+    """
+    if turn_queue is None:
+        turn_queue = get_turn_queue()
+    failures = []
+    for record in event.get('Records', []):
+        try:
+            process_turn_job(
+                job=json.loads(record['body']),
+                session_table=session_table,
+                connection_table=connection_table,
+                turn_table=turn_table,
+                llm_client=llm_client
+            )
+        except TurnLeaseHeld:
+            retry_after_lease(turn_queue, record)
+            failures.append({'itemIdentifier': record['messageId']})
+        except Exception as e:
+            logger.exception("Turn job failed", message_id=record.get('messageId'), exc_info=e)
+            if not dead_letter_expired_job(record):
+                failures.append({'itemIdentifier': record['messageId']})
+    return {'batchItemFailures': failures}
+
+
+def retry_after_lease(turn_queue, record):
+    delay = LEASE_RETRY_DELAY + random.randint(0, LEASE_RETRY_DELAY)
+    logger.info("Turn lease held, retrying job", message_id=record['messageId'], delay=delay)
+    try:
+        turn_queue.defer(record, delay)
+    except (BotoCoreError, ClientError) as e:
+        # The job is still redelivered, after the visibility timeout
+        logger.exception("Couldn't reschedule turn job", exc_info=e)
+
+
+def dead_letter_expired_job(record):
+    """
+    Moves a failed job older than `TURN_JOB_MAX_AGE` to the dead-letter queue.
+
+    :return: True if the job was moved, so it is deleted from the turn queue.
+    """
+    dead_letter_queue = get_dead_letter_queue()
+    if dead_letter_queue is None:
+        return False
+    try:
+        job = json.loads(record['body'])
+        if time.time() - job['enqueued_at'] < TURN_JOB_MAX_AGE:
+            return False
+        dead_letter_queue.send(job)
+    except (ValueError, KeyError, TypeError):
+        # Left to the queue's redrive policy
+        return False
+    except (BotoCoreError, ClientError) as e:
+        logger.exception("Couldn't dead-letter turn job", exc_info=e)
+        return False
+    logger.warning("Turn job dead-lettered", message_id=record['messageId'], job_id=job['job_id'])
+    return True
+
+
+def process_turn_job(job, session_table, connection_table, turn_table, llm_client):
+    structlog.contextvars.bind_contextvars(session_id=job['session_id'], job_id=job['job_id'])
+    logger.info("Running turn job", queue_wait=time.time() - job['enqueued_at'])
+    entry_kwargs = dict(
+        session_table=session_table,
+        llm_client=llm_client,
+        session_id=job['session_id'],
+        message=job['message'],
+        connection_table=connection_table,
+        turn_table=turn_table,
+        connection_id=job['connection_id'],
+        api_gateway_management_client=client_pool.get_management_client(job['endpoint_url'])
+    )
+    if session_manager.TURN_PIPELINE == 'async':
+        response = async_runtime.run(session_manager.add_entry_async(**entry_kwargs))
+    else:
+        response = session_manager.add_entry(**entry_kwargs)
+    # A player sending inline gets the wait reply; a queued action would be lost
+    if response.get('body') == session_manager.LEASE_HELD_BODY:
+        raise TurnLeaseHeld(job['session_id'])
+    return response
+
+
+def run_local_worker(turn_queue, session_table, connection_table, turn_table, llm_client, batch_size=10):
+    """
+    Drains a LocalTurnQueue through the same path the SQS worker takes.
+
+    :return: The number of jobs run.
+    """
+    jobs_run = 0
+    while True:
+        event = turn_queue.receive(max_messages=batch_size)
+        if not event['Records']:
+            return jobs_run
+        handle_turn_jobs(event, session_table, connection_table, turn_table, llm_client, turn_queue=turn_queue)
+        jobs_run += len(event['Records'])
@@ -1,14 +1,24 @@
 import json
+import os
 import structlog
-import boto3
 
 import utils.session_operations as session_operations
 import utils.session_manager as session_manager
+import utils.client_pool as client_pool
+from utils import async_runtime
+from utils.turn_queue import get_turn_queue, make_turn_job
+from utils.session_unit_of_work import SessionUnitOfWork
+from utils.connection_registry import registry as connection_registry
+from utils.connection_sender import ConnectionSender
+from utils.replay_buffer import frames_after, replay_table
 
 from botocore.exceptions import ClientError 
 logger = structlog.get_logger(__name__)
 
-def handle_websocket_connection(event, session_table, connection_table, llm_client):
+# 'queue' hands turns to the turn worker instead of running them in this invocation
+TURN_DISPATCH = os.getenv('TURN_DISPATCH', 'inline')
+
+def handle_websocket_connection(event, session_table, connection_table, turn_table, llm_client):
     
     route_key = event.get("requestContext", {}).get("routeKey")
     connection_id = event.get("requestContext", {}).get("connectionId")
@@ -36,9 +46,8 @@ def handle_websocket_connection(event, session_table, connection_table, llm_clie
     elif route_key == "sendmessage":
         domain = event.get("requestContext", {}).get("domainName")
         stage = event.get("requestContext", {}).get("stage")
-        api_gateway_management_client = boto3.client(
-            "apigatewaymanagementapi", endpoint_url=f"https://{domain}/{stage}"
-        )
+        api_gateway_management_client = client_pool.get_management_client(f"https://{domain}/{stage}")
+        logger.info("API Gateway management client ready", **client_pool.pool_stats())
         
         body = json.loads(body_str) if body_str is not None else {"msg": ""}
         message = body.get("msg", "")   
@@ -54,11 +63,26 @@ def handle_websocket_connection(event, session_table, connection_table, llm_clie
             response["statusCode"] = handle_message(
                 session_table=session_table,    
                 connection_table=connection_table,
+                turn_table=turn_table,
                 connection_id=connection_id,
                 event_body=message,
                 llm_client=llm_client,
                 api_gateway_management_client=api_gateway_management_client
             )
+    elif route_key == "resume":
+        domain = event.get("requestContext", {}).get("domainName")
+        stage = event.get("requestContext", {}).get("stage")
+        body = json.loads(body_str) if body_str is not None else {}
+        if domain is None or stage is None or 'turn' not in body or 'seq' not in body:
+            response["statusCode"] = 400
+        else:
+            response["statusCode"] = handle_resume(
+                connection_table=connection_table,
+                connection_id=connection_id,
+                turn=body['turn'],
+                seq=body['seq'],
+                api_gateway_management_client=client_pool.get_management_client(f"https://{domain}/{stage}")
+            )
     else:
         response["statusCode"] = 404
 
@@ -78,17 +102,19 @@ def handle_connect(session_id, session_table,connection_table, connection_id, ll
     status_code = 200
 
     try:
-        session = session_operations.get_or_create_session(
-            session_table=session_table,
-            llm_client=llm_client,
-            session_id=session_id
-        )
+        # Only existence matters here; the thread is assigned on the first action
+        if not SessionUnitOfWork(session_table, None, session_id).exists():
+            session_operations.create_session(
+                session_table=session_table,
+                session_id=session_id
+            )
         # add the connection id to the session
         session_operations.add_connection_id_to_session(
             connection_table=connection_table,
             session_id=session_id,
             connection_id=connection_id
         )
+        connection_registry.add(session_id, connection_id)
         
         logger.info("Added connection %s for session %s.", connection_id, session_id)
     except ClientError:
@@ -113,6 +139,7 @@ def handle_disconnect(connection_table, connection_id):
             connection_table=connection_table,
             connection_id=connection_id
         )
+        connection_registry.discard(connection_id)
         logger.info("Disconnected connection %s.", connection_id)
     except ClientError:
         logger.exception("Couldn't disconnect connection %s.", connection_id)
@@ -120,7 +147,49 @@ def handle_disconnect(connection_table, connection_id):
     return status_code
 
 
-def handle_message(session_table, connection_table, connection_id, event_body, llm_client, api_gateway_management_client):
+def handle_resume(connection_table, connection_id, turn, seq, api_gateway_management_client):
+    """
+    Sends a reconnecting client the frames it missed from the session's replay
+    buffer, followed by a `resume` frame with the buffer's turn, last sequence
+    number and whether the turn has finished. A client resuming a turn that
+    is still running resumes again until it has. When the missed frames are
+    no longer buffered a `resync` frame is sent instead, and the client
+    refetches the session.
+
+    :param turn: The turn of the last frame the client received.
+    :param seq: The sequence number of the last frame the client received.
+    :return: An HTTP status code that indicates the result of the resume.
+    """
+    session_id = session_operations.get_session_id_for_connection(
+        connection_table=connection_table,
+        connection_id=connection_id
+    )
+    if session_id is None:
+        logger.warning("Session ID not found for connection %s.", connection_id)
+        return 404
+    structlog.contextvars.bind_contextvars(session_id=session_id)
+    replay = session_operations.get_replay(replay_table, session_id)
+
+    sender = ConnectionSender(api_gateway_management_client, connection_id)
+    frames = frames_after(replay, turn, seq)
+    if frames is None:
+        sender.put({'type': 'resync'}, json.dumps({'type': 'resync'}).encode('utf-8'))
+    else:
+        for frame in frames:
+            sender.put(json.loads(frame), frame.encode('utf-8'))
+        replay = replay or {}
+        status = {
+            'type': 'resume',
+            'turn': int(replay.get('turn', turn)),
+            'last_seq': int(replay.get('next_seq', int(seq) + 1)) - 1,
+            'complete': bool(replay.get('complete', True)),
+        }
+        sender.put(status, json.dumps(status).encode('utf-8'))
+    sender.drain()
+    logger.info("Connection resumed", turn=turn, seq=seq, frames=len(frames or []), resync=frames is None)
+    return 200
+
+def handle_message(session_table, connection_table, turn_table, connection_id, event_body, llm_client, api_gateway_management_client):
     """
     Handles messages sent by a participant in the chat. Looks up all connections
     currently tracked in the DynamoDB table, and uses the API Gateway Management API
@@ -131,12 +200,14 @@ def handle_message(session_table, connection_table, connection_id, event_body, l
     because disconnect messages are not always sent when a client disconnects.
 
     :param table: The DynamoDB connection table.
+    :param turn_table: The DynamoDB table holding each session's turns.
     :param connection_id: The ID of the connection that sent the message.
     :param event_body: The body of the message sent from API Gateway. This is a
                        dict with a `msg` field that contains the message to send.
     :param apig_management_client: A Boto3 API Gateway Management API client.
     :return: An HTTP status code that indicates the result of posting the message
-             to all active connections.
+             to all active connections. When turns are dispatched to the queue
+             this only reflects whether the turn was queued.
     """
     status_code = 200
     try:
@@ -149,15 +220,28 @@ def handle_message(session_table, connection_table, connection_id, event_body, l
             status_code = 404
         else:
             structlog.contextvars.bind_contextvars(session_id=session_id)  
-            session_manager.add_entry(
-            session_table=session_table,
-            llm_client=llm_client,
-            session_id=session_id,
-            message=event_body,
-            connection_table=connection_table,
-            connection_id=connection_id,
-            api_gateway_management_client=api_gateway_management_client
-        )
+            entry_kwargs = dict(
+                session_table=session_table,
+                llm_client=llm_client,
+                session_id=session_id,
+                message=event_body,
+                connection_table=connection_table,
+                turn_table=turn_table,
+                connection_id=connection_id,
+                api_gateway_management_client=api_gateway_management_client
+            )
+            if TURN_DISPATCH == 'queue':
+                get_turn_queue().send(make_turn_job(
+                    session_id=session_id,
+                    connection_id=connection_id,
+                    message=event_body,
+                    endpoint_url=api_gateway_management_client.meta.endpoint_url
+                ))
+                logger.info("Turn queued")
+            elif session_manager.TURN_PIPELINE == 'async':
+                async_runtime.run(session_manager.add_entry_async(**entry_kwargs))
+            else:
+                session_manager.add_entry(**entry_kwargs)
     except Exception as e:
         logger.exception("Error adding entry", error=str(e), event_body=event_body)
         status_code = 500